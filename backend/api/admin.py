@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, DeviceGroup, DeviceGroupMember, ExportedFile
+from .models import (
+    CustomUser, DeviceGroup, DeviceGroupMember, ExportedFile, ExportJob, ScheduledExport,
+    THReading, VOCReading, IngestionWatermark, SensorRollup
+)
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
@@ -38,4 +41,36 @@ class ExportedFileAdmin(admin.ModelAdmin):
     list_display = ('filename', 'file_type', 'device_id', 'pollutant', 'created_by', 'created_at', 'expires_at')
     list_filter = ('file_type', 'created_at')
     search_fields = ('filename', 'device_id', 'pollutant')
-    readonly_fields = ('created_at',)
\ No newline at end of file
+    readonly_fields = ('created_at',)
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'file_format', 'status', 'rows_written', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('created_at', 'started_at', 'heartbeat_at', 'finished_at')
+
+@admin.register(ScheduledExport)
+class ScheduledExportAdmin(admin.ModelAdmin):
+    list_display = ('name', 'schedule', 'device_type', 'file_format', 'enabled', 'next_run_at', 'last_status', 'last_duration_seconds')
+    list_filter = ('enabled', 'device_type', 'last_status')
+    search_fields = ('name',)
+    readonly_fields = ('created_at', 'last_run_at', 'last_status', 'last_duration_seconds', 'last_exported_file')
+
+@admin.register(THReading, VOCReading)
+class SensorReadingAdmin(admin.ModelAdmin):
+    list_display = ('site_name', 'reported_time', 'received_time')
+    list_filter = ('site_name',)
+    search_fields = ('site_name',)
+    date_hierarchy = 'reported_time'
+
+@admin.register(IngestionWatermark)
+class IngestionWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('site_name', 'device_type', 'covered_from', 'covered_until', 'updated_at')
+    list_filter = ('device_type',)
+    search_fields = ('site_name',)
+
+@admin.register(SensorRollup)
+class SensorRollupAdmin(admin.ModelAdmin):
+    list_display = ('site_name', 'pollutant', 'resolution', 'bucket_start', 'count', 'mean_value')
+    list_filter = ('resolution', 'pollutant')
+    search_fields = ('site_name',)
@@ -0,0 +1,254 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+
+_MISSING = object()
+
+# Local tiers by LOCATION: Django creates a cache instance per thread, but the threads
+# of a worker process should share one LRU and one set of counters
+_local_stores = {}
+_local_stores_lock = threading.Lock()
+
+class _LocalStore:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {}
+
+class TwoLevelCache(BaseCache):
+    """
+    Small in-process LRU in front of a shared cache every worker can see
+    The shared tier is another configured cache alias (Redis or file based), so one
+    upstream fetch serves all gunicorn workers while hot keys stay in local memory.
+    Local entries are kept for at most LOCAL_TTL seconds, which bounds how long a
+    worker can serve a value another worker has since replaced or deleted.
+
+    LOCATION names the local tier; instances with the same LOCATION share it.
+
+    OPTIONS:
+        SHARED_ALIAS: cache alias of the shared tier (default 'shared')
+        LOCAL_MAX_BYTES: pickled size budget of the local LRU (default 16 MB)
+        LOCAL_TTL: seconds a local copy is trusted (default 5)
+        NAMESPACE_TTLS: default timeout per key namespace, the text before the first ':'
+    """
+
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        super().__init__(params)
+        self._shared_alias = options.get('SHARED_ALIAS', 'shared')
+        self._max_bytes = int(options.get('LOCAL_MAX_BYTES', 16 * 1024 * 1024))
+        self._local_ttl = float(options.get('LOCAL_TTL', 5))
+        self._namespace_ttls = dict(options.get('NAMESPACE_TTLS', {}))
+        with _local_stores_lock:
+            store = _local_stores.setdefault(location or 'default', _LocalStore())
+        self._local = store.entries
+        self._lock = store.lock
+        self._stats = store.stats
+        self._store = store
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    @staticmethod
+    def namespace(key):
+        return str(key).split(':', 1)[0]
+
+    def _count(self, key, outcome):
+        with self._lock:
+            counters = self._stats.setdefault(
+                self.namespace(key), {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'sets': 0}
+            )
+            counters[outcome] += 1
+
+    def _timeout(self, key, timeout):
+        """Resolve DEFAULT_TIMEOUT to the namespace's TTL when one is configured"""
+        if timeout is DEFAULT_TIMEOUT:
+            return self._namespace_ttls.get(self.namespace(key), DEFAULT_TIMEOUT)
+        return timeout
+
+    # Local LRU, always called with the full (prefixed, versioned) key
+
+    def _local_get(self, full_key):
+        with self._lock:
+            entry = self._local.get(full_key)
+            if entry is None:
+                return _MISSING
+            expires, payload = entry
+            if expires <= time.monotonic():
+                self._local_pop(full_key)
+                return _MISSING
+            self._local.move_to_end(full_key)
+        return pickle.loads(payload)
+
+    def _local_set(self, full_key, value, timeout):
+        expiry = self.get_backend_timeout(timeout)
+        lifetime = self._local_ttl if expiry is None else min(self._local_ttl, expiry - time.time())
+        if lifetime <= 0:
+            self._local_delete(full_key)
+            return
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local_pop(full_key)
+            if len(payload) > self._max_bytes:
+                return
+            self._local[full_key] = (time.monotonic() + lifetime, payload)
+            self._store.size += len(payload)
+            while self._store.size > self._max_bytes:
+                self._store.size -= len(self._local.popitem(last=False)[1][1])
+
+    def _local_pop(self, full_key):
+        entry = self._local.pop(full_key, None)
+        if entry is not None:
+            self._store.size -= len(entry[1])
+
+    def _local_delete(self, full_key):
+        with self._lock:
+            self._local_pop(full_key)
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        value = self._local_get(full_key)
+        if value is not _MISSING:
+            self._count(key, 'local_hits')
+            return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._count(key, 'misses')
+            return default
+        self._count(key, 'shared_hits')
+        self._local_set(full_key, value, self._local_ttl)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remaining = []
+        for key in keys:
+            value = self._local_get(self.make_and_validate_key(key, version=version))
+            if value is _MISSING:
+                remaining.append(key)
+            else:
+                self._count(key, 'local_hits')
+                found[key] = value
+
+        shared = self.shared.get_many(remaining, version=version) if remaining else {}
+        for key in remaining:
+            if key in shared:
+                self._count(key, 'shared_hits')
+                found[key] = shared[key]
+                self._local_set(self.make_and_validate_key(key, version=version), shared[key], self._local_ttl)
+            else:
+                self._count(key, 'misses')
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        timeout = self._timeout(key, timeout)
+        self.shared.set(key, value, timeout=timeout, version=version)
+        self._local_set(full_key, value, timeout)
+        self._count(key, 'sets')
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        by_timeout = {}
+        for key, value in data.items():
+            by_timeout.setdefault(self._timeout(key, timeout), {})[key] = value
+        failed = []
+        for key_timeout, group in by_timeout.items():
+            failed += self.shared.set_many(group, timeout=key_timeout, version=version)
+            for key, value in group.items():
+                self._local_set(self.make_and_validate_key(key, version=version), value, key_timeout)
+                self._count(key, 'sets')
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Atomic only as far as the shared tier's add is (Redis yes, file based no)"""
+        full_key = self.make_and_validate_key(key, version=version)
+        timeout = self._timeout(key, timeout)
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._local_set(full_key, value, timeout)
+            self._count(key, 'sets')
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.touch(key, timeout=self._timeout(key, timeout), version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        if self._local_get(self.make_and_validate_key(key, version=version)) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local_delete(self.make_and_validate_key(key, version=version))
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            self._store.size = 0
+        self.shared.clear()
+
+    def stats(self):
+        """Hit/miss counters per namespace for this worker, plus local LRU usage"""
+        with self._lock:
+            namespaces = {name: dict(counters) for name, counters in self._stats.items()}
+            entries, size = len(self._local), self._store.size
+        for counters in namespaces.values():
+            lookups = counters['local_hits'] + counters['shared_hits'] + counters['misses']
+            counters['hit_ratio'] = (counters['local_hits'] + counters['shared_hits']) / lookups if lookups else None
+        return {
+            'local_entries': entries,
+            'local_bytes': size,
+            'local_max_bytes': self._max_bytes,
+            'namespaces': namespaces,
+        }
+
+
+# Writes since the last size check, by directory: like the local tiers above, these must
+# be shared by the per-thread instances Django creates
+_cull_counters = {}
+_cull_counters_lock = threading.Lock()
+
+class CullingFileCache(FileBasedCache):
+    """
+    File based cache that checks its size every CULL_EVERY writes instead of on each one
+    Django's file cache lists the whole directory before every set to decide whether to
+    cull, which dominates write cost once it holds thousands of entries. The directory
+    can overshoot MAX_ENTRIES by up to CULL_EVERY writes per worker process in between;
+    the count is kept per process and directory, across all threads' cache instances.
+
+    OPTIONS (besides FileBasedCache's):
+        CULL_EVERY: writes between size checks (default 100)
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        options = params.get('OPTIONS', {})
+        self._cull_every = max(int(options.get('CULL_EVERY', 100)), 1)
+        with _cull_counters_lock:
+            self._counter = _cull_counters.setdefault(self._dir, [0])
+
+    def _cull(self):
+        with _cull_counters_lock:
+            self._counter[0] += 1
+            if self._counter[0] < self._cull_every:
+                return
+            self._counter[0] = 0
+        super()._cull()
@@ -0,0 +1,334 @@
+import time
+import bisect
+import calendar
+import hashlib
+import json
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.cache import cache
+from .flight_services import across_workers, flight_key
+
+logger = logging.getLogger(__name__)
+
+# Timestamp format used by the sensor API for ReportedTimeUTC
+SENSOR_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+DAY_SECONDS = 86400
+
+# Beyond this many separate gaps, fetch one span covering all of them
+MAX_SEGMENT_FETCHES = 3
+
+# How the sensor data behind the current request was obtained, most degraded first
+FRESHNESS_LEVELS = ('synthetic', 'stale', 'fresh')
+
+# Set of freshness marks for the request being served, installed by DataFreshnessMiddleware
+_data_marks = contextvars.ContextVar('data_marks', default=None)
+
+# Keys with a background revalidation running in this process
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+def to_epoch(dt):
+    """Convert a naive UTC datetime to epoch seconds"""
+    return calendar.timegm(dt.timetuple())
+
+def from_epoch(epoch):
+    """Convert epoch seconds to a naive UTC datetime"""
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).replace(tzinfo=None)
+
+def utc_now_epoch():
+    return int(datetime.now(timezone.utc).timestamp())
+
+def start_freshness_tracking():
+    """Begin collecting freshness marks for a request; returns a token for stop_freshness_tracking"""
+    return _data_marks.set(set())
+
+def current_freshness():
+    """Most degraded freshness marked so far in this request, or None if no sensor data was used"""
+    marks = _data_marks.get() or set()
+    for level in FRESHNESS_LEVELS:
+        if level in marks:
+            return level
+    return None
+
+def stop_freshness_tracking(token):
+    """Stop collecting and return the request's overall freshness"""
+    freshness = current_freshness()
+    _data_marks.reset(token)
+    return freshness
+
+def mark_data(level):
+    """Record that sensor data served by the current request is fresh, stale or synthetic"""
+    marks = _data_marks.get()
+    if marks is not None:
+        marks.add(level)
+
+def _store_revalidated(key, data, fresh_seconds, stale_seconds):
+    cache.set(key, {'data': data, 'fresh_until': time.time() + fresh_seconds}, fresh_seconds + stale_seconds)
+
+def _shared_tier():
+    """The cache tier other workers write to, bypassing this worker's short-lived local copies"""
+    return getattr(cache, 'shared', cache)
+
+def _fresh_revalidated(key):
+    entry = _shared_tier().get(key)
+    if entry is not None and time.time() < entry['fresh_until']:
+        return entry['data']
+    return None
+
+def _fetch_revalidated(key, fetch, fresh_seconds, stale_seconds):
+    """Fetch and store a get_or_revalidate entry, unless another worker stores it meanwhile"""
+    def fetch_and_store():
+        data = fetch()
+        if data is not None:
+            _store_revalidated(key, data, fresh_seconds, stale_seconds)
+        return data
+    return across_workers(flight_key(key), fetch_and_store, lambda: _fresh_revalidated(key))
+
+def _revalidate(key, fetch, fresh_seconds, stale_seconds):
+    try:
+        _fetch_revalidated(key, fetch, fresh_seconds, stale_seconds)
+    except Exception as e:
+        logger.warning(f"Background refresh of {key} failed: {str(e)}")
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(key)
+
+def seconds_until_stale(key):
+    """Seconds before a get_or_revalidate entry goes stale, 0 if it is stale or missing"""
+    entry = cache.get(key)
+    if entry is None:
+        return 0
+    return max(entry['fresh_until'] - time.time(), 0)
+
+def get_or_revalidate(key, fetch, fresh_seconds, stale_seconds, refresh=False):
+    """
+    Serve a cached value, refreshing it in the background once it is older than fresh_seconds
+    fetch: callable returning the value, or None on failure; failures are never cached
+    A stale value is served for up to stale_seconds more while the refresh runs, so
+    callers only wait on the upstream when nothing usable is cached. Returns None if
+    nothing is cached and the fetch fails. refresh=True fetches now whatever is cached,
+    falling back to the cached value if the fetch fails.
+    """
+    entry = cache.get(key)
+    if refresh:
+        data = fetch()
+        if data is not None:
+            _store_revalidated(key, data, fresh_seconds, stale_seconds)
+            mark_data('fresh')
+            return data
+        if entry is None:
+            return None
+        mark_data('stale')
+        return entry['data']
+
+    if entry is not None:
+        if time.time() < entry['fresh_until']:
+            mark_data('fresh')
+            return entry['data']
+        with _revalidating_lock:
+            start = key not in _revalidating
+            _revalidating.add(key)
+        if start:
+            threading.Thread(
+                target=_revalidate, args=(key, fetch, fresh_seconds, stale_seconds), daemon=True
+            ).start()
+        mark_data('stale')
+        return entry['data']
+
+    data = _fetch_revalidated(key, fetch, fresh_seconds, stale_seconds)
+    if data is not None:
+        mark_data('fresh')
+    return data
+
+def segment_cache_key(endpoint, site_name, unit_start, unit_size):
+    return f"sensor_segment:{endpoint}:{site_name or 'all'}:{unit_size}:{unit_start}"
+
+def segment_ttl(bucket_start, bucket_size, now_epoch=None):
+    """Closed historical buckets live long, the trailing live bucket briefly"""
+    now_epoch = now_epoch if now_epoch is not None else utc_now_epoch()
+    if bucket_start + bucket_size <= now_epoch - settings.SENSOR_SEGMENT_SETTLE_SECONDS:
+        return settings.SENSOR_SEGMENT_CLOSED_TTL
+    return settings.SENSOR_SEGMENT_LIVE_TTL
+
+def chart_cache_key(start_time, end_time, **params):
+    """
+    Key for a rendered chart response, from its canonical request parameters
+    Windows reaching the live edge end at "now", a different second on every request,
+    so their times are floored to SENSOR_CHART_CACHE_LIVE_TTL steps: requests within
+    one step share the entry, which is never served for longer than that anyway.
+    """
+    if chart_result_ttl(end_time) == settings.SENSOR_CHART_CACHE_LIVE_TTL:
+        step = max(settings.SENSOR_CHART_CACHE_LIVE_TTL, 1)
+        start_time = from_epoch(to_epoch(start_time) // step * step)
+        end_time = from_epoch(to_epoch(end_time) // step * step)
+    params.update(start_time=start_time, end_time=end_time)
+    canonical = json.dumps(params, sort_keys=True, default=str)
+    return f"sensor_chart:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+def chart_result_ttl(end_time, now_epoch=None):
+    """Charts of settled history live long, charts that reach the live edge briefly"""
+    now_epoch = now_epoch if now_epoch is not None else utc_now_epoch()
+    if to_epoch(end_time) < now_epoch - settings.SENSOR_SEGMENT_SETTLE_SECONDS:
+        return settings.SENSOR_CHART_CACHE_CLOSED_TTL
+    return settings.SENSOR_CHART_CACHE_LIVE_TTL
+
+def get_chart_result(key):
+    """Return the cached (resolution, payload bytes) for a chart, or None"""
+    result = cache.get(key)
+    if result is not None:
+        mark_data('fresh')
+    return result
+
+def set_chart_result(key, resolution, payload, end_time):
+    """Cache a rendered chart unless it is too big to be worth a cache slot or not built from fresh data"""
+    if current_freshness() not in (None, 'fresh'):
+        return
+    if len(payload) > settings.SENSOR_CHART_CACHE_MAX_BYTES:
+        logger.debug(f"Not caching {key}: {len(payload)} bytes")
+        return
+    cache.set(key, (resolution, payload), chart_result_ttl(end_time))
+
+def segment_units(start_epoch, end_epoch, bucket_size, now_epoch):
+    """
+    (start, size) cache units covering [start_epoch, end_epoch]
+    Days that have fully settled are cached as one unit each and only the unsettled
+    tail is split into bucket_size units, so a cold month costs about 30 cache writes.
+    """
+    cutoff = now_epoch - settings.SENSOR_SEGMENT_SETTLE_SECONDS
+    tail_start = cutoff - cutoff % DAY_SECONDS if DAY_SECONDS % bucket_size == 0 else start_epoch
+    units = []
+    position = start_epoch
+    while position <= end_epoch:
+        size = DAY_SECONDS if position < tail_start else bucket_size
+        unit_start = position - position % size
+        units.append((unit_start, size))
+        position = unit_start + size
+    return units
+
+def _missing_runs(missing):
+    """Group missing (start, size) units into contiguous (start, end) spans"""
+    runs = []
+    for unit_start, size in missing:
+        if runs and runs[-1][1] == unit_start:
+            runs[-1][1] = unit_start + size
+        else:
+            runs.append([unit_start, unit_start + size])
+    if len(runs) > MAX_SEGMENT_FETCHES:
+        runs = [[runs[0][0], runs[-1][1]]]
+    return runs
+
+def _split_into_units(rows, units):
+    """Assign upstream rows to the given units by ReportedTimeUTC, sorted within each unit"""
+    split = {unit: [] for unit in units}
+    starts = [unit[0] for unit in units]
+    for row in rows:
+        try:
+            reported = datetime.fromisoformat(row.get('ReportedTimeUTC', ''))
+        except (TypeError, ValueError):
+            logger.debug(f"Dropping row without a usable ReportedTimeUTC: {row}")
+            continue
+        epoch = to_epoch(reported)
+        index = bisect.bisect_right(starts, epoch) - 1
+        if index >= 0 and epoch < starts[index] + units[index][1]:
+            split[units[index]].append(row)
+    for unit_rows in split.values():
+        unit_rows.sort(key=lambda row: row['ReportedTimeUTC'])
+    return split
+
+def _fresh_segments(keys, units, now_epoch):
+    """Rows of the units whose segments are fresh in the shared tier"""
+    cached = _shared_tier().get_many([keys[unit] for unit in units])
+    found = {}
+    for unit in units:
+        entry = cached.get(keys[unit])
+        if entry is not None and entry[0] > now_epoch:
+            found[unit] = entry[1]
+    return found
+
+def get_segmented_window(endpoint, site_name, start_time, end_time, fetch):
+    """
+    Serve a [start_time, end_time] window from cached time segments
+    fetch: callable(start, end) returning a list of rows, or None on upstream failure
+    Only the segments missing from the cache are requested upstream, and they are
+    written back in one set_many per TTL.
+    """
+    bucket_size = settings.SENSOR_SEGMENT_BUCKET_SECONDS
+    if bucket_size <= 0:
+        return fetch(start_time, end_time)
+
+    now_epoch = utc_now_epoch()
+    units = segment_units(to_epoch(start_time), to_epoch(end_time), bucket_size, now_epoch)
+    keys = {unit: segment_cache_key(endpoint, site_name, *unit) for unit in units}
+
+    # Segments are cached as (fresh_until, rows) and kept SENSOR_CACHE_STALE_SECONDS past
+    # fresh_until, so an expired segment can stand in when the upstream cannot be reached
+    cached = cache.get_many(list(keys.values()))
+    segments = {}
+    stale = {}
+    for unit, key in keys.items():
+        if key in cached:
+            fresh_until, rows = cached[key]
+            if fresh_until > now_epoch:
+                segments[unit] = rows
+            else:
+                stale[unit] = rows
+    missing = [unit for unit in units if unit not in segments]
+
+    writes = {}
+    for run_start, run_end in _missing_runs(missing):
+        run_units = [unit for unit in missing if run_start <= unit[0] < run_end]
+
+        shared = {}
+
+        def lookup(run_units=run_units, shared=shared):
+            # Another worker held the lock for this run; use the segments it cached
+            found = _fresh_segments(keys, run_units, now_epoch)
+            if len(found) < len(run_units):
+                return None
+            shared.update(found)
+            return found
+
+        rows = across_workers(
+            flight_key(endpoint, {'site_name': site_name, 'start': run_start, 'end': run_end}),
+            lambda: fetch(from_epoch(run_start), from_epoch(run_end - 1)),
+            lookup
+        )
+        if shared:
+            segments.update(shared)
+            continue
+        if rows is None:
+            if not all(unit in stale for unit in run_units):
+                return None
+            for unit in run_units:
+                segments[unit] = stale[unit]
+            mark_data('stale')
+            continue
+        if isinstance(rows, dict):
+            rows = [rows]
+
+        for unit, unit_rows in _split_into_units(rows, run_units).items():
+            segments[unit] = unit_rows
+            ttl = segment_ttl(unit[0], unit[1], now_epoch)
+            writes.setdefault(ttl, {})[keys[unit]] = (now_epoch + ttl, unit_rows)
+    for ttl, entries in writes.items():
+        cache.set_many(entries, ttl + settings.SENSOR_CACHE_STALE_SECONDS)
+    mark_data('fresh')
+
+    logger.debug(
+        f"Segment cache {endpoint} {site_name}: {len(units) - len(missing)} hit, "
+        f"{len(missing)} missed"
+    )
+
+    # ReportedTimeUTC sorts lexically, so the window edges can be compared as strings
+    lower = start_time.strftime(SENSOR_TIME_FORMAT)
+    upper = end_time.strftime(SENSOR_TIME_FORMAT)
+    return [
+        row
+        for unit in units
+        for row in segments[unit]
+        if lower <= row['ReportedTimeUTC'] <= upper
+    ]
@@ -0,0 +1,389 @@
+import calendar
+import math
+import logging
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the pure-Python engine is used without it
+    np = None
+
+logger = logging.getLogger(__name__)
+
+def _to_epoch(timestamp):
+    """Convert a 'YYYY-MM-DD HH:MM:SS' string or datetime to UTC epoch seconds"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+    return calendar.timegm(timestamp.timetuple())
+
+def _lttb_indices_python(x, y, threshold):
+    """Pure-Python LTTB over parallel lists of x and y values"""
+    n = len(x)
+
+    # Calculate the size of each bucket
+    every = (n - 2) / (threshold - 2)
+
+    # Initialize the sample with the first point
+    sampled_indices = [0]
+    a = 0
+
+    for i in range(0, threshold - 2):
+        # Calculate the bucket range
+        avg_range_start = int((i + 1) * every) + 1
+        avg_range_end = int((i + 2) * every) + 1
+        avg_range_end = min(avg_range_end, n)
+
+        avg_range_length = avg_range_end - avg_range_start
+
+        # Calculate the average point in the next bucket
+        avg_x = 0.0
+        avg_y = 0.0
+        for j in range(avg_range_start, avg_range_end):
+            avg_x += x[j]
+            avg_y += y[j]
+        avg_x /= avg_range_length
+        avg_y /= avg_range_length
+
+        # Get the range of the current bucket
+        range_offs = int(math.floor((i + 0) * every)) + 1
+        range_to = int(math.floor((i + 1) * every)) + 1
+        range_to = min(range_to, n)
+
+        # Point a
+        point_ax = x[a]
+        point_ay = y[a]
+
+        max_area = -1
+        max_index = -1
+
+        for j in range(range_offs, range_to):
+            # Calculate the area of the triangle
+            area = abs(
+                (point_ax - avg_x) * (y[j] - point_ay) -
+                (point_ax - x[j]) * (avg_y - point_ay)
+            ) * 0.5
+
+            if area > max_area:
+                max_area = area
+                max_index = j
+
+        sampled_indices.append(max_index)
+        a = max_index
+
+    # Add the last point
+    sampled_indices.append(n - 1)
+    return sampled_indices
+
+def _lttb_indices_numpy(x, y, threshold):
+    """Vectorized LTTB over NumPy arrays, selecting the same indices as the Python engine"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    every = (n - 2) / (threshold - 2)
+
+    # Bucket boundaries for every bucket at once
+    i = np.arange(threshold - 2)
+    avg_start = ((i + 1) * every).astype(np.int64) + 1
+    avg_end = np.minimum(((i + 2) * every).astype(np.int64) + 1, n)
+    range_offs = np.floor(i * every).astype(np.int64) + 1
+    range_to = np.minimum(np.floor((i + 1) * every).astype(np.int64) + 1, n)
+
+    # Next-bucket averages: the average ranges are contiguous, so one reduceat covers them
+    lengths = avg_end - avg_start
+    avg_x = np.add.reduceat(x, avg_start) / lengths
+    avg_y = np.add.reduceat(y, avg_start) / lengths
+
+    # Only the choice of point a is sequential; each bucket's area search is vectorized
+    sampled_indices = [0]
+    a = 0
+    for k in range(threshold - 2):
+        lo = range_offs[k]
+        hi = range_to[k]
+        point_ax = x[a]
+        point_ay = y[a]
+        areas = np.abs(
+            (point_ax - avg_x[k]) * (y[lo:hi] - point_ay) -
+            (point_ax - x[lo:hi]) * (avg_y[k] - point_ay)
+        )
+        a = int(lo + np.argmax(areas))
+        sampled_indices.append(a)
+
+    sampled_indices.append(n - 1)
+    return sampled_indices
+
+def lttb_indices(x, y, threshold, use_numpy=True):
+    """
+    Return the indices selected by LTTB for parallel x (epoch seconds) and y sequences
+    Uses the NumPy engine when available unless use_numpy is False.
+    """
+    n = len(x)
+    if threshold >= n or threshold == 0:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][:threshold]
+
+    if use_numpy and np is not None:
+        return _lttb_indices_numpy(x, y, threshold)
+    return _lttb_indices_python(x, y, threshold)
+
+def _envelope_indices_python(x, y, buckets, keep_edges):
+    """Single-pass per-bucket envelope over equal-width time buckets"""
+    n = len(x)
+    order = list(range(n))
+    if any(x[i] > x[i + 1] for i in range(n - 1)):
+        order.sort(key=lambda i: x[i])
+
+    x0 = x[order[0]]
+    span = x[order[-1]] - x0
+    scale = buckets / span if span > 0 else 0
+
+    selected = set()
+    current = None
+    for position, i in enumerate(order):
+        bucket = min(int((x[i] - x0) * scale), buckets - 1) if span > 0 else position * buckets // n
+        if bucket != current:
+            if current is not None:
+                selected.update((min_index, max_index))
+                if keep_edges:
+                    selected.update((first_index, last_index))
+            current = bucket
+            first_index = min_index = max_index = i
+        if y[i] < y[min_index]:
+            min_index = i
+        if y[i] > y[max_index]:
+            max_index = i
+        last_index = i
+
+    selected.update((min_index, max_index))
+    if keep_edges:
+        selected.update((first_index, last_index))
+    return sorted(selected)
+
+def _first_match(mask, starts, ends):
+    """First index in each [start, end) segment where mask is set, else the segment start"""
+    positions = np.flatnonzero(mask)
+    if not len(positions):
+        return starts
+    found = positions[np.minimum(np.searchsorted(positions, starts), len(positions) - 1)]
+    return np.where((found >= starts) & (found < ends), found, starts)
+
+def _envelope_indices_numpy(x, y, buckets, keep_edges):
+    """Vectorized per-bucket envelope, selecting the same indices as the Python engine"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+
+    order = None
+    if np.any(x[1:] < x[:-1]):
+        order = np.argsort(x, kind='stable')
+        x = x[order]
+        y = y[order]
+
+    span = x[-1] - x[0]
+    if span > 0:
+        bucket_ids = np.minimum(((x - x[0]) * (buckets / span)).astype(np.int64), buckets - 1)
+    else:
+        bucket_ids = np.arange(n) * buckets // n
+
+    # Buckets are contiguous runs of equal ids in time order
+    starts = np.flatnonzero(np.concatenate(([True], bucket_ids[1:] != bucket_ids[:-1])))
+    ends = np.concatenate((starts[1:], [n]))
+    counts = ends - starts
+    mins = np.repeat(np.fmin.reduceat(y, starts), counts)
+    maxs = np.repeat(np.fmax.reduceat(y, starts), counts)
+
+    parts = [_first_match(y == mins, starts, ends), _first_match(y == maxs, starts, ends)]
+    if keep_edges:
+        parts.extend((starts, ends - 1))
+    selected = np.unique(np.concatenate(parts))
+    if order is not None:
+        selected = np.sort(order[selected])
+    return selected.tolist()
+
+def envelope_indices(x, y, max_points, algorithm='m4', use_numpy=True):
+    """
+    Return the indices of the per-bucket envelope over equal-width time buckets
+    'm4' keeps the first/min/max/last point of each bucket, 'minmax' the min/max.
+    Both are a single O(n) pass and never return more than max_points indices.
+    """
+    n = len(x)
+    if n <= max_points or max_points == 0:
+        return list(range(n))
+
+    buckets = max_points // (4 if algorithm == 'm4' else 2)
+    if buckets < 1:
+        return simple_indices(n, max_points)
+
+    if use_numpy and np is not None:
+        return _envelope_indices_numpy(x, y, buckets, algorithm == 'm4')
+    return _envelope_indices_python(x, y, buckets, algorithm == 'm4')
+
+def _timestamps_to_epoch(timestamps, use_numpy=True):
+    """Convert timestamps to epoch seconds, vectorized when NumPy is available"""
+    if use_numpy and np is not None and timestamps and isinstance(timestamps[0], str):
+        try:
+            parsed = np.array(timestamps, dtype='datetime64[s]')
+        except ValueError:
+            parsed = None
+        # Empty strings parse as NaT, let strict per-item parsing reject them
+        if parsed is not None and not np.isnat(parsed).any():
+            return parsed.astype(np.int64).astype(np.float64)
+    return [_to_epoch(timestamp) for timestamp in timestamps]
+
+# Algorithms that downsample on timestamps and values; anything else uses a stride
+TIME_SERIES_ALGORITHMS = ('lttb', 'm4', 'minmax')
+ALGORITHMS = TIME_SERIES_ALGORITHMS + ('simple',)
+
+# Value columns provided by each sensor API endpoint
+TH_COLUMNS = ['Temperature', 'Humidity', 'Noise', 'PM2_5', 'PM10', 'Illumination']
+VOC_COLUMNS = ['VOC', 'O3', 'SO2', 'NO2']
+
+def _timestamp(record):
+    return record['timestamp']
+
+def _value(record):
+    return record['value']
+
+def reported_time(record):
+    """Timestamp key for raw sensor API rows"""
+    return record.get('ReportedTimeUTC', '')
+
+def simple_indices(n, max_points=500):
+    """Stride-based indices for non-time-series data"""
+    if n <= max_points:
+        return list(range(n))
+    return list(range(0, n, math.ceil(n / max_points)))
+
+def downsample_indices(records, max_points=500, algorithm='lttb',
+                       timestamp_key=_timestamp, value_key=_value, use_numpy=True):
+    """
+    Return the indices of the records to keep, in order
+    timestamp_key / value_key: callables extracting the x and y of each record,
+    so rows can be selected from the original records without building a copy
+    """
+    n = len(records)
+    if n <= max_points or max_points == 0:
+        return list(range(n))
+
+    if algorithm not in TIME_SERIES_ALGORITHMS:
+        return simple_indices(n, max_points)
+
+    try:
+        x = _timestamps_to_epoch([timestamp_key(record) for record in records], use_numpy)
+    except (ValueError, TypeError, KeyError) as e:
+        logger.error(f"Error processing data for {algorithm}: {str(e)}")
+        return simple_indices(n, max_points)
+
+    return _column_indices(records, x, max_points, value_key, algorithm, use_numpy)
+
+def _column_indices(records, x, max_points, value_key, algorithm='lttb', use_numpy=True):
+    """Indices for one value column against already parsed timestamps"""
+    try:
+        y = [float(value_key(record)) for record in records]
+    except (ValueError, TypeError, KeyError) as e:
+        logger.error(f"Error processing data for {algorithm}: {str(e)}")
+        return simple_indices(len(records), max_points)
+
+    if algorithm == 'lttb':
+        return lttb_indices(x, y, max_points, use_numpy=use_numpy)
+    return envelope_indices(x, y, max_points, algorithm, use_numpy=use_numpy)
+
+def multi_channel_indices(records, max_points, columns, algorithm='lttb',
+                          timestamp_key=reported_time, use_numpy=True):
+    """
+    Return indices preserving the shape of every requested column
+    Each column is downsampled over the same bucket layout and the per-bucket
+    picks are unioned, so a spike in any column survives. The result never
+    exceeds max_points.
+    """
+    n = len(records)
+    if n <= max_points or max_points == 0:
+        return list(range(n))
+    if algorithm not in TIME_SERIES_ALGORITHMS or not columns:
+        return simple_indices(n, max_points)
+
+    try:
+        x = _timestamps_to_epoch([timestamp_key(record) for record in records], use_numpy)
+    except (ValueError, TypeError, KeyError) as e:
+        logger.error(f"Error processing data for {algorithm}: {str(e)}")
+        return simple_indices(n, max_points)
+
+    # Share the point budget between columns; LTTB's first and last points are common to all
+    if algorithm == 'lttb':
+        per_column = max(3, (max_points - 2) // len(columns) + 2)
+    else:
+        per_column = max(4, max_points // len(columns))
+    selected = set()
+    for column in columns:
+        selected.update(_column_indices(
+            records, x, per_column, lambda record: record.get(column), algorithm, use_numpy
+        ))
+
+    indices = sorted(selected)
+    if len(indices) > max_points:
+        indices = [indices[i] for i in simple_indices(len(indices), max_points)]
+    return indices
+
+def downsample_records(records, max_points=500, algorithm='lttb',
+                       timestamp_key=reported_time, value_key=_value):
+    """Downsample raw sensor rows in place of a transformed copy, keeping whole rows"""
+    indices = downsample_indices(records, max_points, algorithm, timestamp_key, value_key)
+    return [records[i] for i in indices]
+
+def downsample_records_multi(records, max_points, columns, algorithm='lttb',
+                             timestamp_key=reported_time):
+    """Downsample raw sensor rows keeping the extremes of every requested column"""
+    indices = multi_channel_indices(records, max_points, columns, algorithm, timestamp_key)
+    return [records[i] for i in indices]
+
+def parse_columns(raw, allowed):
+    """
+    Parse a comma-separated columns parameter against the columns an endpoint provides
+    'all' selects every column. Raises ValueError for unknown columns.
+    """
+    if not raw:
+        return []
+    if raw.strip().lower() == 'all':
+        return list(allowed)
+    columns = [column.strip() for column in raw.split(',') if column.strip()]
+    invalid = [column for column in columns if column not in allowed]
+    if invalid:
+        raise ValueError(f"Invalid columns: {', '.join(invalid)}. Allowed: {', '.join(allowed)}")
+    return columns
+
+# LTTB Algorithm Implementation
+def largest_triangle_three_buckets(data, threshold, use_numpy=True):
+    """
+    Implement the Largest Triangle Three Buckets (LTTB) downsampling algorithm
+    data: list of dictionaries with 'timestamp' and 'value' keys
+    threshold: maximum number of points to return
+    """
+    if len(data) <= threshold or threshold == 0:
+        return data
+
+    return [data[i] for i in downsample_indices(data, threshold, 'lttb', use_numpy=use_numpy)]
+
+def downsample_data_simple(data, max_points=500):
+    """Simple downsampling for non-time-series data"""
+    if len(data) <= max_points:
+        return data
+
+    return [data[i] for i in simple_indices(len(data), max_points)]
+
+def downsample_data(data, max_points=500, algorithm='lttb'):
+    """
+    Downsample data using the specified algorithm
+    algorithm: 'lttb', 'm4' or 'minmax' for time-series data, 'simple' for other data
+    """
+    if len(data) <= max_points:
+        return data
+
+    if algorithm in TIME_SERIES_ALGORITHMS:
+        # Check if data has the required structure for time-series downsampling
+        if all('timestamp' in d and 'value' in d for d in data):
+            return [data[i] for i in downsample_indices(data, max_points, algorithm)]
+        else:
+            logger.warning(f"Data structure not suitable for {algorithm}, using simple downsampling")
+            return downsample_data_simple(data, max_points)
+    else:
+        return downsample_data_simple(data, max_points)
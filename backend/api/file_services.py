@@ -1,18 +1,238 @@
 import os
+import io
+import re
 import csv
+import gzip
 import json
+import shutil
+import hashlib
+import zlib
+import zipfile
+import tempfile
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.utils import timezone
-from .models import ExportedFile
+from .models import ExportedFile, THReading, VOCReading
+from .http_services import SensorAPIError
+from .store_services import closing_db_connection
 
-def generate_export_filename(prefix, file_format='csv'):
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Columnar exports are only offered when pyarrow is installed
+    pa = None
+    pq = None
+
+def generate_export_filename(prefix, file_format='csv', compression=None):
     """Generate a unique filename for exports"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    return f"{prefix}_{timestamp}.{file_format}"
+    extension = COMPRESSION_EXTENSIONS[compression] if compression else ''
+    return f"{prefix}_{timestamp}.{file_format}{extension}"
+
+# Content type served for each export format
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+    'zip': 'application/zip',
+}
+
+# Columnar formats hold typed values: readings as floats and sensor times as UTC timestamps
+NUMERIC_COLUMNS = set(THReading.API_FIELDS) | set(VOCReading.API_FIELDS)
+TIME_COLUMNS = ('ReportedTimeUTC', 'ReceivedTime')
+COLUMNAR_BATCH_ROWS = 10000
+
+def peek_rows(rows):
+    """
+    Pull the first row from an iterable of rows without losing it
+    Returns an iterator over all the rows, or None if there are none.
+    """
+    iterator = iter(rows)
+    try:
+        first = next(iterator)
+    except StopIteration:
+        return None
+    return itertools.chain([first], iterator)
+
+def encode_csv_rows(rows):
+    """Yield CSV text chunks for rows, using the first row's keys as the header"""
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row.keys()), extrasaction='ignore')
+            writer.writeheader()
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+def encode_json_rows(rows):
+    """Yield a JSON array of rows one element at a time"""
+    yield '['
+    separator = '\n'
+    for row in rows:
+        yield separator + json.dumps(row, ensure_ascii=False, default=str)
+        separator = ',\n'
+    yield '\n]\n'
+
+def encode_ndjson_rows(rows):
+    """Yield one JSON document per line"""
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, default=str) + '\n'
+
+ENCODERS = {
+    'csv': encode_csv_rows,
+    'json': encode_json_rows,
+    'ndjson': encode_ndjson_rows,
+}
+
+# Compression applied on top of the text formats, by its file extension
+COMPRESSION_EXTENSIONS = {
+    'gzip': '.gz',
+}
+
+def gzip_chunks(chunks, compresslevel=6):
+    """Gzip a stream of text chunks incrementally, yielding compressed bytes"""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def read_decompressed(file_path, chunk_size=65536):
+    """Yield the decompressed bytes of a gzip export, for clients that cannot accept gzip"""
+    with gzip.open(file_path, 'rb') as export_file:
+        while True:
+            chunk = export_file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+def encode_rows(rows, file_format='csv'):
+    """Yield text chunks encoding rows in the given export format"""
+    return ENCODERS[file_format](rows)
+
+def _to_float(value):
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+def _to_string(value):
+    return None if value is None else str(value)
+
+def arrow_schema(fieldnames):
+    """Arrow schema for export rows with the given keys"""
+    fields = []
+    for name in fieldnames:
+        if name in TIME_COLUMNS:
+            fields.append(pa.field(name, pa.timestamp('s', tz='UTC')))
+        elif name in NUMERIC_COLUMNS:
+            fields.append(pa.field(name, pa.float64()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+def _record_batch(rows, schema):
+    arrays = []
+    for field in schema:
+        if pa.types.is_timestamp(field.type):
+            convert = _to_timestamp
+        elif pa.types.is_floating(field.type):
+            convert = _to_float
+        else:
+            convert = _to_string
+        arrays.append(pa.array([convert(row.get(field.name)) for row in rows], type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _open_columnar_writer(file_path, schema, file_format):
+    compression = settings.EXPORT_COLUMNAR_COMPRESSION
+    if file_format == 'parquet':
+        return pq.ParquetWriter(file_path, schema, compression=compression)
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    return pa.ipc.new_file(file_path, schema, options=options)
+
+def write_columnar_file(rows, file_path, file_format='parquet'):
+    """
+    Write rows to a Parquet or Arrow IPC file in fixed-size record batches
+    The schema comes from the first row's keys, like the CSV header does.
+    """
+    writer = None
+    batch = []
+    try:
+        for row in rows:
+            if writer is None:
+                schema = arrow_schema(row.keys())
+                writer = _open_columnar_writer(file_path, schema, file_format)
+            batch.append(row)
+            if len(batch) >= COLUMNAR_BATCH_ROWS:
+                writer.write_batch(_record_batch(batch, schema))
+                batch = []
+        if writer is None:
+            schema = arrow_schema([])
+            writer = _open_columnar_writer(file_path, schema, file_format)
+        if batch:
+            writer.write_batch(_record_batch(batch, schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+COLUMNAR_FORMATS = ('parquet', 'arrow') if pa is not None else ()
+
+# Formats every export endpoint accepts; only the text ones can be streamed to the client
+STREAMABLE_FORMATS = tuple(ENCODERS)
+EXPORT_FORMATS = STREAMABLE_FORMATS + COLUMNAR_FORMATS
+
+def write_rows(rows, file_path, file_format='csv', compression=None):
+    """Encode rows into file_path and return how many were written"""
+    count = 0
+    
+    def counted():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+    
+    if file_format in COLUMNAR_FORMATS:
+        write_columnar_file(counted(), file_path, file_format)
+    elif compression == 'gzip':
+        with gzip.open(file_path, 'wt', newline='', encoding='utf-8') as export_file:
+            for chunk in encode_rows(counted(), file_format):
+                export_file.write(chunk)
+    else:
+        with open(file_path, 'w', newline='', encoding='utf-8') as export_file:
+            for chunk in encode_rows(counted(), file_format):
+                export_file.write(chunk)
+    return count
+
+def save_data_to_file(data, filename, file_format='csv', directory='', compression=None):
+    """
+    Stream rows to a file on disk in the specified format
+    data can be any iterable of rows, including a generator, so only one
+    chunk or record batch is held in memory at a time. Text formats can be
+    gzip-compressed as they are written. A partially written file is removed.
+    """
+    if file_format not in EXPORT_FORMATS:
+        return None
+    if compression and (compression not in COMPRESSION_EXTENSIONS or file_format not in STREAMABLE_FORMATS):
+        return None
 
-def save_data_to_file(data, filename, file_format='csv', directory=''):
-    """Save data to a file on disk in the specified format"""
     # Create directory if it doesn't exist
     export_dir = os.path.join(settings.EXPORT_ROOT, directory)
     os.makedirs(export_dir, exist_ok=True)
@@ -20,25 +240,158 @@ def save_data_to_file(data, filename, file_format='csv', directory=''):
     file_path = os.path.join(export_dir, filename)
     
     try:
-        if file_format == 'csv':
-            with open(file_path, 'w', newline='', encoding='utf-8') as csvfile:
-                if data and len(data) > 0:
-                    writer = csv.DictWriter(csvfile, fieldnames=data[0].keys())
-                    writer.writeheader()
-                    for item in data:
-                        writer.writerow(item)
-        elif file_format == 'json':
-            with open(file_path, 'w', encoding='utf-8') as jsonfile:
-                json.dump(data, jsonfile, indent=2, ensure_ascii=False, default=str)
-        else:
-            return None
+        write_rows(data, file_path, file_format, compression)
         
         return file_path
     except Exception as e:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        if isinstance(e, SensorAPIError):
+            raise
         print(f"Error saving {file_format} file: {e}")
         return None
 
-def create_export_record(request, file_path, filename, file_type, device_id=None, pollutant=None):
+def save_chunks_to_file(chunks, filename, directory=''):
+    """Write already encoded bytes, such as an archive, to an export file; a partial file is removed"""
+    export_dir = os.path.join(settings.EXPORT_ROOT, directory)
+    os.makedirs(export_dir, exist_ok=True)
+    
+    file_path = os.path.join(export_dir, filename)
+    
+    try:
+        with open(file_path, 'wb') as export_file:
+            for chunk in chunks:
+                export_file.write(chunk)
+        return file_path
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+
+class _ChunkBuffer:
+    """Write-only file object that collects bytes until they are drained into a response"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def partition_filename(name, file_format):
+    """Archive member name for a partition, safe to extract anywhere"""
+    return f"{re.sub(r'[^A-Za-z0-9._-]', '_', name)}.{file_format}"
+
+def write_partitions(partitions, directory, file_format='csv', max_workers=4):
+    """
+    Write each partition's rows to its own file in directory, in parallel
+    partitions: dict of name -> callable returning that partition's rows
+    Yields (name, file_path, rows written) as each partition finishes.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(partitions))))
+    try:
+        futures = {}
+        for name, rows in partitions.items():
+            file_path = os.path.join(directory, partition_filename(name, file_format))
+            futures[executor.submit(closing_db_connection(write_rows), rows(), file_path, file_format)] = (name, file_path)
+        for future in as_completed(futures):
+            name, file_path = futures[future]
+            yield name, file_path, future.result()
+    finally:
+        # Stop queued partitions if a partition failed or the consumer went away
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def iter_partitioned_zip(partitions, file_format='csv', max_workers=4, on_partition=None, chunk_size=65536):
+    """
+    Yield a ZIP archive holding one file per partition, in the order partitions finish
+    Partitions are encoded in parallel to temporary files and copied into the archive
+    a chunk at a time, so it can be streamed to a client or a file without holding
+    it in memory. Empty partitions are left out.
+    on_partition: optional callable(name, rows written) called as each one is added
+    """
+    compression = zipfile.ZIP_STORED if file_format in COLUMNAR_FORMATS else zipfile.ZIP_DEFLATED
+    buffer = _ChunkBuffer()
+    directory = tempfile.mkdtemp(prefix='export_partitions_')
+    try:
+        with zipfile.ZipFile(buffer, 'w', compression=compression) as archive:
+            for name, file_path, count in write_partitions(partitions, directory, file_format, max_workers):
+                if count:
+                    arcname = os.path.basename(file_path)
+                    with open(file_path, 'rb') as source, archive.open(arcname, 'w', force_zip64=True) as entry:
+                        for chunk in iter(lambda: source.read(chunk_size), b''):
+                            entry.write(chunk)
+                            data = buffer.drain()
+                            if data:
+                                yield data
+                os.remove(file_path)
+                if on_partition:
+                    on_partition(name, count)
+        yield buffer.drain()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def file_sha256(file_path, chunk_size=1048576):
+    """Hex SHA-256 of a file's bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as export_file:
+        for chunk in iter(lambda: export_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def ensure_content_hash(exported_file):
+    """Return the export's content hash, computing it for files recorded without one"""
+    if not exported_file.content_hash:
+        exported_file.content_hash = file_sha256(exported_file.file_path)
+        exported_file.save(update_fields=['content_hash'])
+    return exported_file.content_hash
+
+def parse_byte_range(header, size):
+    """
+    Parse a single-range 'bytes=start-end' Range header against a file size
+    Returns (start, end) inclusive, or None when there is no usable range and the
+    whole file should be sent. Raises ValueError when the range is unsatisfiable.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if start:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        elif end:
+            # Suffix range: the last N bytes
+            start = max(size - int(end), 0)
+            end = size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError(f'Range {header} not satisfiable for {size} bytes')
+    return start, end
+
+def read_file_range(file_path, start, end, chunk_size=65536):
+    """Yield the bytes of a file from start to end inclusive"""
+    with open(file_path, 'rb') as export_file:
+        export_file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = export_file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def create_export_record(user, file_path, filename, file_type, device_id=None, pollutant=None,
+                         content_key='', shared=False):
     """Create a record of the exported file in the database"""
     # Set expiration time (e.g., 24 hours from now)
     expires_at = timezone.now() + timedelta(hours=24)
@@ -49,8 +402,11 @@ def create_export_record(request, file_path, filename, file_type, device_id=None
         file_type=file_type,
         device_id=device_id,
         pollutant=pollutant,
-        created_by=request.user,
-        expires_at=expires_at
+        created_by=user,
+        expires_at=expires_at,
+        content_key=content_key,
+        content_hash=file_sha256(file_path),
+        shared=shared
     )
     
     return exported_file
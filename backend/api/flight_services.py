@@ -0,0 +1,111 @@
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds between attempts to take another worker's lock
+POLL_SECONDS = 0.05
+
+class _Flight:
+    """An upstream call in progress in this process, which identical callers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+_flights = {}
+_flights_lock = threading.Lock()
+_counters = {'leaders': 0, 'followers': 0, 'shared_results': 0, 'wait_timeouts': 0}
+
+def _count(name):
+    with _flights_lock:
+        _counters[name] += 1
+
+def flight_key(endpoint, params=None):
+    """Canonical key for an upstream call, independent of parameter order"""
+    canonical = json.dumps([endpoint, params or {}], sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def get_flight_stats():
+    """Report how often upstream calls were coalesced in this worker process"""
+    with _flights_lock:
+        stats = dict(_counters)
+        stats['in_flight'] = len(_flights)
+    return stats
+
+def single_flight(key, fetch):
+    """
+    Run fetch() once for identical concurrent calls in this process and hand every caller its result
+    An exception raised by fetch is re-raised for every caller waiting on it. Other worker
+    processes are coalesced where the result is cached, with across_workers.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        _count('followers')
+        if not flight.done.wait(settings.SENSOR_FLIGHT_WAIT_SECONDS):
+            _count('wait_timeouts')
+            return fetch()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    _count('leaders')
+    try:
+        flight.result = fetch()
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+def across_workers(key, fetch, lookup):
+    """
+    Run fetch() under a lock in the shared cache, so one worker process at a time fetches key
+    lookup: callable returning what the lock holder cached, or None
+    A worker that finds the lock taken waits for it and then calls lookup() to read the
+    cache the holder filled, fetching only if that comes back None. Nothing is published
+    besides the lock. The lock needs an atomic add, so this is a plain fetch() unless
+    SENSOR_FLIGHT_ACROSS_WORKERS is on, which it is by default with Redis.
+    """
+    if not settings.SENSOR_FLIGHT_ACROSS_WORKERS:
+        return fetch()
+
+    lock_key = f"sensor_flight_lock:{key}"
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + settings.SENSOR_FLIGHT_WAIT_SECONDS
+    waited = False
+
+    while not cache.add(lock_key, token, settings.SENSOR_FLIGHT_LOCK_SECONDS):
+        if time.monotonic() >= deadline:
+            # The lock holder is stuck or gone; fetching ourselves beats waiting forever
+            _count('wait_timeouts')
+            logger.warning(f"Gave up waiting for another worker's upstream call {key}")
+            return fetch()
+        waited = True
+        time.sleep(POLL_SECONDS)
+
+    try:
+        if waited:
+            value = lookup()
+            if value is not None:
+                _count('shared_results')
+                return value
+        return fetch()
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
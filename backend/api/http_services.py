@@ -0,0 +1,195 @@
+import time
+import logging
+import threading
+import requests
+from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# One pooled session per worker process, created lazily so that it is
+# never shared across a gunicorn fork.
+_session = None
+_session_lock = threading.Lock()
+_request_count = 0
+_inflight = 0
+_counter_lock = threading.Lock()
+
+class SensorAPIError(Exception):
+    """Raised when data needed mid-stream cannot be fetched from the sensor API"""
+
+class CircuitOpenError(SensorAPIError):
+    """Raised without contacting the sensor API while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Fail fast once the sensor API has failed repeatedly
+    After failure_threshold consecutive failures the circuit opens and calls raise
+    CircuitOpenError immediately. Every reset_seconds a background probe checks the
+    API, closing the circuit on success, so no user request waits on a dead upstream.
+    """
+
+    def __init__(self, failure_threshold, reset_seconds, probe_path):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.probe_path = probe_path
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.times_opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def before_request(self, url):
+        with self._lock:
+            if self.state == 'closed':
+                return
+            self.rejected += 1
+            start_probe = not self.probing and time.monotonic() - self.opened_at >= self.reset_seconds
+            if start_probe:
+                self.probing = True
+        if start_probe:
+            threading.Thread(target=self._probe, args=(urljoin(url, self.probe_path),), daemon=True).start()
+        raise CircuitOpenError('Sensor API circuit is open')
+
+    def record_success(self):
+        with self._lock:
+            if self.state == 'open':
+                logger.info('Sensor API recovered, closing circuit')
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'closed' and self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                logger.warning(f"Sensor API failed {self.failures} times in a row, opening circuit")
+
+    def _probe(self, url):
+        try:
+            response = get_sensor_session().get(url, timeout=get_sensor_timeout())
+            healthy = response.status_code < 500
+        except requests.exceptions.RequestException:
+            healthy = False
+        with self._lock:
+            self.probing = False
+            if not healthy:
+                self.opened_at = time.monotonic()
+        if healthy:
+            self.record_success()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+            }
+
+_breaker = None
+
+def get_circuit_breaker():
+    """Return the per-process circuit breaker guarding sensor API calls"""
+    global _breaker
+    if _breaker is None:
+        with _session_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    settings.SENSOR_BREAKER_FAILURES,
+                    settings.SENSOR_BREAKER_RESET_SECONDS,
+                    settings.SENSOR_BREAKER_PROBE_PATH
+                )
+    return _breaker
+
+def get_sensor_session():
+    """Return the per-process keep-alive session used for sensor API calls"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = settings.SENSOR_API_POOL_SIZE
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+                logger.info(f"Created sensor API session with pool size {pool_size}")
+    return _session
+
+def get_sensor_timeout():
+    """Return the (connect, read) timeout tuple for sensor API calls"""
+    return (settings.SENSOR_API_CONNECT_TIMEOUT, settings.SENSOR_API_READ_TIMEOUT)
+
+def sensor_get(url, params=None):
+    """Issue a GET through the pooled session, failing fast while the circuit is open"""
+    global _request_count, _inflight
+    breaker = get_circuit_breaker()
+    breaker.before_request(url)
+    with _counter_lock:
+        _request_count += 1
+        _inflight += 1
+    try:
+        response = get_sensor_session().get(url, params=params, timeout=get_sensor_timeout())
+    except requests.exceptions.RequestException:
+        breaker.record_failure()
+        raise
+    finally:
+        with _counter_lock:
+            _inflight -= 1
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+def get_inflight_requests():
+    """Number of sensor API calls this process is currently waiting on"""
+    return _inflight
+
+def get_connection_stats():
+    """Report connection reuse counters for the pooled session"""
+    stats = {
+        'requests': _request_count,
+        'in_flight': _inflight,
+        'connections_opened': 0,
+        'connections_reused': 0,
+        'pool_size': settings.SENSOR_API_POOL_SIZE,
+        'connect_timeout': settings.SENSOR_API_CONNECT_TIMEOUT,
+        'read_timeout': settings.SENSOR_API_READ_TIMEOUT,
+        'hosts': {},
+    }
+    if _session is None:
+        return stats
+
+    adapter = _session.get_adapter('http://')
+    pools = adapter.poolmanager.pools
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        reused = max(pool.num_requests - pool.num_connections, 0)
+        stats['hosts'][f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+            'requests': pool.num_requests,
+            'connections_opened': pool.num_connections,
+            'connections_reused': reused,
+        }
+        stats['connections_opened'] += pool.num_connections
+        stats['connections_reused'] += reused
+    return stats
+
+def reset_sensor_session():
+    """Close and drop the pooled session and circuit breaker (used by tests)"""
+    global _session, _breaker, _request_count
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _breaker = None
+    with _counter_lock:
+        _request_count = 0
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import threading
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import ExportJob, ExportedFile, ScheduledExport
+from .http_services import SensorAPIError
+from .cache_services import to_epoch, utc_now_epoch
+from .file_services import (
+    generate_export_filename,
+    save_data_to_file,
+    save_chunks_to_file,
+    create_export_record,
+    iter_partitioned_zip,
+    peek_rows
+)
+
+logger = logging.getLogger(__name__)
+
+# Filename prefix for the files produced by each kind of export job
+EXPORT_PREFIXES = {
+    'th': 'th_export',
+    'voc': 'voc_export',
+    'multi': 'multi_device_export',
+}
+
+# Jobs still to be written; at most one per owner and content key (unique_active_export_job)
+ACTIVE_STATUSES = ('pending', 'running')
+
+# Write progress back to the job row every this many rows
+PROGRESS_EVERY = 1000
+
+# Refresh a running job's heartbeat at least this often while rows are flowing
+HEARTBEAT_SECONDS = 30
+
+def export_content_key(kind, params, file_format='csv', compression=None):
+    """Canonical hash of what an export contains: endpoint, sites, window and format"""
+    canonical = {
+        'kind': kind,
+        'device_type': params.get('device_type'),
+        'sites': sorted(set(params.get('site_names') or [params.get('site_name') or ''])),
+        'layout': params.get('layout') or 'merged',
+        'start_time': params['start_time'],
+        'end_time': params['end_time'],
+        'format': file_format,
+        'compression': compression or '',
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
+
+def window_is_closed(params):
+    """Whether the export window ends before readings could still arrive"""
+    end = to_epoch(datetime.strptime(params['end_time'], '%Y-%m-%d %H:%M:%S'))
+    return end < utc_now_epoch() - settings.SENSOR_SEGMENT_SETTLE_SECONDS
+
+def find_existing_export(user, content_key, shared):
+    """
+    Return (exported_file, job) for an identical export the user may reuse, either may be None
+    Closed windows are shared between admins; a window that includes live data is
+    only reused for the same user, and its file only while it is still fresh.
+    """
+    now = timezone.now()
+    owner = Q(created_by=user) | Q(shared=True) if shared else Q(created_by=user)
+
+    files = ExportedFile.objects.filter(owner, content_key=content_key, expires_at__gt=now)
+    if not shared:
+        files = files.filter(created_at__gte=now - timedelta(seconds=settings.EXPORT_LIVE_REUSE_SECONDS))
+    for exported_file in files.order_by('-created_at')[:5]:
+        if os.path.exists(exported_file.file_path):
+            return exported_file, None
+
+    job = ExportJob.objects.filter(
+        owner, content_key=content_key, status__in=ACTIVE_STATUSES
+    ).order_by('-created_at').first()
+    return None, job
+
+def create_export_job(user, kind, params, file_format='csv', compression=None, schedule=None):
+    """
+    Queue an export for the worker; params hold the request's string parameters
+    Returns (job, created). When an identical export queued at the same moment wins the
+    race for the active-job unique constraint, that job is returned instead.
+    """
+    content_key = export_content_key(kind, params, file_format, compression)
+    shared = window_is_closed(params)
+    try:
+        with transaction.atomic():
+            job = ExportJob.objects.create(
+                kind=kind,
+                params=params,
+                file_format=file_format,
+                compression=compression or '',
+                content_key=content_key,
+                shared=shared,
+                schedule=schedule,
+                created_by=user
+            )
+        return job, True
+    except IntegrityError:
+        job = ExportJob.objects.filter(
+            content_key=content_key, shared=shared, created_by=user, status__in=ACTIVE_STATUSES
+        ).first()
+        if job is None:
+            raise
+        return job, False
+
+def claim_next_job():
+    """
+    Atomically move the oldest pending job to running and return it
+    The conditional update lets several workers poll the same table safely.
+    """
+    for job in ExportJob.objects.filter(status='pending').order_by('created_at')[:10]:
+        now = timezone.now()
+        claimed = ExportJob.objects.filter(id=job.id, status='pending').update(
+            status='running', started_at=now, heartbeat_at=now
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+def requeue_stale_jobs(max_age_minutes):
+    """
+    Return jobs whose worker died back to the queue
+    A job counts as abandoned once its heartbeat is older than max_age_minutes, so long
+    exports that are still being written by a live worker are left alone.
+    """
+    cutoff = timezone.now() - timedelta(minutes=max_age_minutes)
+    stale = Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    return ExportJob.objects.filter(stale, status='running').update(
+        status='pending', started_at=None, heartbeat_at=None, rows_written=0, progress=0
+    )
+
+def heartbeat(job, **updates):
+    """Record that the job's worker is alive, along with any progress fields"""
+    ExportJob.objects.filter(id=job.id).update(heartbeat_at=timezone.now(), **updates)
+
+class _PartitionHeartbeat:
+    """Refreshes a job's heartbeat at most every HEARTBEAT_SECONDS from the threads writing its partitions"""
+
+    def __init__(self, job):
+        self.job = job
+        self.next_beat = time.monotonic() + HEARTBEAT_SECONDS
+        self.lock = threading.Lock()
+
+    def rows(self, rows):
+        for row in rows:
+            if time.monotonic() >= self.next_beat:
+                with self.lock:
+                    due = time.monotonic() >= self.next_beat
+                    if due:
+                        self.next_beat = time.monotonic() + HEARTBEAT_SECONDS
+                if due:
+                    heartbeat(self.job)
+            yield row
+
+def _window_progress(job, row):
+    """Fraction of the requested window covered, judged by the row's ReportedTimeUTC"""
+    try:
+        start = to_epoch(datetime.strptime(job.params['start_time'], '%Y-%m-%d %H:%M:%S'))
+        end = to_epoch(datetime.strptime(job.params['end_time'], '%Y-%m-%d %H:%M:%S'))
+        reported = to_epoch(datetime.strptime(row['ReportedTimeUTC'], '%Y-%m-%d %H:%M:%S'))
+    except (KeyError, TypeError, ValueError):
+        return None
+    if end <= start:
+        return None
+    return min(max((reported - start) / (end - start), 0.0), 1.0)
+
+def track_progress(job, rows):
+    """Pass rows through while periodically recording how far the job has got"""
+    count = 0
+    next_beat = time.monotonic() + HEARTBEAT_SECONDS
+    for row in rows:
+        count += 1
+        if count % PROGRESS_EVERY == 0 or time.monotonic() >= next_beat:
+            progress = _window_progress(job, row)
+            updates = {'rows_written': count}
+            if progress is not None:
+                updates['progress'] = progress
+            heartbeat(job, **updates)
+            next_beat = time.monotonic() + HEARTBEAT_SECONDS
+        yield row
+    job.rows_written = count
+
+def _record_schedule_run(job):
+    """Store the outcome and duration of a finished scheduled job on its schedule"""
+    duration = None
+    if job.started_at and job.finished_at:
+        duration = (job.finished_at - job.started_at).total_seconds()
+    updates = {'last_status': job.status, 'last_duration_seconds': duration}
+    if job.status == 'done':
+        updates['last_exported_file'] = job.exported_file
+    ScheduledExport.objects.filter(id=job.schedule_id).update(**updates)
+
+def _finish(job, status, error=''):
+    job.status = status
+    job.error = error
+    job.finished_at = timezone.now()
+    if status == 'done':
+        job.progress = 1.0
+    job.save()
+    if job.schedule_id:
+        _record_schedule_run(job)
+    return job
+
+def run_export_job(job, rows):
+    """
+    Write a claimed job's rows to an export file and record the ExportedFile
+    rows: iterable of rows for the job, consumed lazily
+    """
+    try:
+        rows = peek_rows(rows)
+        if rows is None:
+            return _finish(job, 'failed', 'No data to export')
+
+        compression = job.compression or None
+        filename = generate_export_filename(EXPORT_PREFIXES[job.kind], job.file_format, compression)
+        file_path = save_data_to_file(
+            track_progress(job, rows), filename, job.file_format, 'air_quality', compression
+        )
+        if not file_path:
+            return _finish(job, 'failed', 'Failed to create export file')
+
+        job.exported_file = create_export_record(
+            job.created_by, file_path, filename, 'air_quality', job.params.get('site_name'),
+            content_key=job.content_key, shared=job.shared
+        )
+        logger.info(f"Export job {job.id} completed, file ID: {job.exported_file.id}")
+        return _finish(job, 'done')
+    except SensorAPIError as e:
+        logger.warning(f"Export job {job.id} failed: {str(e)}")
+        return _finish(job, 'failed', 'Failed to fetch data from sensor API')
+    except Exception as e:
+        logger.error(f"Error running export job {job.id}: {str(e)}", exc_info=True)
+        return _finish(job, 'failed', str(e))
+
+def run_partitioned_export_job(job, partitions):
+    """
+    Write a claimed job as a ZIP with one file per partition and record the ExportedFile
+    partitions: dict of site name -> callable returning that site's rows
+    Sites are fetched and encoded in parallel, up to SENSOR_API_MAX_CONCURRENCY at a time.
+    """
+    finished = []
+    # One site can take longer than the stale timeout, so beat while its rows are written
+    beat = _PartitionHeartbeat(job)
+    partitions = {name: (lambda rows=rows: beat.rows(rows())) for name, rows in partitions.items()}
+
+    def on_partition(name, count):
+        finished.append(count)
+        heartbeat(job, rows_written=sum(finished), progress=len(finished) / len(partitions))
+
+    try:
+        filename = generate_export_filename(EXPORT_PREFIXES[job.kind], 'zip')
+        chunks = iter_partitioned_zip(
+            partitions, job.file_format, settings.SENSOR_API_MAX_CONCURRENCY, on_partition=on_partition
+        )
+        file_path = save_chunks_to_file(chunks, filename, 'air_quality')
+
+        job.rows_written = sum(finished)
+        if not job.rows_written:
+            os.remove(file_path)
+            return _finish(job, 'failed', 'No data to export')
+
+        job.exported_file = create_export_record(
+            job.created_by, file_path, filename, 'air_quality',
+            content_key=job.content_key, shared=job.shared
+        )
+        logger.info(f"Export job {job.id} completed, file ID: {job.exported_file.id}")
+        return _finish(job, 'done')
+    except SensorAPIError as e:
+        logger.warning(f"Export job {job.id} failed: {str(e)}")
+        return _finish(job, 'failed', 'Failed to fetch data from sensor API')
+    except Exception as e:
+        logger.error(f"Error running export job {job.id}: {str(e)}", exc_info=True)
+        return _finish(job, 'failed', str(e))
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from datetime import datetime, timedelta
+import math
+import random
+import time
+
+from api import downsampling_services
+from api.downsampling_services import downsample_indices, TIME_SERIES_ALGORITHMS
+
+class Command(BaseCommand):
+    help = 'Benchmark the NumPy downsampling engines against the pure-Python fallbacks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help='Comma-separated input sizes to benchmark')
+        parser.add_argument('--threshold', type=int, default=500,
+                            help='Number of points to downsample to')
+        parser.add_argument('--algorithm', default='lttb', choices=TIME_SERIES_ALGORITHMS,
+                            help='Downsampling algorithm to benchmark')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Runs per engine, the best time is reported')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        threshold = options['threshold']
+        algorithm = options['algorithm']
+
+        if downsampling_services.np is None:
+            self.stdout.write(self.style.WARNING('NumPy is not installed, only the Python engine will run'))
+
+        self.stdout.write(f"Algorithm: {algorithm}, threshold: {threshold}")
+        self.stdout.write(f"{'points':>10} {'python (s)':>12} {'numpy (s)':>12} {'speedup':>9} {'same':>6}")
+        for size in sizes:
+            data = self.generate_series(size)
+
+            python_time, python_result = self.time_engine(data, threshold, algorithm, False, options['repeat'])
+            if downsampling_services.np is None:
+                self.stdout.write(f"{size:>10} {python_time:>12.3f} {'-':>12} {'-':>9} {'-':>6}")
+                continue
+
+            numpy_time, numpy_result = self.time_engine(data, threshold, algorithm, True, options['repeat'])
+            same = python_result == numpy_result
+            self.stdout.write(
+                f"{size:>10} {python_time:>12.3f} {numpy_time:>12.3f} "
+                f"{python_time / numpy_time:>8.1f}x {str(same):>6}"
+            )
+
+    def generate_series(self, size):
+        """Minute-resolution readings shaped like the sensor API's TH data"""
+        rng = random.Random(size)
+        start = datetime(2025, 1, 1)
+        return [
+            {
+                'timestamp': (start + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S'),
+                'value': f"{20 + 5 * math.sin(i / 720) + rng.gauss(0, 0.5):.2f}"
+            }
+            for i in range(size)
+        ]
+
+    def time_engine(self, data, threshold, algorithm, use_numpy, repeat):
+        best = None
+        result = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = downsample_indices(data, threshold, algorithm, use_numpy=use_numpy)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
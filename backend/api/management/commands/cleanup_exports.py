@@ -1,22 +1,144 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from api.models import ExportedFile
+import itertools
 import os
+import time
 
 class Command(BaseCommand):
-    help = 'Clean up expired exported files'
+    help = 'Clean up expired, missing and orphaned export files, keeping EXPORT_ROOT within its disk budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows to delete per query')
+        parser.add_argument('--max-bytes', type=int, default=None,
+                            help='Disk budget for EXPORT_ROOT in bytes (default: EXPORT_DISK_BUDGET_BYTES, 0 = no limit)')
+        parser.add_argument('--orphan-grace-minutes', type=int, default=60,
+                            help='Leave files without a record alone until they are this old, '
+                                 'since the export worker may still be writing them')
 
     def handle(self, *args, **options):
-        # Find expired files
-        expired_files = ExportedFile.objects.filter(expires_at__lt=timezone.now())
-        count = expired_files.count()
-        
-        # Delete files from disk and database
-        for exported_file in expired_files:
-            if os.path.exists(exported_file.file_path):
-                os.remove(exported_file.file_path)
-            exported_file.delete()
-        
+        batch_size = options['batch_size']
+        max_bytes = options['max_bytes'] if options['max_bytes'] is not None else settings.EXPORT_DISK_BUDGET_BYTES
+
+        expired, expired_bytes = self.delete_expired(batch_size)
+        missing = self.delete_missing(batch_size)
+        orphans, orphan_bytes, disk_usage = self.sweep_orphans(batch_size, options['orphan_grace_minutes'])
+        evicted, evicted_bytes = self.evict_over_budget(batch_size, max_bytes, disk_usage)
+
+        reclaimed = expired_bytes + orphan_bytes + evicted_bytes
+        self.stdout.write(f'Expired exports removed: {expired} ({expired_bytes} bytes)')
+        self.stdout.write(f'Records without a file removed: {missing}')
+        self.stdout.write(f'Orphaned files removed: {orphans} ({orphan_bytes} bytes)')
+        self.stdout.write(f'Exports evicted for the disk budget: {evicted} ({evicted_bytes} bytes)')
         self.stdout.write(
-            self.style.SUCCESS(f'Successfully cleaned up {count} expired export files')
-        )
\ No newline at end of file
+            self.style.SUCCESS(f'Successfully cleaned up exports, reclaimed {reclaimed} bytes')
+        )
+
+    def remove_file(self, file_path):
+        """Delete a file and return the bytes freed"""
+        try:
+            size = os.path.getsize(file_path)
+            os.remove(file_path)
+            return size
+        except FileNotFoundError:
+            return 0
+
+    def delete_batch(self, rows):
+        """Delete the files and rows for a batch of (id, file_path) pairs"""
+        reclaimed = sum(self.remove_file(file_path) for _, file_path in rows)
+        ExportedFile.objects.filter(id__in=[row_id for row_id, _ in rows]).delete()
+        return reclaimed
+
+    def delete_expired(self, batch_size):
+        count = 0
+        reclaimed = 0
+        now = timezone.now()
+        while True:
+            rows = list(
+                ExportedFile.objects.filter(expires_at__lt=now).values_list('id', 'file_path')[:batch_size]
+            )
+            if not rows:
+                break
+            reclaimed += self.delete_batch(rows)
+            count += len(rows)
+        return count, reclaimed
+
+    def delete_missing(self, batch_size):
+        """Remove records whose file is no longer on disk"""
+        count = 0
+        last_id = 0
+        while True:
+            rows = list(
+                ExportedFile.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'file_path')[:batch_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            missing = [row_id for row_id, file_path in rows if not os.path.exists(file_path)]
+            if missing:
+                ExportedFile.objects.filter(id__in=missing).delete()
+                count += len(missing)
+        return count
+
+    def walk_export_root(self):
+        for directory, _, filenames in os.walk(settings.EXPORT_ROOT):
+            for filename in filenames:
+                yield os.path.join(directory, filename)
+
+    def sweep_orphans(self, batch_size, grace_minutes):
+        """
+        Remove files under EXPORT_ROOT that no record points at
+        Returns (files removed, bytes reclaimed, bytes used by recorded exports).
+        Orphans still within the grace period are left out of the usage: eviction can only
+        delete recorded exports, so counting them would evict exports it cannot make room with.
+        """
+        cutoff = time.time() - grace_minutes * 60
+        count = 0
+        reclaimed = 0
+        disk_usage = 0
+
+        paths = self.walk_export_root()
+        while True:
+            batch = list(itertools.islice(paths, batch_size))
+            if not batch:
+                break
+            known = set(ExportedFile.objects.filter(file_path__in=batch).values_list('file_path', flat=True))
+            for path in batch:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if path in known:
+                    disk_usage += stat.st_size
+                elif stat.st_mtime < cutoff:
+                    reclaimed += self.remove_file(path)
+                    count += 1
+        return count, reclaimed, disk_usage
+
+    def evict_over_budget(self, batch_size, max_bytes, disk_usage):
+        """Delete the least recently downloaded exports until the recorded ones fit the budget"""
+        if not max_bytes or disk_usage <= max_bytes:
+            return 0, 0
+
+        count = 0
+        reclaimed = 0
+        # Exports that were never downloaded count as last used when they were created
+        queryset = ExportedFile.objects.order_by(
+            Coalesce('last_downloaded_at', 'created_at'), 'id'
+        ).values_list('id', 'file_path')
+        while disk_usage - reclaimed > max_bytes:
+            rows = list(queryset[:batch_size])
+            if not rows:
+                break
+            selected = []
+            for row_id, file_path in rows:
+                if disk_usage - reclaimed <= max_bytes:
+                    break
+                selected.append((row_id, file_path))
+                reclaimed += self.remove_file(file_path)
+            ExportedFile.objects.filter(id__in=[row_id for row_id, _ in selected]).delete()
+            count += len(selected)
+        return count, reclaimed
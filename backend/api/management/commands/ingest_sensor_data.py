@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.store_services import ingest_site, device_type_for_site, get_watermark, update_rollups
+from api.views import SensorAPIService
+
+class Command(BaseCommand):
+    help = 'Incrementally ingest TH and VOC readings from the sensor API into the local store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', nargs='*', default=None,
+                            help='Site names to ingest (default: every site the sensor API reports)')
+        parser.add_argument('--device-type', choices=['th', 'voc', 'all'], default='all',
+                            help='Only ingest sites of this device type')
+        parser.add_argument('--lookback-days', type=int, default=30,
+                            help='How far back to start for sites without a watermark')
+        parser.add_argument('--chunk-hours', type=int, default=24,
+                            help='Size of each upstream request window')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per bulk insert')
+        parser.add_argument('--rebuild-rollups', action='store_true',
+                            help='Recompute rollups for everything already ingested before pulling new data')
+
+    def handle(self, *args, **options):
+        sites = options['sites']
+        if not sites:
+            data = SensorAPIService.make_request("/api/v6/sites", use_mock=False)
+            if not data or 'sites' not in data:
+                raise CommandError('Failed to fetch sites from sensor API')
+            sites = data['sites']
+
+        total = 0
+        for site_name in sites:
+            device_type = device_type_for_site(site_name)
+            if device_type is None:
+                self.stdout.write(self.style.WARNING(f'Skipping {site_name}: unknown device type'))
+                continue
+            if options['device_type'] not in ('all', device_type):
+                continue
+
+            watermark = get_watermark(device_type, site_name)
+            if options['rebuild_rollups'] and watermark:
+                rebuilt = update_rollups(
+                    device_type, site_name, watermark.covered_from, watermark.covered_until,
+                    batch_size=options['batch_size']
+                )
+                self.stdout.write(f'{site_name}: rebuilt {rebuilt} rollup buckets')
+
+            endpoint = f"/api/v6/{device_type}"
+            received, covered_until = ingest_site(
+                device_type,
+                site_name,
+                lambda start, end: SensorAPIService.fetch_window(endpoint, start, end, site_name, use_mock=False),
+                lookback_days=options['lookback_days'],
+                chunk_hours=options['chunk_hours'],
+                batch_size=options['batch_size'],
+            )
+            total += received
+            self.stdout.write(f'{site_name}: {received} rows received, covered until {covered_until}')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully ingested {total} readings from the sensor API')
+        )
@@ -0,0 +1,51 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from api.job_services import claim_next_job, run_export_job, run_partitioned_export_job, requeue_stale_jobs
+from api.views import SensorAPIService
+
+class Command(BaseCommand):
+    help = 'Process queued export jobs outside the web workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling for new jobs')
+        parser.add_argument('--poll-interval', type=float, default=5,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--stale-minutes', type=int, default=60,
+                            help='Requeue running jobs whose worker has sent no heartbeat for this long, at startup')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(options['stale_minutes'])
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale export jobs'))
+
+        processed = 0
+        while True:
+            close_old_connections()
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f'Running {job}')
+            started = time.monotonic()
+            if job.params.get('layout') == 'per_site':
+                partitions = SensorAPIService.iter_export_partitions(job.params)
+                job = run_partitioned_export_job(job, partitions)
+            else:
+                rows = SensorAPIService.iter_export_rows(job.kind, job.params)
+                job = run_export_job(job, rows)
+            elapsed = time.monotonic() - started
+            processed += 1
+
+            if job.status == 'done':
+                self.stdout.write(self.style.SUCCESS(
+                    f'Export job {job.id} wrote {job.rows_written} rows in {elapsed:.1f}s'
+                ))
+            else:
+                self.stdout.write(self.style.ERROR(f'Export job {job.id} failed: {job.error}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} export jobs'))
@@ -0,0 +1,31 @@
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from api.schedule_services import queue_due_exports
+
+class Command(BaseCommand):
+    help = 'Queue export jobs for scheduled exports that are due, e.g. off-peak overnight'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Check schedules once and exit, for running from cron')
+        parser.add_argument('--interval', type=float, default=60,
+                            help='Seconds between schedule checks when running continuously')
+        parser.add_argument('--run-jobs', action='store_true',
+                            help='Also produce the queued exports in this process instead of a separate worker')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            queued = queue_due_exports()
+            for job in queued:
+                self.stdout.write(f'Queued {job} for schedule "{job.schedule.name}"')
+            if queued and options['run_jobs']:
+                call_command('run_export_worker', '--once', stdout=self.stdout, stderr=self.stderr)
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Scheduled exports checked'))
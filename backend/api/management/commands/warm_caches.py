@@ -0,0 +1,113 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from api.cache_services import seconds_until_stale, segment_units, from_epoch, utc_now_epoch
+from api.store_services import device_type_for_site
+from api.views import SensorAPIService
+
+class Command(BaseCommand):
+    help = ('Keep the sensor caches warm: refresh sites and health before they go stale '
+            'and preload every site\'s default dashboard windows into the segment cache')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Warm everything once and exit, for running from cron')
+        parser.add_argument('--interval', type=float, default=15,
+                            help='Seconds between checks of the sites and health entries')
+        parser.add_argument('--window-interval', type=float, default=300,
+                            help='Seconds between preloads of the dashboard windows')
+        parser.add_argument('--windows', nargs='*', type=int, default=[24, 24 * 7, 24 * 30],
+                            help='Window lengths to preload, in hours, ending now (default: 24h, 7d, 30d)')
+        parser.add_argument('--sites', nargs='*', default=None,
+                            help='Site names to preload (default: every site the sensor API reports)')
+
+    def handle(self, *args, **options):
+        next_windows = 0
+        while True:
+            close_old_connections()
+            # Anything that would go stale before the next check is refreshed now
+            self.refresh_lookups(options['interval'])
+            if time.monotonic() >= next_windows:
+                self.warm_windows(
+                    options['sites'], options['windows'], strict=options['once'] or bool(options['sites'])
+                )
+                next_windows = time.monotonic() + options['window_interval']
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Caches warmed'))
+
+    def refresh_lookups(self, lead_seconds):
+        for key, refresh in (
+            ('sensor_api_health', SensorAPIService.get_health),
+            ('sensor_api_sites', SensorAPIService.get_sites),
+        ):
+            if seconds_until_stale(key) > lead_seconds:
+                continue
+            refresh(refresh=True)
+            if seconds_until_stale(key):
+                self.stdout.write(f'Refreshed {key}')
+            else:
+                self.stdout.write(self.style.WARNING(f'Failed to refresh {key}'))
+
+    def check_capacity(self, sites, windows, strict):
+        """
+        The sites whose windows fit in half the shared cache tier
+        Past that the tier culls entries at random, so preloading would evict the
+        windows it just loaded and anything users have cached. With strict (--once or
+        explicit --sites) going over raises CommandError; the daemon instead warns and
+        warms the sites that fit, so a growing site list cannot stop it.
+        """
+        shared = getattr(cache, 'shared', cache)
+        if not sites or not windows or settings.SENSOR_SEGMENT_BUCKET_SECONDS <= 0 or isinstance(shared, RedisCache):
+            # Redis evicts by memory rather than by entry count
+            return sites
+        now = utc_now_epoch()
+        # The shorter windows are served from the longest one's entries
+        per_site = len(segment_units(now - max(windows) * 3600, now, settings.SENSOR_SEGMENT_BUCKET_SECONDS, now))
+        needed = per_site * len(sites)
+        if needed <= shared._max_entries // 2:
+            return sites
+
+        message = (
+            f'Preloading {len(sites)} sites x {max(windows)}h needs about {needed} cache entries, '
+            f'more than half of the shared cache\'s MAX_ENTRIES ({shared._max_entries}); '
+            'raise CACHE_MAX_ENTRIES, use Redis, or pass fewer --sites or shorter --windows'
+        )
+        if strict:
+            raise CommandError(message)
+        fits = shared._max_entries // 2 // per_site
+        self.stdout.write(self.style.WARNING(f'{message}. Warming the first {fits} sites only'))
+        return sites[:fits]
+
+    def warm_windows(self, sites, windows, strict=True):
+        if not sites:
+            data = SensorAPIService.get_sites()
+            sites = data.get('sites', []) if isinstance(data, dict) else []
+
+        sites = self.check_capacity(sites, windows, strict)
+        end = from_epoch(utc_now_epoch())
+        warmed = 0
+        failed = 0
+        for site_name in sites:
+            device_type = device_type_for_site(site_name)
+            if device_type is None:
+                continue
+            # Longest window first: the shorter ones are then served from its buckets
+            for hours in sorted(windows, reverse=True):
+                rows = SensorAPIService.get_window_data(
+                    f"/api/v6/{device_type}", end - timedelta(hours=hours), end, site_name, use_mock=False
+                )
+                if rows is None:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f'{site_name}: failed to preload the last {hours}h'))
+                    break
+                warmed += 1
+
+        self.stdout.write(f'Preloaded {warmed} dashboard windows ({failed} failed)')
@@ -3,6 +3,8 @@ import time
 
 from django.conf import settings
 
+from .cache_services import start_freshness_tracking, stop_freshness_tracking
+
 logger = logging.getLogger(__name__)
 
 class RequestLoggingMiddleware:
@@ -59,4 +61,24 @@ class QueryTimingMiddleware:
                 f"Total time: {total_time:.2f}s"
             )
         
-        return response
\ No newline at end of file
+        return response
+
+class DataFreshnessMiddleware:
+    """
+    Tell clients how the sensor data in a response was obtained
+    X-Data-Freshness is 'fresh', 'stale' (served from cache while the sensor API
+    was slow or down) or 'synthetic' (mock data); it is omitted when no sensor data
+    was involved.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = start_freshness_tracking()
+        try:
+            response = self.get_response(request)
+        finally:
+            freshness = stop_freshness_tracking(token)
+        if freshness:
+            response['X-Data-Freshness'] = freshness
+        return response
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_delete_airqualitydata_delete_batterydata_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('site_name', models.CharField(max_length=50)),
+                ('device_type', models.CharField(choices=[('th', 'TH'), ('voc', 'VOC')], max_length=10)),
+                ('covered_from', models.DateTimeField()),
+                ('covered_until', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('site_name', 'device_type')},
+            },
+        ),
+        migrations.CreateModel(
+            name='THReading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('site_name', models.CharField(max_length=50)),
+                ('reported_time', models.DateTimeField()),
+                ('received_time', models.DateTimeField(blank=True, null=True)),
+                ('temperature', models.FloatField(blank=True, null=True)),
+                ('humidity', models.FloatField(blank=True, null=True)),
+                ('noise', models.FloatField(blank=True, null=True)),
+                ('pm2_5', models.FloatField(blank=True, null=True)),
+                ('pm10', models.FloatField(blank=True, null=True)),
+                ('illumination', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('site_name', 'reported_time'), name='unique_th_reading')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VOCReading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('site_name', models.CharField(max_length=50)),
+                ('reported_time', models.DateTimeField()),
+                ('received_time', models.DateTimeField(blank=True, null=True)),
+                ('voc', models.FloatField(blank=True, null=True)),
+                ('o3', models.FloatField(blank=True, null=True)),
+                ('so2', models.FloatField(blank=True, null=True)),
+                ('no2', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('site_name', 'reported_time'), name='unique_voc_reading')],
+            },
+        ),
+    ]
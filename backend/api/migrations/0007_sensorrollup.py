@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_threading_vocreading_ingestionwatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('site_name', models.CharField(max_length=50)),
+                ('pollutant', models.CharField(max_length=20)),
+                ('resolution', models.CharField(choices=[('1m', '1 minute'), ('5m', '5 minutes'), ('1h', '1 hour'), ('1d', '1 day')], max_length=3)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.IntegerField()),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('sum_value', models.FloatField()),
+                ('mean_value', models.FloatField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('site_name', 'pollutant', 'resolution', 'bucket_start'), name='unique_sensor_rollup')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='compression',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_exportjob_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportedfile',
+            name='content_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='exportedfile',
+            name='shared',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='exportjob',
+            name='content_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='exportjob',
+            name='shared',
+            field=models.BooleanField(default=False),
+        ),
+    ]
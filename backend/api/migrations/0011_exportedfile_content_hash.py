@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_export_dedup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportedfile',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
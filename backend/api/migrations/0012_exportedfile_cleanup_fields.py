@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_exportedfile_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportedfile',
+            name='last_downloaded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='exportedfile',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_exportedfile_cleanup_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('schedule', models.CharField(help_text='Cron expression in UTC (minute hour day-of-month month day-of-week), e.g. "30 2 * * *"', max_length=100)),
+                ('device_type', models.CharField(choices=[('th', 'TH'), ('voc', 'VOC')], max_length=3)),
+                ('site_names', models.JSONField(default=list)),
+                ('window_hours', models.PositiveIntegerField(default=24, help_text="Length of the exported window, ending at the start of the run's UTC day")),
+                ('file_format', models.CharField(default='csv', max_length=10)),
+                ('compression', models.CharField(blank=True, max_length=10)),
+                ('layout', models.CharField(choices=[('merged', 'One file with a SiteName column'), ('per_site', 'ZIP with one file per site')], default='merged', max_length=10)),
+                ('enabled', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('next_run_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('last_status', models.CharField(blank=True, max_length=10)),
+                ('last_duration_seconds', models.FloatField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('last_exported_file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.exportedfile')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='exportjob',
+            name='schedule',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='api.scheduledexport'),
+        ),
+    ]
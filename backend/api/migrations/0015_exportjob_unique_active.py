@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_exportjob_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='exportjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running']), models.Q(('content_key', ''), _negated=True)), fields=('content_key', 'shared', 'created_by'), name='unique_active_export_job'),
+        ),
+    ]
@@ -123,7 +123,15 @@ class ExportedFile(models.Model):
     pollutant = models.CharField(max_length=10, blank=True, null=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
-    expires_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+    # Used by cleanup_exports to evict the least recently downloaded files first
+    last_downloaded_at = models.DateTimeField(blank=True, null=True)
+    # Hash of the export's parameters, so identical exports can be reused
+    content_key = models.CharField(max_length=64, blank=True, db_index=True)
+    # SHA-256 of the file's bytes, served as its ETag
+    content_hash = models.CharField(max_length=64, blank=True)
+    # Closed historical windows can be downloaded by any admin, not just the creator
+    shared = models.BooleanField(default=False)
     
     def __str__(self):
         return self.filename
@@ -134,7 +142,217 @@ class ExportedFile(models.Model):
     
     def get_file_format(self):
         """Get the file format based on filename extension"""
-        if self.filename.endswith('.json'):
-            return 'json'
+        filename = self.filename[:-3] if self.get_compression() else self.filename
+        extension = filename.rsplit('.', 1)[-1]
+        if extension in ('json', 'ndjson', 'parquet', 'arrow', 'zip'):
+            return extension
         else:
-            return 'csv'
\ No newline at end of file
+            return 'csv'
+    
+    def get_compression(self):
+        """Get the compression applied to the file, if any"""
+        return 'gzip' if self.filename.endswith('.gz') else None
+
+# Background export jobs, processed by `manage.py run_export_worker`
+class ExportJob(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    KIND_CHOICES = (
+        ('th', 'TH'),
+        ('voc', 'VOC'),
+        ('multi', 'Multi-device'),
+    )
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    params = models.JSONField(default=dict)
+    file_format = models.CharField(max_length=10, default='csv')
+    compression = models.CharField(max_length=10, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', db_index=True)
+    rows_written = models.PositiveIntegerField(default=0)
+    progress = models.FloatField(default=0)
+    error = models.TextField(blank=True)
+    exported_file = models.ForeignKey(ExportedFile, on_delete=models.SET_NULL, blank=True, null=True)
+    content_key = models.CharField(max_length=64, blank=True, db_index=True)
+    shared = models.BooleanField(default=False)
+    schedule = models.ForeignKey(
+        'ScheduledExport', on_delete=models.SET_NULL, blank=True, null=True, related_name='jobs'
+    )
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Refreshed by the worker while it runs the job, so a dead worker's jobs can be told apart
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        constraints = [
+            # Identical exports requested at the same moment share one job; jobs queued
+            # before content keys existed have none and are left alone
+            models.UniqueConstraint(
+                fields=['content_key', 'shared', 'created_by'],
+                condition=models.Q(status__in=['pending', 'running']) & ~models.Q(content_key=''),
+                name='unique_active_export_job'
+            )
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} export #{self.id} ({self.status})"
+
+# Recurring exports, queued by `manage.py run_scheduled_exports`
+class ScheduledExport(models.Model):
+    DEVICE_TYPES = (
+        ('th', 'TH'),
+        ('voc', 'VOC'),
+    )
+    LAYOUTS = (
+        ('merged', 'One file with a SiteName column'),
+        ('per_site', 'ZIP with one file per site'),
+    )
+    
+    name = models.CharField(max_length=100)
+    schedule = models.CharField(
+        max_length=100,
+        help_text='Cron expression in UTC (minute hour day-of-month month day-of-week), e.g. "30 2 * * *"'
+    )
+    device_type = models.CharField(max_length=3, choices=DEVICE_TYPES)
+    site_names = models.JSONField(default=list)
+    window_hours = models.PositiveIntegerField(
+        default=24, help_text='Length of the exported window, ending at the start of the run\'s UTC day'
+    )
+    file_format = models.CharField(max_length=10, default='csv')
+    compression = models.CharField(max_length=10, blank=True)
+    layout = models.CharField(max_length=10, choices=LAYOUTS, default='merged')
+    enabled = models.BooleanField(default=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_run_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    last_run_at = models.DateTimeField(blank=True, null=True)
+    last_status = models.CharField(max_length=10, blank=True)
+    last_duration_seconds = models.FloatField(blank=True, null=True)
+    last_exported_file = models.ForeignKey(ExportedFile, on_delete=models.SET_NULL, blank=True, null=True)
+    
+    def __str__(self):
+        return self.name
+    
+    def clean(self):
+        from .schedule_services import parse_cron
+        try:
+            parse_cron(self.schedule)
+        except ValueError as e:
+            raise ValidationError({'schedule': str(e)})
+    
+    def save(self, *args, **kwargs):
+        if self.next_run_at is None:
+            from .schedule_services import cron_next
+            from django.utils import timezone
+            self.next_run_at = cron_next(self.schedule, timezone.now())
+        super().save(*args, **kwargs)
+
+# Local time-series store
+class SensorReading(models.Model):
+    site_name = models.CharField(max_length=50)
+    reported_time = models.DateTimeField()
+    received_time = models.DateTimeField(blank=True, null=True)
+
+    # Sensor API column -> model field, and how the API formats the values
+    API_FIELDS = {}
+    VALUE_FORMAT = '{:.2f}'
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"{self.site_name} at {self.reported_time}"
+
+class THReading(SensorReading):
+    temperature = models.FloatField(blank=True, null=True)
+    humidity = models.FloatField(blank=True, null=True)
+    noise = models.FloatField(blank=True, null=True)
+    pm2_5 = models.FloatField(blank=True, null=True)
+    pm10 = models.FloatField(blank=True, null=True)
+    illumination = models.FloatField(blank=True, null=True)
+
+    API_FIELDS = {
+        'Temperature': 'temperature',
+        'Humidity': 'humidity',
+        'Noise': 'noise',
+        'PM2_5': 'pm2_5',
+        'PM10': 'pm10',
+        'Illumination': 'illumination',
+    }
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['site_name', 'reported_time'], name='unique_th_reading')
+        ]
+
+class VOCReading(SensorReading):
+    voc = models.FloatField(blank=True, null=True)
+    o3 = models.FloatField(blank=True, null=True)
+    so2 = models.FloatField(blank=True, null=True)
+    no2 = models.FloatField(blank=True, null=True)
+
+    API_FIELDS = {
+        'VOC': 'voc',
+        'O3': 'o3',
+        'SO2': 'so2',
+        'NO2': 'no2',
+    }
+    VALUE_FORMAT = '{:.4f}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['site_name', 'reported_time'], name='unique_voc_reading')
+        ]
+
+class IngestionWatermark(models.Model):
+    DEVICE_TYPES = (
+        ('th', 'TH'),
+        ('voc', 'VOC'),
+    )
+
+    site_name = models.CharField(max_length=50)
+    device_type = models.CharField(max_length=10, choices=DEVICE_TYPES)
+    covered_from = models.DateTimeField()
+    covered_until = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('site_name', 'device_type')
+
+    def __str__(self):
+        return f"{self.site_name} ({self.device_type}) until {self.covered_until}"
+
+class SensorRollup(models.Model):
+    RESOLUTIONS = (
+        ('1m', '1 minute'),
+        ('5m', '5 minutes'),
+        ('1h', '1 hour'),
+        ('1d', '1 day'),
+    )
+
+    site_name = models.CharField(max_length=50)
+    pollutant = models.CharField(max_length=20)
+    resolution = models.CharField(max_length=3, choices=RESOLUTIONS)
+    bucket_start = models.DateTimeField()
+    count = models.IntegerField()
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    sum_value = models.FloatField()
+    mean_value = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['site_name', 'pollutant', 'resolution', 'bucket_start'],
+                name='unique_sensor_rollup'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.site_name} {self.pollutant} {self.resolution} at {self.bucket_start}"
@@ -0,0 +1,120 @@
+import time
+import queue
+import logging
+import itertools
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from .http_services import get_circuit_breaker, get_inflight_requests
+
+logger = logging.getLogger(__name__)
+
+# Task priorities, most likely next view first
+PREVIOUS_WINDOW = 1
+COARSER_ZOOM = 2
+
+# Zooming out never asks for more than the chart endpoints allow
+MAX_SPAN = timedelta(days=30)
+
+# Workers are started lazily, so none are inherited across a gunicorn fork
+_queue = queue.PriorityQueue()
+_workers = []
+_pending = set()
+_lock = threading.Lock()
+_sequence = itertools.count()
+_counters = {'queued': 0, 'completed': 0, 'failed': 0, 'dropped': 0, 'expired': 0}
+
+def _count(name):
+    with _lock:
+        _counters[name] += 1
+
+def get_prefetch_stats():
+    """Report prefetch activity for this worker process"""
+    with _lock:
+        stats = dict(_counters)
+        stats['pending'] = len(_pending)
+        stats['workers'] = len(_workers)
+    return stats
+
+def prefetch_windows(start_time, end_time, now):
+    """
+    (priority, start, end) windows a chart user is likely to ask for next
+    The previous window of the same length comes first; then the view zoomed out to
+    twice the span around the same centre, kept from reaching past now.
+    """
+    span = end_time - start_time
+    windows = [(PREVIOUS_WINDOW, start_time - span, start_time - timedelta(seconds=1))]
+
+    zoom_span = min(span * 2, MAX_SPAN)
+    if zoom_span > span:
+        padding = timedelta(seconds=int((zoom_span - span).total_seconds() // 2))
+        zoom_end = min(end_time + padding, max(now, end_time))
+        windows.append((COARSER_ZOOM, zoom_end - zoom_span, zoom_end))
+    return windows
+
+def _ensure_workers():
+    with _lock:
+        while len(_workers) < settings.SENSOR_PREFETCH_WORKERS:
+            worker = threading.Thread(target=_work, name=f"sensor-prefetch-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+def enqueue_prefetch(key, priority, task):
+    """
+    Queue task() to run in the background unless it is already queued
+    Returns False when prefetching is off, the queue is full or the sensor API is down.
+    """
+    if settings.SENSOR_PREFETCH_WORKERS <= 0 or get_circuit_breaker().state == 'open':
+        return False
+    with _lock:
+        if key in _pending or len(_pending) >= settings.SENSOR_PREFETCH_MAX_QUEUE:
+            _counters['dropped'] += 1
+            return False
+        _pending.add(key)
+        _counters['queued'] += 1
+    _ensure_workers()
+    _queue.put((priority, next(_sequence), time.monotonic(), key, task))
+    return True
+
+def schedule_prefetch(endpoint, site_name, start_time, end_time, now, fetch):
+    """
+    Warm the segment cache for the windows likely to follow [start_time, end_time]
+    fetch: callable(start, end) loading a window through the segment cache
+    """
+    if settings.SENSOR_SEGMENT_BUCKET_SECONDS <= 0:
+        return
+    for priority, start, end in prefetch_windows(start_time, end_time, now):
+        enqueue_prefetch(
+            (endpoint, site_name, start, end), priority,
+            lambda start=start, end=end: fetch(start, end)
+        )
+
+def _wait_for_quiet(queued_at):
+    """Hold back while interactive requests are waiting on the sensor API; False if the task went stale"""
+    while get_inflight_requests() >= settings.SENSOR_PREFETCH_BUSY_REQUESTS:
+        if time.monotonic() - queued_at > settings.SENSOR_PREFETCH_MAX_AGE_SECONDS:
+            return False
+        time.sleep(0.1)
+    return time.monotonic() - queued_at <= settings.SENSOR_PREFETCH_MAX_AGE_SECONDS
+
+def _work():
+    while True:
+        priority, _, queued_at, key, task = _queue.get()
+        try:
+            if not _wait_for_quiet(queued_at) or get_circuit_breaker().state == 'open':
+                _count('expired')
+                continue
+            if task() is None:
+                _count('failed')
+            else:
+                _count('completed')
+        except Exception as e:
+            _count('failed')
+            logger.warning(f"Prefetch of {key} failed: {str(e)}")
+        finally:
+            with _lock:
+                _pending.discard(key)
+            # The task may have read the local store; don't hold a connection between tasks
+            connection.close()
+            _queue.task_done()
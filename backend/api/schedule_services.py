@@ -0,0 +1,124 @@
+import logging
+from datetime import timedelta, timezone as dt_timezone
+from django.utils import timezone
+from .models import ScheduledExport
+from .job_services import create_export_job, export_content_key, find_existing_export, window_is_closed
+
+logger = logging.getLogger(__name__)
+
+# (name, lowest, highest) for the five cron fields
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day of month', 1, 31),
+    ('month', 1, 12),
+    ('day of week', 0, 6),
+)
+
+def _parse_cron_field(value, name, lowest, highest):
+    values = set()
+    try:
+        for part in value.split(','):
+            base, _, step = part.partition('/')
+            step = int(step) if step else 1
+            if base == '*':
+                start, end = lowest, highest
+            elif '-' in base:
+                start, end = (int(bound) for bound in base.split('-', 1))
+            else:
+                start = int(base)
+                end = highest if step > 1 else start
+            if start < lowest or end > highest or start > end or step < 1:
+                raise ValueError(value)
+            values.update(range(start, end + 1, step))
+    except ValueError:
+        raise ValueError(f"Invalid {name} field: {value}")
+    return values
+
+def parse_cron(expression):
+    """
+    Parse a five-field cron expression (minute hour day-of-month month day-of-week)
+    Supports '*', numbers, ranges, lists and steps; Sunday is 0 in day-of-week.
+    Returns a tuple of value sets plus whether each day field was restricted.
+    """
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError('A cron expression needs 5 fields: minute hour day-of-month month day-of-week')
+    parsed = tuple(
+        _parse_cron_field(value, name, lowest, highest)
+        for value, (name, lowest, highest) in zip(fields, CRON_FIELDS)
+    )
+    return parsed + (fields[2] != '*', fields[4] != '*')
+
+def cron_next(expression, after):
+    """First time strictly after `after` (an aware datetime) that matches the expression, in UTC"""
+    minutes, hours, days, months, weekdays, days_restricted, weekdays_restricted = parse_cron(expression)
+    after = after.astimezone(dt_timezone.utc).replace(second=0, microsecond=0)
+    day = after.replace(hour=0, minute=0)
+
+    # Five years covers every satisfiable expression, including 29 February
+    for _ in range(366 * 5):
+        if day.month in months:
+            day_match = day.day in days
+            weekday_match = (day.weekday() + 1) % 7 in weekdays
+            # As in cron, a restricted day-of-month and day-of-week match when either does
+            if days_restricted and weekdays_restricted:
+                matches = day_match or weekday_match
+            else:
+                matches = day_match and weekday_match
+            if matches:
+                for hour in sorted(hours):
+                    for minute in sorted(minutes):
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate > after:
+                            return candidate
+        day += timedelta(days=1)
+    raise ValueError(f"Cron expression never matches: {expression}")
+
+def schedule_window(schedule, run_time):
+    """
+    Export window for a run: the window_hours ending at the start of the run's UTC day
+    A daily schedule therefore exports the previous day, a weekly one the previous seven.
+    """
+    end = run_time.astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(hours=schedule.window_hours)
+    return start.replace(tzinfo=None), (end - timedelta(seconds=1)).replace(tzinfo=None)
+
+def schedule_params(schedule, run_time):
+    start, end = schedule_window(schedule, run_time)
+    return {
+        'device_type': schedule.device_type,
+        'start_time': start.strftime('%Y-%m-%d %H:%M:%S'),
+        'end_time': end.strftime('%Y-%m-%d %H:%M:%S'),
+        'site_names': list(schedule.site_names),
+        'layout': schedule.layout,
+    }
+
+def queue_due_exports(now=None):
+    """
+    Queue an export job for every enabled schedule whose next run is due
+    Returns the jobs queued. A schedule whose identical export already exists or is
+    being produced is not queued again; it just moves on to its next run.
+    """
+    now = now or timezone.now()
+    queued = []
+    for schedule in ScheduledExport.objects.filter(enabled=True, next_run_at__lte=now).select_related('created_by'):
+        params = schedule_params(schedule, schedule.next_run_at)
+        compression = schedule.compression or None
+        content_key = export_content_key('multi', params, schedule.file_format, compression)
+        exported_file, job = find_existing_export(schedule.created_by, content_key, window_is_closed(params))
+
+        if exported_file is None and job is None:
+            job, created = create_export_job(
+                schedule.created_by, 'multi', params, schedule.file_format, compression, schedule=schedule
+            )
+            if created:
+                queued.append(job)
+                logger.info(f"Queued export job {job.id} for schedule '{schedule.name}'")
+        elif exported_file is not None:
+            schedule.last_exported_file = exported_file
+
+        schedule.last_run_at = now
+        schedule.next_run_at = cron_next(schedule.schedule, now)
+        schedule.save(update_fields=['last_run_at', 'next_run_at', 'last_exported_file'])
+    return queued
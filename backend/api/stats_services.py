@@ -0,0 +1,191 @@
+import math
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from .cache_services import to_epoch, from_epoch, utc_now_epoch
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 86400
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with bounded relative error (DDSketch-style)
+    Values are counted in logarithmic buckets, so two sketches merge by adding
+    their bucket counts and quantiles are within relative_accuracy of the truth.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _key(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value):
+        if value > 0:
+            key = self._key(value)
+            self.positive[key] = self.positive.get(key, 0) + 1
+        elif value < 0:
+            key = self._key(-value)
+            self.negative[key] = self.negative.get(key, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Cannot merge sketches with different relative accuracy')
+        for key, count in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + count
+        for key, count in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # Walk from the most negative value up to the most positive one
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+class RunningStats:
+    """
+    Single-pass count/mean/min/max/std with approximate percentiles
+    Uses Welford's update for the moments and Chan's formula to merge, so
+    summaries of separate time buckets combine without rescanning raw data.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.sketch.add(value)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+        else:
+            total = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / total
+            self.m2 += other.m2 + delta * delta * self.count * other.count / total
+            self.count = total
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def std(self):
+        """Sample standard deviation"""
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'std': self.std,
+            'p50': self.sketch.quantile(0.50),
+            'p95': self.sketch.quantile(0.95),
+            'p99': self.sketch.quantile(0.99),
+        }
+
+def stats_from_rows(rows, pollutant, stats=None):
+    """Stream rows into a RunningStats, skipping missing or non-numeric values"""
+    stats = stats or RunningStats()
+    if isinstance(rows, dict):
+        rows = [rows]
+    for row in rows:
+        value = row.get(pollutant)
+        if value is None or value == '':
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if math.isfinite(value):
+            stats.add(value)
+    return stats
+
+def stats_cache_key(device_type, site_name, pollutant, day_start):
+    return f"sensor_stats:{device_type}:{site_name}:{pollutant}:{day_start}"
+
+def get_window_stats(device_type, site_name, pollutant, start_time, end_time, fetch):
+    """
+    Compute stats for a window by merging cached per-day summaries
+    fetch: callable(start, end) returning sensor API rows, or None on upstream failure
+    Whole days inside the window are summarised once and cached; partial days at
+    the edges are streamed from rows directly. Returns None if any fetch fails.
+    """
+    start_epoch = to_epoch(start_time)
+    end_epoch = to_epoch(end_time)
+    now_epoch = utc_now_epoch()
+    stats = RunningStats()
+
+    day = start_epoch - start_epoch % DAY_SECONDS
+    while day <= end_epoch:
+        day_end = day + DAY_SECONDS - 1
+        piece_start = max(day, start_epoch)
+        piece_end = min(day_end, end_epoch)
+
+        if piece_start == day and piece_end == day_end:
+            key = stats_cache_key(device_type, site_name, pollutant, day)
+            summary = cache.get(key)
+            if summary is None:
+                rows = fetch(from_epoch(day), from_epoch(day_end))
+                if rows is None:
+                    return None
+                summary = stats_from_rows(rows, pollutant)
+                settled = day_end < now_epoch - settings.SENSOR_SEGMENT_SETTLE_SECONDS
+                ttl = settings.SENSOR_SEGMENT_CLOSED_TTL if settled else settings.SENSOR_SEGMENT_LIVE_TTL
+                cache.set(key, summary, ttl)
+            stats.merge(summary)
+        else:
+            rows = fetch(from_epoch(piece_start), from_epoch(piece_end))
+            if rows is None:
+                return None
+            stats_from_rows(rows, pollutant, stats)
+
+        day += DAY_SECONDS
+
+    return stats
@@ -0,0 +1,378 @@
+import logging
+import functools
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection
+from .models import THReading, VOCReading, IngestionWatermark, SensorRollup
+from .cache_services import utc_now_epoch
+
+logger = logging.getLogger(__name__)
+
+READING_MODELS = {
+    'th': THReading,
+    'voc': VOCReading,
+}
+
+ENDPOINT_DEVICE_TYPES = {
+    '/api/v6/th': 'th',
+    '/api/v6/voc': 'voc',
+}
+
+SENSOR_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Rollup resolutions from finest to coarsest, in seconds; each divides a day
+ROLLUP_RESOLUTIONS = {
+    '1m': 60,
+    '5m': 300,
+    '1h': 3600,
+    '1d': 86400,
+}
+
+def device_type_for_site(site_name):
+    """Infer the device type from a sensor API site name"""
+    if '-TH-' in site_name:
+        return 'th'
+    if '-VOC-' in site_name:
+        return 'voc'
+    return None
+
+def closing_db_connection(func):
+    """
+    Wrap func for a pool thread so the database connection it opens is closed when it returns
+    Pool threads are not request threads, so nothing else would close their connections.
+    """
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connection.close()
+    return run
+
+def to_aware(dt):
+    """Treat naive sensor API datetimes as UTC"""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=dt_timezone.utc)
+    return dt
+
+def to_naive(dt):
+    return dt.astimezone(dt_timezone.utc).replace(tzinfo=None)
+
+def _parse_time(value):
+    if not value:
+        return None
+    try:
+        return to_aware(datetime.strptime(value, SENSOR_TIME_FORMAT))
+    except (TypeError, ValueError):
+        return None
+
+def _parse_float(value):
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def row_to_reading(model, row, site_name):
+    """Build an unsaved reading from a sensor API row, or None if it has no usable time"""
+    reported_time = _parse_time(row.get('ReportedTimeUTC'))
+    if reported_time is None:
+        return None
+    values = {field: _parse_float(row.get(column)) for column, field in model.API_FIELDS.items()}
+    return model(
+        site_name=row.get('SiteName') or site_name,
+        reported_time=reported_time,
+        received_time=_parse_time(row.get('ReceivedTime')),
+        **values
+    )
+
+def get_watermark(device_type, site_name):
+    return IngestionWatermark.objects.filter(device_type=device_type, site_name=site_name).first()
+
+def ingest_site(device_type, site_name, fetch, lookback_days=30, chunk_hours=24, batch_size=1000):
+    """
+    Pull readings for one site from the stored watermark up to now and bulk insert them
+    fetch: callable(start, end) returning upstream rows, or None on failure
+    Returns (rows received, covered_until) and stops at the first failed chunk.
+    Rows already stored are skipped by the unique constraint.
+    """
+    model = READING_MODELS[device_type]
+    now = datetime.fromtimestamp(utc_now_epoch(), tz=dt_timezone.utc)
+    # Readings can arrive late, so only the settled part of the window counts as covered
+    settled = now - timedelta(seconds=settings.SENSOR_SEGMENT_SETTLE_SECONDS)
+
+    watermark = get_watermark(device_type, site_name)
+    if watermark:
+        start = watermark.covered_until
+    else:
+        start = now - timedelta(days=lookback_days)
+        watermark = IngestionWatermark(
+            device_type=device_type, site_name=site_name, covered_from=start, covered_until=start
+        )
+
+    received = 0
+    while start < now:
+        end = min(start + timedelta(hours=chunk_hours), now)
+        # The upstream end_time is inclusive, so stop one second short to keep chunks disjoint
+        rows = fetch(to_naive(start), to_naive(end - timedelta(seconds=1)))
+        if rows is None:
+            logger.warning(f"Ingestion of {site_name} stopped at {start}: upstream request failed")
+            break
+        if isinstance(rows, dict):
+            rows = [rows]
+
+        readings = [reading for reading in (row_to_reading(model, row, site_name) for row in rows) if reading]
+        model.objects.bulk_create(readings, batch_size=batch_size, ignore_conflicts=True)
+        received += len(readings)
+        if readings:
+            update_rollups(device_type, site_name, start, end, batch_size=batch_size)
+
+        watermark.covered_until = max(watermark.covered_until, min(end, settled))
+        watermark.save()
+        start = end
+
+    return received, watermark.covered_until
+
+def _store_split(watermark, start_time, end_time):
+    """
+    Where a window stops being served by the store: end_time if it is fully covered,
+    covered_until if only a prefix is, None if the store does not cover its start
+    """
+    if watermark is None or not watermark.covered_from <= start_time < watermark.covered_until:
+        return None
+    return min(end_time, watermark.covered_until)
+
+def read_window(device_type, site_name, start_time, end_time, tail=None):
+    """
+    Serve a window from the local store in the sensor API row format
+    tail: optional callable(start, end) returning rows, or None on failure, for the part of
+    the window after the ingested data; dashboard windows end at now, past the watermark.
+    Returns None when the store does not cover the window (or its start, given a tail).
+    """
+    if not settings.SENSOR_LOCAL_STORE_ENABLED or not site_name:
+        return None
+
+    start_time = to_aware(start_time)
+    end_time = to_aware(end_time)
+    split = _store_split(get_watermark(device_type, site_name), start_time, end_time)
+    if split is None or (split < end_time and tail is None):
+        return None
+
+    model = READING_MODELS[device_type]
+    columns = list(model.API_FIELDS.items())
+    fields = ['site_name', 'reported_time', 'received_time'] + [field for _, field in columns]
+    value_format = model.VALUE_FORMAT
+
+    rows = []
+    queryset = model.objects.filter(site_name=site_name, reported_time__gte=start_time)
+    if split < end_time:
+        # Readings at covered_until itself may not be ingested yet, so they come from the tail
+        queryset = queryset.filter(reported_time__lt=split)
+    else:
+        queryset = queryset.filter(reported_time__lte=end_time)
+    for values in queryset.order_by('reported_time').values_list(*fields).iterator(chunk_size=5000):
+        row = {
+            'SiteName': values[0],
+            'ReportedTimeUTC': to_naive(values[1]).strftime(SENSOR_TIME_FORMAT),
+            'ReceivedTime': to_naive(values[2]).strftime(SENSOR_TIME_FORMAT) if values[2] else None,
+        }
+        for (column, _), value in zip(columns, values[3:]):
+            row[column] = value_format.format(value) if value is not None else None
+        rows.append(row)
+
+    if split < end_time:
+        tail_rows = tail(to_naive(split), to_naive(end_time))
+        if tail_rows is None:
+            return None
+        rows.extend([tail_rows] if isinstance(tail_rows, dict) else tail_rows)
+    return rows
+
+def _add_to_bucket(buckets, key, count, min_value, max_value, sum_value):
+    stats = buckets.get(key)
+    if stats is None:
+        buckets[key] = [count, min_value, max_value, sum_value]
+    else:
+        stats[0] += count
+        stats[1] = min(stats[1], min_value)
+        stats[2] = max(stats[2], max_value)
+        stats[3] += sum_value
+
+def update_rollups(device_type, site_name, start_time, end_time, batch_size=1000):
+    """
+    Recompute the rollup buckets touched by [start_time, end_time]
+    The finest resolution is rebuilt from the raw readings and each coarser one from the
+    buckets of the resolution below it, so only the buckets spanning the range are read
+    and written; rerunning it is idempotent and picks up late readings.
+    """
+    model = READING_MODELS[device_type]
+    columns = list(model.API_FIELDS.items())
+    start_epoch = int(to_aware(start_time).timestamp())
+    end_epoch = int(to_aware(end_time).timestamp())
+
+    written = 0
+    finer = None
+    for resolution, size in sorted(ROLLUP_RESOLUTIONS.items(), key=lambda item: item[1]):
+        range_start = datetime.fromtimestamp(start_epoch - start_epoch % size, tz=dt_timezone.utc)
+        range_end = datetime.fromtimestamp(end_epoch - end_epoch % size + size, tz=dt_timezone.utc)
+
+        # (pollutant, bucket) -> [count, min, max, sum]
+        buckets = {}
+        if finer is None:
+            queryset = model.objects.filter(
+                site_name=site_name, reported_time__gte=range_start, reported_time__lt=range_end
+            ).values_list('reported_time', *[field for _, field in columns])
+            for values in queryset.iterator(chunk_size=5000):
+                epoch = int(values[0].timestamp())
+                for (column, _), value in zip(columns, values[1:]):
+                    if value is not None:
+                        _add_to_bucket(buckets, (column, epoch - epoch % size), 1, value, value, value)
+        else:
+            queryset = SensorRollup.objects.filter(
+                site_name=site_name, resolution=finer, bucket_start__gte=range_start, bucket_start__lt=range_end
+            ).values_list('pollutant', 'bucket_start', 'count', 'min_value', 'max_value', 'sum_value')
+            for column, bucket_start, *stats in queryset.iterator(chunk_size=5000):
+                epoch = int(bucket_start.timestamp())
+                _add_to_bucket(buckets, (column, epoch - epoch % size), *stats)
+
+        rollups = [
+            SensorRollup(
+                site_name=site_name,
+                pollutant=column,
+                resolution=resolution,
+                bucket_start=datetime.fromtimestamp(bucket, tz=dt_timezone.utc),
+                count=count,
+                min_value=min_value,
+                max_value=max_value,
+                sum_value=sum_value,
+                mean_value=sum_value / count
+            )
+            for (column, bucket), (count, min_value, max_value, sum_value) in buckets.items()
+        ]
+        SensorRollup.objects.bulk_create(
+            rollups,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['site_name', 'pollutant', 'resolution', 'bucket_start'],
+            update_fields=['count', 'min_value', 'max_value', 'sum_value', 'mean_value']
+        )
+        written += len(rollups)
+        finer = resolution
+    return written
+
+def choose_resolution(start_time, end_time, max_points):
+    """
+    Pick the coarsest rollup resolution that still yields at least max_points buckets
+    Returns None when even the finest resolution is too coarse, meaning raw rows are needed.
+    """
+    span = (end_time - start_time).total_seconds()
+    chosen = None
+    for resolution, size in ROLLUP_RESOLUTIONS.items():
+        if span / size >= max_points:
+            chosen = resolution
+    return chosen
+
+def _rollup_row(site_name, bucket_start, columns):
+    """An empty rollup row with the same keys as a sensor API row"""
+    row = {
+        'SiteName': site_name,
+        'ReportedTimeUTC': to_naive(bucket_start).strftime(SENSOR_TIME_FORMAT),
+        # Buckets merge many readings, so there is no single received time
+        'ReceivedTime': None,
+    }
+    row.update((column, None) for column in columns)
+    return row
+
+def _aggregate_rows(rows, columns, size, site_name, value_format, extremes):
+    """Bucket raw sensor API rows the way the rollup tables do, in read_rollup_window's row format"""
+    buckets = {}
+    for row in rows:
+        reported_time = _parse_time(row.get('ReportedTimeUTC'))
+        if reported_time is None:
+            continue
+        epoch = int(reported_time.timestamp())
+        bucket = buckets.setdefault(epoch - epoch % size, {})
+        for column in columns:
+            value = _parse_float(row.get(column))
+            if value is not None:
+                _add_to_bucket(bucket, column, 1, value, value, value)
+
+    aggregated = []
+    for bucket_start in sorted(buckets):
+        row = _rollup_row(site_name, datetime.fromtimestamp(bucket_start, tz=dt_timezone.utc), columns)
+        for column, (count, min_value, max_value, sum_value) in buckets[bucket_start].items():
+            row[column] = value_format.format(sum_value / count)
+            if extremes:
+                row[f'{column}_min'] = value_format.format(min_value)
+                row[f'{column}_max'] = value_format.format(max_value)
+        aggregated.append(row)
+    return aggregated
+
+def read_rollup_window(device_type, site_name, start_time, end_time, resolution, max_points, columns=None,
+                       tail=None, extremes=False):
+    """
+    Serve a window from the rollup tables in the sensor API row format
+    resolution: 'auto' to choose from max_points, or one of ROLLUP_RESOLUTIONS
+    Each column holds the bucket mean and ReceivedTime is None; with extremes=True the
+    bucket's extremes are added as '<column>_min' / '<column>_max'.
+    tail: optional callable(start, end) returning raw rows, or None on failure, for the part
+    of the window after the ingested data; those rows are bucketed the same way here.
+    Returns (rows, resolution), or (None, 'raw') when raw rows should be served instead.
+    """
+    if not settings.SENSOR_LOCAL_STORE_ENABLED or not site_name or resolution == 'raw':
+        return None, 'raw'
+    if resolution == 'auto':
+        resolution = choose_resolution(start_time, end_time, max_points)
+        if resolution is None:
+            return None, 'raw'
+
+    start_time = to_aware(start_time)
+    end_time = to_aware(end_time)
+    split = _store_split(get_watermark(device_type, site_name), start_time, end_time)
+    if split is None or (split < end_time and tail is None):
+        return None, 'raw'
+
+    model = READING_MODELS[device_type]
+    columns = columns or list(model.API_FIELDS)
+    value_format = model.VALUE_FORMAT
+
+    size = ROLLUP_RESOLUTIONS[resolution]
+    start_epoch = int(start_time.timestamp())
+    first_bucket = datetime.fromtimestamp(start_epoch - start_epoch % size, tz=dt_timezone.utc)
+
+    queryset = SensorRollup.objects.filter(
+        site_name=site_name,
+        pollutant__in=columns,
+        resolution=resolution,
+        bucket_start__gte=first_bucket,
+    )
+    if split < end_time:
+        # Only buckets that ended before covered_until are complete in the rollup tables
+        split_epoch = int(split.timestamp())
+        split = datetime.fromtimestamp(split_epoch - split_epoch % size, tz=dt_timezone.utc)
+        queryset = queryset.filter(bucket_start__lt=split)
+    else:
+        queryset = queryset.filter(bucket_start__lte=end_time)
+
+    rows = {}
+    queryset = queryset.order_by('bucket_start').values_list(
+        'bucket_start', 'pollutant', 'mean_value', 'min_value', 'max_value'
+    )
+    for bucket_start, pollutant, mean_value, min_value, max_value in queryset.iterator(chunk_size=5000):
+        row = rows.get(bucket_start)
+        if row is None:
+            row = rows[bucket_start] = _rollup_row(site_name, bucket_start, columns)
+        row[pollutant] = value_format.format(mean_value)
+        if extremes:
+            row[f'{pollutant}_min'] = value_format.format(min_value)
+            row[f'{pollutant}_max'] = value_format.format(max_value)
+    rows = list(rows.values())
+
+    if split < end_time:
+        tail_rows = tail(to_naive(max(split, start_time)), to_naive(end_time))
+        if tail_rows is None:
+            return None, 'raw'
+        if isinstance(tail_rows, dict):
+            tail_rows = [tail_rows]
+        rows.extend(_aggregate_rows(tail_rows, columns, size, site_name, value_format, extremes))
+    return rows, resolution
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+class TestRunner(DiscoverRunner):
+    """
+    Test runner that puts the shared cache tier in memory, whatever CACHE_BACKEND is set to
+    Runs then never touch each other's entries or a real Redis.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._shared_cache = override_settings(CACHES={
+            **settings.CACHES,
+            'shared': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'shared-cache-tests',
+                'OPTIONS': {'MAX_ENTRIES': 10000},
+            },
+        })
+        self._shared_cache.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._shared_cache.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,8 +1,48 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+import gzip
+import json
+import math
+import time
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipIf
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import override_settings
 from django.test import TestCase
+from django.utils import timezone
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
-from .models import CustomUser
+from .models import CustomUser, THReading, SensorRollup, ExportedFile, ExportJob, ScheduledExport
+from .http_services import get_sensor_session, get_circuit_breaker, reset_sensor_session, SensorAPIError
+from .flight_services import single_flight, across_workers, flight_key
+from .prefetch_services import enqueue_prefetch, prefetch_windows, PREVIOUS_WINDOW, COARSER_ZOOM
+from .cache_backends import TwoLevelCache, CullingFileCache
+from .cache_services import get_segmented_window, segment_cache_key, chart_cache_key, segment_units, chart_result_ttl, seconds_until_stale, from_epoch, to_epoch, utc_now_epoch
+from . import downsampling_services, file_services, job_services, store_services
+from .downsampling_services import (
+    largest_triangle_three_buckets,
+    downsample_indices,
+    envelope_indices,
+    multi_channel_indices,
+    reported_time
+)
+from .stats_services import RunningStats, stats_from_rows
+from .job_services import requeue_stale_jobs
+from .schedule_services import cron_next, parse_cron
+from .store_services import ingest_site, read_window, to_naive, choose_resolution
+from .views import SensorAPIService
+from .management.commands.warm_caches import Command
 
 class UserRegistrationTest(APITestCase):
     def test_user_registration(self):
@@ -39,4 +79,1136 @@ class AuthTest(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('access', response.data)
-        self.assertIn('refresh', response.data)
\ No newline at end of file
+        self.assertIn('refresh', response.data)
+
+class SensorSessionTest(APITestCase):
+    def setUp(self):
+        reset_sensor_session()
+        self.admin = CustomUser.objects.create_user(
+            email='admin@example.com',
+            password='AdminPass123!',
+            role='admin'
+        )
+
+    def test_session_is_reused(self):
+        self.assertIs(get_sensor_session(), get_sensor_session())
+
+    def test_stats_requires_admin(self):
+        url = reverse('sensor_api_stats')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('connections_reused', response.data['connections'])
+
+
+class MultiDeviceFanOutTest(TestCase):
+    def test_sites_are_fetched_concurrently_and_keyed_by_site(self):
+        def slow_fetch(start_time, end_time, site_name):
+            time.sleep(0.2)
+            return [{'SiteName': site_name}]
+
+        site_names = ['SITE-A', 'SITE-B', 'SITE-C', 'SITE-D']
+        now = datetime.now()
+        with mock.patch.object(SensorAPIService, 'get_th_data', side_effect=slow_fetch):
+            started = time.monotonic()
+            data = SensorAPIService.get_multi_device_data('th', now, now, site_names, max_workers=4)
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(list(data.keys()), site_names)
+        self.assertEqual(data['SITE-C'], [{'SiteName': 'SITE-C'}])
+        self.assertLess(elapsed, 0.6)
+
+    def test_pool_threads_close_their_database_connections(self):
+        now = datetime.now()
+        with mock.patch.object(SensorAPIService, 'get_th_data', return_value=[{'SiteName': 'SITE-A'}]), \
+                mock.patch.object(store_services, 'connection') as connection:
+            SensorAPIService.get_multi_device_data('th', now, now, ['SITE-A', 'SITE-B'])
+        self.assertEqual(connection.close.call_count, 2)
+
+
+    def test_endpoint_reads_each_sites_rollups_concurrently(self):
+        def slow_rollups(device_type, site_name, *args):
+            time.sleep(0.2)
+            return [{'SiteName': site_name, 'Temperature': '21.50'}], '1h'
+
+        client = APIClient()
+        client.force_authenticate(user=CustomUser.objects.create_user(email='user@example.com', password='UserPass123!'))
+        site_names = ['SITE-A', 'SITE-B', 'SITE-C', 'SITE-D']
+        with mock.patch.object(SensorAPIService, 'get_rollup_data', side_effect=slow_rollups):
+            started = time.monotonic()
+            response = client.get(reverse('sensor_api_multi_device_data'), {
+                'device_type': 'th', 'site_names': site_names,
+                'start_time': '2025-01-01 00:00:00', 'end_time': '2025-01-02 00:00:00'
+            })
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data.keys()), site_names)
+        self.assertLess(elapsed, 0.6)
+
+class SegmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def fetch(self, start, end):
+        self.calls.append((start, end))
+        rows = []
+        current = start
+        while current <= end:
+            rows.append({'ReportedTimeUTC': current.strftime('%Y-%m-%d %H:%M:%S')})
+            current += timedelta(minutes=10)
+        return rows
+
+    def test_settled_days_are_cached_whole(self):
+        start = datetime(2025, 1, 1, 0, 0, 0)
+        end = datetime(2025, 1, 1, 5, 30, 0)
+        with mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            rows = get_segmented_window('/api/v6/th', 'SITE-A', start, end, self.fetch)
+        self.assertEqual(self.calls, [(datetime(2025, 1, 1), datetime(2025, 1, 1, 23, 59, 59))])
+        self.assertEqual(set_many.call_count, 1)
+        self.assertEqual(len(set_many.call_args.args[0]), 1)
+        self.assertEqual(rows[0]['ReportedTimeUTC'], '2025-01-01 00:00:00')
+        self.assertEqual(rows[-1]['ReportedTimeUTC'], '2025-01-01 05:30:00')
+
+        shifted = get_segmented_window(
+            '/api/v6/th', 'SITE-A', start + timedelta(minutes=5), end + timedelta(minutes=40), self.fetch
+        )
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(shifted[0]['ReportedTimeUTC'], '2025-01-01 00:10:00')
+        self.assertEqual(shifted[-1]['ReportedTimeUTC'], '2025-01-01 06:10:00')
+
+    def test_sliding_live_window_only_fetches_missing_buckets(self):
+        now = utc_now_epoch()
+        hour = now - now % 3600
+        start = from_epoch(hour - 3 * 3600)
+        end = from_epoch(now)
+        get_segmented_window('/api/v6/th', 'SITE-A', start, end, self.fetch)
+        self.assertEqual(len(self.calls), 1)
+
+        # Expire the newest bucket only, as its live TTL would
+        cache.delete(segment_cache_key('/api/v6/th', 'SITE-A', hour, 3600))
+        get_segmented_window('/api/v6/th', 'SITE-A', start, end, self.fetch)
+        self.assertEqual(self.calls[1], (from_epoch(hour), from_epoch(hour + 3599)))
+
+    def test_cold_month_is_a_handful_of_entries(self):
+        now = utc_now_epoch()
+        units = segment_units(now - 30 * 86400, now, 3600, now)
+        self.assertLessEqual(len(units), 31 + 24)
+        self.assertTrue(all(size == 86400 for _, size in units[:29]))
+
+    def test_failed_fetch_is_not_cached(self):
+        start = datetime(2025, 1, 1, 0, 0, 0)
+        end = datetime(2025, 1, 1, 1, 0, 0)
+        self.assertIsNone(get_segmented_window('/api/v6/th', 'SITE-A', start, end, lambda s, e: None))
+        get_segmented_window('/api/v6/th', 'SITE-A', start, end, self.fetch)
+        self.assertEqual(len(self.calls), 1)
+
+
+class TwoLevelCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def worker_cache(self, **options):
+        """A separate TwoLevelCache over the same shared tier, as another worker process would have"""
+        options.setdefault('NAMESPACE_TTLS', {'sensor_api_sites': 300})
+        return TwoLevelCache(f"worker-{self._testMethodName}", {'OPTIONS': options})
+
+    def test_file_tier_lists_its_directory_only_every_few_writes(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        file_cache = CullingFileCache(root, {'OPTIONS': {'MAX_ENTRIES': 20, 'CULL_EVERY': 10}})
+        with mock.patch.object(file_cache, '_list_cache_files', wraps=file_cache._list_cache_files) as listing:
+            file_cache.set_many({f"key{i}": i for i in range(30)})
+        self.assertEqual(listing.call_count, 3)
+        self.assertLessEqual(len(os.listdir(root)), 20 + 10)
+
+    def test_file_tier_counts_writes_across_thread_instances(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        params = {'OPTIONS': {'MAX_ENTRIES': 20, 'CULL_EVERY': 10}}
+        # Each thread gets its own short-lived instance, as Django's per-thread caches do
+        with mock.patch.object(FileBasedCache, '_cull') as cull:
+            def write(thread):
+                file_cache = CullingFileCache(root, params)
+                for i in range(5):
+                    file_cache.set(f"thread{thread}-key{i}", i)
+            with ThreadPoolExecutor(max_workers=6) as executor:
+                list(executor.map(write, range(6)))
+        self.assertEqual(cull.call_count, 3)
+
+    def test_workers_share_one_upstream_fetch(self):
+        with mock.patch.object(SensorAPIService, 'make_request', return_value=[{'SiteName': 'SITE-A'}]) as request:
+            self.assertEqual(SensorAPIService.get_sites(), [{'SiteName': 'SITE-A'}])
+            other = self.worker_cache()
+            self.assertEqual(other.get('sensor_api_sites')['data'], [{'SiteName': 'SITE-A'}])
+            self.assertEqual(other.get('sensor_api_sites')['data'], [{'SiteName': 'SITE-A'}])
+        self.assertEqual(request.call_count, 1)
+
+        counters = other.stats()['namespaces']['sensor_api_sites']
+        self.assertEqual((counters['shared_hits'], counters['local_hits'], counters['misses']), (1, 1, 0))
+
+    def test_namespace_ttl_and_local_size_limit(self):
+        worker = self.worker_cache(LOCAL_MAX_BYTES=4096)
+        with mock.patch.object(worker.shared, 'set', wraps=worker.shared.set) as shared_set:
+            worker.set('sensor_api_sites', ['x'])
+            worker.set('sensor_segment:th:SITE-A:live', ['y'], 60)
+        self.assertEqual(shared_set.call_args_list[0].kwargs['timeout'], 300)
+        self.assertEqual(shared_set.call_args_list[1].kwargs['timeout'], 60)
+        for index in range(20):
+            worker.set(f"sensor_segment:th:SITE-A:{index}", 'x' * 500)
+
+        stats = worker.stats()
+        self.assertLessEqual(stats['local_bytes'], 4096)
+        self.assertLess(stats['local_entries'], 21)
+        # Entries evicted locally are still served from the shared tier
+        self.assertEqual(worker.get('sensor_segment:th:SITE-A:0'), 'x' * 500)
+
+        values = worker.get('sensor_api_sites')
+        values.append('y')
+        self.assertEqual(worker.get('sensor_api_sites'), ['x'])
+
+
+class LTTBEngineTest(TestCase):
+    def make_series(self, size):
+        start = datetime(2025, 1, 1)
+        return [
+            {
+                'timestamp': (start + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S'),
+                'value': f"{math.sin(i / 50) * 10 + (i * 7919 % 13) / 10:.2f}"
+            }
+            for i in range(size)
+        ]
+
+    @skipIf(downsampling_services.np is None, 'NumPy is not installed')
+    def test_numpy_engine_matches_python_engine(self):
+        data = self.make_series(5000)
+        python_result = largest_triangle_three_buckets(data, 300, use_numpy=False)
+        numpy_result = largest_triangle_three_buckets(data, 300, use_numpy=True)
+        self.assertEqual(len(python_result), 300)
+        self.assertEqual(python_result, numpy_result)
+
+    def test_bad_values_fall_back_to_simple_downsampling(self):
+        data = self.make_series(1000)
+        data[10]['value'] = None
+        self.assertEqual(len(largest_triangle_three_buckets(data, 100)), 100)
+
+
+class RecordDownsamplingTest(APITestCase):
+    def make_rows(self, size):
+        start = datetime(2025, 1, 1)
+        # Every timestamp appears twice, as happens when a device resends readings
+        return [
+            {
+                'ReportedTimeUTC': (start + timedelta(minutes=i // 2)).strftime('%Y-%m-%d %H:%M:%S'),
+                'Temperature': f"{math.sin(i / 40) * 10:.2f}",
+                'row': i
+            }
+            for i in range(size)
+        ]
+
+    def test_indices_select_original_rows(self):
+        rows = self.make_rows(2000)
+        indices = downsample_indices(
+            rows, 200, 'lttb', timestamp_key=reported_time, value_key=lambda row: row['Temperature']
+        )
+        self.assertEqual(len(indices), 200)
+        self.assertEqual(indices, sorted(set(indices)))
+
+    def test_th_view_returns_distinct_rows(self):
+        user = CustomUser.objects.create_user(email='user@example.com', password='UserPass123!')
+        self.client.force_authenticate(user=user)
+        rows = self.make_rows(2000)
+        with mock.patch.object(SensorAPIService, 'get_th_data', return_value=rows):
+            response = self.client.get(reverse('sensor_api_th_data'), {
+                'start_time': '2025-01-01 00:00:00',
+                'end_time': '2025-01-02 00:00:00',
+                'max_points': 100
+            })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        returned = [row['row'] for row in response.data]
+        self.assertEqual(len(returned), 100)
+        self.assertEqual(len(set(returned)), 100)
+
+
+class SingleFlightTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_identical_requests_share_one_fetch(self):
+        def slow_get(url, params=None):
+            time.sleep(0.2)
+            response = mock.Mock()
+            response.json.return_value = {'sites': ['SITE-A'], 'count': 1}
+            return response
+
+        params = {'start_time': '2025-01-01 00:00:00', 'end_time': '2025-01-01 01:00:00'}
+        with mock.patch('api.views.sensor_get', side_effect=slow_get) as sensor_get:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(
+                    lambda _: SensorAPIService.make_request('/api/v6/th', dict(params), use_mock=False), range(8)
+                ))
+        self.assertEqual(sensor_get.call_count, 1)
+        self.assertTrue(all(result == {'sites': ['SITE-A'], 'count': 1} for result in results))
+
+    @override_settings(SENSOR_FLIGHT_ACROSS_WORKERS=True)
+    def test_follower_reads_the_segments_another_worker_cached(self):
+        day = to_epoch(datetime(2025, 1, 1))
+        rows = [{'ReportedTimeUTC': '2025-01-01 12:00:00', 'Temperature': '21.50'}]
+        lock_key = f"sensor_flight_lock:{flight_key('/api/v6/th', {'site_name': 'SITE-A', 'start': day, 'end': day + 86400})}"
+        cache.add(lock_key, 'other-worker', 30)
+
+        def other_worker_finishes():
+            cache.set(segment_cache_key('/api/v6/th', 'SITE-A', day, 86400), (utc_now_epoch() + 3600, rows), 3600)
+            cache.delete(lock_key)
+
+        finisher = threading.Timer(0.1, other_worker_finishes)
+        finisher.start()
+        self.addCleanup(finisher.cancel)
+
+        fetch = mock.Mock(side_effect=AssertionError('should not fetch'))
+        window = get_segmented_window('/api/v6/th', 'SITE-A', datetime(2025, 1, 1), datetime(2025, 1, 1, 23, 59, 59), fetch)
+        self.assertEqual(window, rows)
+        fetch.assert_not_called()
+        self.assertIsNone(cache.get(lock_key))
+
+    def test_cross_worker_lock_is_off_without_an_atomic_add(self):
+        self.assertFalse(settings.SENSOR_FLIGHT_ACROSS_WORKERS)
+        with mock.patch.object(cache, 'add') as add:
+            self.assertEqual(across_workers('key', lambda: ['SITE-A'], mock.Mock()), ['SITE-A'])
+        add.assert_not_called()
+
+    def test_failure_reaches_every_waiter(self):
+        release = threading.Event()
+
+        def failing_fetch():
+            release.wait(2)
+            raise SensorAPIError('Connection refused')
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(single_flight, 'health', failing_fetch) for _ in range(3)]
+            time.sleep(0.1)
+            release.set()
+        for future in futures:
+            self.assertRaises(SensorAPIError, future.result)
+
+
+class DegradedUpstreamTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        reset_sensor_session()
+        self.addCleanup(reset_sensor_session)
+        user = CustomUser.objects.create_user(email='user@example.com', password='UserPass123!')
+        self.client.force_authenticate(user=user)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 2
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    @override_settings(SENSOR_BREAKER_FAILURES=3, SENSOR_BREAKER_RESET_SECONDS=0)
+    def test_circuit_fails_fast_and_recovers_in_background(self):
+        session = get_sensor_session()
+        with mock.patch.object(session, 'get', side_effect=requests.exceptions.ConnectionError('down')) as get:
+            for _ in range(3):
+                self.assertIsNone(SensorAPIService.make_request('/api/v6/health', use_mock=False))
+            self.assertEqual(get_circuit_breaker().state, 'open')
+            get.reset_mock()
+            # The probe started here fails too, so the circuit stays open
+            self.assertIsNone(SensorAPIService.make_request('/api/v6/health', use_mock=False))
+            self.wait_for(lambda: not get_circuit_breaker().probing)
+            self.assertEqual(get.call_count, 1)
+            self.assertEqual(get_circuit_breaker().state, 'open')
+
+        with mock.patch.object(session, 'get', return_value=mock.Mock(status_code=200)):
+            self.assertIsNone(SensorAPIService.make_request('/api/v6/health', use_mock=False))
+            self.wait_for(lambda: get_circuit_breaker().state == 'closed')
+
+    def test_stale_sites_are_served_while_refreshing(self):
+        cache.set('sensor_api_sites', {'data': {'sites': ['OLD']}, 'fresh_until': time.time() - 1}, 3600)
+        refreshed = threading.Event()
+
+        def fetch(endpoint, params=None, use_mock=True):
+            refreshed.wait(2)
+            return {'sites': ['NEW']}
+
+        with mock.patch.object(SensorAPIService, 'make_request', side_effect=fetch):
+            response = self.client.get(reverse('sensor_api_sites'))
+            self.assertEqual(response.data, {'sites': ['OLD']})
+            self.assertEqual(response['X-Data-Freshness'], 'stale')
+            refreshed.set()
+            self.wait_for(lambda: cache.get('sensor_api_sites')['data'] == {'sites': ['NEW']})
+
+    def test_mock_sites_are_marked_synthetic_and_not_cached(self):
+        with mock.patch.object(SensorAPIService, 'make_request', return_value=None):
+            response = self.client.get(reverse('sensor_api_sites'))
+        self.assertEqual(response['X-Data-Freshness'], 'synthetic')
+        self.assertEqual(response.data['count'], 20)
+        self.assertIsNone(cache.get('sensor_api_sites'))
+
+    def test_expired_segments_stand_in_when_upstream_fails(self):
+        start = datetime(2025, 1, 1, 0, 0, 0)
+        end = datetime(2025, 1, 1, 0, 59, 59)
+        key = segment_cache_key('/api/v6/th', 'SITE-A', int(start.replace(tzinfo=dt_timezone.utc).timestamp()), 86400)
+        cache.set(key, (utc_now_epoch() - 1, [{'ReportedTimeUTC': '2025-01-01 00:10:00'}]), 3600)
+        rows = get_segmented_window('/api/v6/th', 'SITE-A', start, end, lambda s, e: None)
+        self.assertEqual(rows, [{'ReportedTimeUTC': '2025-01-01 00:10:00'}])
+
+
+class WarmCachesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.requests = []
+
+    def make_request(self, endpoint, params=None, use_mock=True):
+        self.requests.append(endpoint)
+        if endpoint == '/api/v6/sites':
+            return {'sites': ['UTIS0001-TH-V6_1'], 'count': 1}
+        if endpoint == '/api/v6/health':
+            return {'status': 'ok'}
+        return [{'ReportedTimeUTC': params['end_time'], 'Temperature': '20.0'}]
+
+    def test_refreshes_lookups_and_preloads_windows(self):
+        with mock.patch.object(SensorAPIService, 'make_request', side_effect=self.make_request):
+            call_command('warm_caches', '--once', '--windows', '24', '168', stdout=io.StringIO())
+            self.assertEqual(self.requests.count('/api/v6/th'), 1)
+            self.assertGreater(seconds_until_stale('sensor_api_sites'), 60)
+
+            # A user's dashboard window is now served from the warmed segments
+            end = from_epoch(utc_now_epoch())
+            SensorAPIService.get_th_data(end - timedelta(hours=24), end, 'UTIS0001-TH-V6_1')
+            self.assertEqual(self.requests.count('/api/v6/th'), 1)
+
+            # Entries still fresh well beyond the check interval are left alone
+            call_command('warm_caches', '--once', '--windows', stdout=io.StringIO())
+        self.assertEqual(self.requests.count('/api/v6/sites'), 1)
+        self.assertEqual(self.requests.count('/api/v6/health'), 1)
+
+
+    def test_refuses_to_preload_more_than_the_shared_tier_holds(self):
+        sites = [f"UTIS{i:04d}-TH-V6_1" for i in range(20)]
+        with mock.patch.object(cache.shared, '_max_entries', 1000), \
+                mock.patch.object(SensorAPIService, 'make_request', side_effect=self.make_request):
+            with self.assertRaisesMessage(CommandError, 'MAX_ENTRIES (1000)'):
+                call_command('warm_caches', '--once', '--sites', *sites, stdout=io.StringIO())
+        self.assertNotIn('/api/v6/th', self.requests)
+
+    def test_daemon_warms_only_the_sites_that_fit(self):
+        sites = {'sites': [f"UTIS{i:04d}-TH-V6_1" for i in range(20)], 'count': 20}
+        out = io.StringIO()
+        with mock.patch.object(cache.shared, '_max_entries', 1000), \
+                mock.patch.object(SensorAPIService, 'get_sites', return_value=sites), \
+                mock.patch.object(SensorAPIService, 'get_window_data', return_value=[]) as window:
+            Command(stdout=out).warm_windows(None, [24 * 30], strict=False)
+        warmed = [call.args[3] for call in window.call_args_list]
+        self.assertIn('Warming the first', out.getvalue())
+        self.assertEqual(warmed, sites['sites'][:len(warmed)])
+        self.assertTrue(0 < len(warmed) < 20)
+
+class ChartResultCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user = CustomUser.objects.create_user(email='user@example.com', password='UserPass123!')
+        self.client.force_authenticate(user=user)
+        start = datetime(2025, 1, 1)
+        self.rows = [
+            {'ReportedTimeUTC': (start + timedelta(seconds=40 * i)).strftime('%Y-%m-%d %H:%M:%S'),
+             'Temperature': f"{math.sin(i / 40) * 10:.2f}"}
+            for i in range(2000)
+        ]
+
+    def get_chart(self, **params):
+        query = {'start_time': '2025-01-01 00:00:00', 'end_time': '2025-01-02 00:00:00', 'max_points': 100}
+        query.update(params)
+        return self.client.get(reverse('get_air_quality_data', args=['aq_SITE-A', 'Temperature']), query)
+
+    def test_repeat_views_skip_fetch_and_transform(self):
+        with mock.patch.object(SensorAPIService, 'get_th_data', return_value=self.rows) as fetch:
+            first = self.get_chart()
+            with mock.patch('api.views.downsample_records') as downsample:
+                second = self.get_chart()
+            other = self.get_chart(max_points=50)
+
+        self.assertEqual(fetch.call_count, 2)
+        downsample.assert_not_called()
+        self.assertEqual((first['X-Result-Cache'], second['X-Result-Cache']), ('miss', 'hit'))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(len(second.json()), 100)
+        self.assertEqual(len(other.json()), 50)
+
+    def test_live_windows_expire_sooner(self):
+        now = from_epoch(utc_now_epoch())
+        self.assertEqual(chart_result_ttl(now - timedelta(days=2)), settings.SENSOR_CHART_CACHE_CLOSED_TTL)
+        self.assertEqual(chart_result_ttl(now), settings.SENSOR_CHART_CACHE_LIVE_TTL)
+
+    def test_live_windows_share_a_key_within_the_live_ttl(self):
+        step = settings.SENSOR_CHART_CACHE_LIVE_TTL
+        now_epoch = utc_now_epoch() // step * step
+        with mock.patch('api.cache_services.utc_now_epoch', return_value=now_epoch + step - 1):
+            keys = {
+                chart_cache_key(start_time=from_epoch(end - 86400), end_time=from_epoch(end), max_points=100)
+                for end in range(now_epoch, now_epoch + step)
+            }
+            self.assertEqual(len(keys), 1)
+            # Settled history keeps exact times
+            old = now_epoch - 3 * 86400
+            self.assertNotEqual(
+                chart_cache_key(start_time=from_epoch(old - 86400), end_time=from_epoch(old), max_points=100),
+                chart_cache_key(start_time=from_epoch(old - 86399), end_time=from_epoch(old + 1), max_points=100)
+            )
+
+
+class PrefetchTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        reset_sensor_session()
+
+    def test_previous_window_and_coarser_zoom(self):
+        start, end = datetime(2025, 1, 2), datetime(2025, 1, 3)
+        self.assertEqual(prefetch_windows(start, end, datetime(2025, 6, 1)), [
+            (PREVIOUS_WINDOW, datetime(2025, 1, 1), datetime(2025, 1, 1, 23, 59, 59)),
+            (COARSER_ZOOM, datetime(2025, 1, 1, 12), datetime(2025, 1, 3, 12)),
+        ])
+        # A window ending now zooms out into the past only
+        self.assertEqual(prefetch_windows(start, end, end)[1], (COARSER_ZOOM, datetime(2025, 1, 1), end))
+
+    def test_queue_runs_by_priority_without_duplicates(self):
+        started = threading.Event()
+        release = threading.Event()
+        order = []
+
+        def blocker():
+            started.set()
+            release.wait(2)
+            return []
+
+        self.assertTrue(enqueue_prefetch('blocker', PREVIOUS_WINDOW, blocker))
+        started.wait(2)
+        self.assertTrue(enqueue_prefetch('zoom', COARSER_ZOOM, lambda: order.append('zoom')))
+        self.assertTrue(enqueue_prefetch('previous', PREVIOUS_WINDOW, lambda: order.append('previous')))
+        self.assertFalse(enqueue_prefetch('zoom', COARSER_ZOOM, lambda: order.append('zoom')))
+        release.set()
+
+        deadline = time.monotonic() + 2
+        while len(order) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(order, ['previous', 'zoom'])
+
+    def test_series_endpoints_prefetch_only_when_asked(self):
+        user = CustomUser.objects.create_user(email='user@example.com', password='UserPass123!')
+        self.client.force_authenticate(user=user)
+        rows = [{'ReportedTimeUTC': '2025-01-01 00:10:00', 'Temperature': '20.0'}]
+        url = reverse('get_air_quality_data', args=['aq_SITE-A', 'Temperature'])
+        query = {'start_time': '2025-01-01 00:00:00', 'end_time': '2025-01-01 06:00:00'}
+
+        with mock.patch.object(SensorAPIService, 'get_th_data', return_value=rows), \
+                mock.patch('api.views.schedule_prefetch') as schedule:
+            self.client.get(url, query)
+            schedule.assert_not_called()
+            self.client.get(url, dict(query, prefetch='true'))
+        schedule.assert_called_once()
+        self.assertEqual(schedule.call_args.args[:4], (
+            '/api/v6/th', 'SITE-A', datetime(2025, 1, 1), datetime(2025, 1, 1, 6)
+        ))
+
+
+class MultiChannelDownsamplingTest(APITestCase):
+    def make_rows(self, size, spike_at):
+        start = datetime(2025, 1, 1)
+        return [
+            {
+                'ReportedTimeUTC': (start + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S'),
+                'Temperature': f"{20 + math.sin(i / 100):.2f}",
+                'PM2_5': '500.00' if i == spike_at else '10.00'
+            }
+            for i in range(size)
+        ]
+
+    def test_spike_in_secondary_column_is_kept(self):
+        rows = self.make_rows(5000, spike_at=1234)
+        single = downsample_indices(
+            rows, 100, 'lttb', timestamp_key=reported_time, value_key=lambda row: row['Temperature']
+        )
+        multi = multi_channel_indices(rows, 100, ['Temperature', 'PM2_5'])
+        self.assertNotIn(1234, single)
+        self.assertIn(1234, multi)
+        self.assertLessEqual(len(multi), 100)
+
+    def test_unknown_column_is_rejected(self):
+        user = CustomUser.objects.create_user(email='user@example.com', password='UserPass123!')
+        self.client.force_authenticate(user=user)
+        response = self.client.get(reverse('sensor_api_th_data'), {
+            'start_time': '2025-01-01 00:00:00',
+            'end_time': '2025-01-02 00:00:00',
+            'columns': 'Temperature,VOC'
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EnvelopeDownsamplingTest(TestCase):
+    def make_series(self, size):
+        x = [1735689600 + 60 * i for i in range(size)]
+        y = [math.sin(i / 30) * 10 + (i * 7919 % 17) / 10 for i in range(size)]
+        return x, y
+
+    def test_m4_keeps_bucket_extremes_within_budget(self):
+        x, y = self.make_series(10000)
+        indices = envelope_indices(x, y, 400, 'm4', use_numpy=False)
+        self.assertLessEqual(len(indices), 400)
+        self.assertEqual(indices, sorted(set(indices)))
+        self.assertIn(y.index(max(y)), indices)
+        self.assertIn(y.index(min(y)), indices)
+        self.assertIn(0, indices)
+        self.assertIn(9999, indices)
+
+    @skipIf(downsampling_services.np is None, 'NumPy is not installed')
+    def test_numpy_engine_matches_python_engine(self):
+        x, y = self.make_series(10000)
+        for algorithm in ('m4', 'minmax'):
+            self.assertEqual(
+                envelope_indices(x, y, 300, algorithm, use_numpy=False),
+                envelope_indices(x, y, 300, algorithm, use_numpy=True)
+            )
+
+
+class LocalStoreTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def fetch(self, start, end):
+        self.calls += 1
+        rows = []
+        current = start
+        while current <= end:
+            rows.append({
+                'SiteName': 'UTIS0001-TH-V6_1',
+                'ReportedTimeUTC': current.strftime('%Y-%m-%d %H:%M:%S'),
+                'ReceivedTime': current.strftime('%Y-%m-%d %H:%M:%S'),
+                'Temperature': '23.40',
+                'Humidity': '65.50'
+            })
+            current += timedelta(minutes=30)
+        return rows
+
+    def test_ingest_is_incremental_and_serves_covered_windows(self):
+        received, covered_until = ingest_site('th', 'UTIS0001-TH-V6_1', self.fetch, lookback_days=2)
+        self.assertGreater(received, 0)
+        self.assertEqual(THReading.objects.count(), received)
+
+        # A second run only asks for the gap since the watermark and skips duplicates
+        self.calls = 0
+        ingest_site('th', 'UTIS0001-TH-V6_1', self.fetch)
+        self.assertLessEqual(self.calls, 1)
+        times = list(THReading.objects.values_list('reported_time', flat=True))
+        self.assertEqual(len(times), len(set(times)))
+
+        end = to_naive(covered_until)
+        start = end - timedelta(hours=6)
+        with mock.patch.object(SensorAPIService, 'fetch_window') as fetch_window:
+            rows = SensorAPIService.get_th_data(start, end, 'UTIS0001-TH-V6_1')
+        fetch_window.assert_not_called()
+        self.assertTrue(rows)
+        self.assertEqual(rows[0]['Temperature'], '23.40')
+        self.assertIsNone(rows[0]['PM2_5'])
+
+    def test_rollups_are_maintained_and_chosen_by_max_points(self):
+        received, covered_until = ingest_site('th', 'UTIS0001-TH-V6_1', self.fetch, lookback_days=2)
+        hourly = SensorRollup.objects.filter(site_name='UTIS0001-TH-V6_1', pollutant='Temperature', resolution='1h')
+        self.assertTrue(hourly.exists())
+        self.assertEqual(sum(hourly.values_list('count', flat=True)), received)
+
+        self.assertEqual(choose_resolution(datetime(2025, 1, 1), datetime(2025, 1, 31), 500), '1h')
+        self.assertIsNone(choose_resolution(datetime(2025, 1, 1), datetime(2025, 1, 1, 2), 500))
+
+        user = CustomUser.objects.create_user(email='user@example.com', password='UserPass123!')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        end = to_naive(covered_until)
+        response = client.get(
+            reverse('get_air_quality_data', args=['aq_UTIS0001-TH-V6_1', 'Temperature']),
+            {
+                'start_time': (end - timedelta(hours=30)).strftime('%Y-%m-%d %H:%M:%S'),
+                'end_time': end.strftime('%Y-%m-%d %H:%M:%S'),
+                'max_points': 20
+            }
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Data-Resolution'], '1h')
+        self.assertEqual(response.json()[0]['value'], '23.40')
+        self.assertIn('max', response.json()[0])
+
+        # Rollup rows keep the raw rows' keys; the extremes are only added for charts
+        rollups, _ = SensorAPIService.get_rollup_data('th', 'UTIS0001-TH-V6_1', end - timedelta(hours=30), end, '1h', 20)
+        raw = read_window('th', 'UTIS0001-TH-V6_1', end - timedelta(hours=6), end)
+        self.assertEqual(set(rollups[0]), set(raw[0]))
+        self.assertIsNone(rollups[0]['ReceivedTime'])
+
+    def test_late_reading_only_rewrites_the_buckets_it_falls_in(self):
+        # Pin ingestion to midnight so readings land on the hour and half hour
+        with mock.patch.object(store_services, 'utc_now_epoch', return_value=to_epoch(datetime(2025, 1, 3))):
+            ingest_site('th', 'UTIS0001-TH-V6_1', self.fetch, lookback_days=2)
+        late = datetime(2025, 1, 1, 0, 1, tzinfo=dt_timezone.utc)
+        THReading.objects.create(site_name='UTIS0001-TH-V6_1', reported_time=late, temperature=30.0)
+        rollups = SensorRollup.objects.filter(site_name='UTIS0001-TH-V6_1', pollutant='Temperature')
+        before = {(resolution, bucket): count for resolution, bucket, count in rollups.values_list('resolution', 'bucket_start', 'count')}
+
+        # A new 1m bucket next to the first reading's; the coarser buckets already exist
+        # and are merged again from the finer rollups
+        store_services.update_rollups('th', 'UTIS0001-TH-V6_1', late, late)
+        self.assertEqual(rollups.count(), len(before) + 1)
+        self.assertNotIn(('1m', late), before)
+        self.assertIn(('1m', late - timedelta(minutes=1)), before)
+        for resolution, size in store_services.ROLLUP_RESOLUTIONS.items():
+            epoch = int(late.timestamp())
+            bucket = rollups.get(resolution=resolution, bucket_start=datetime.fromtimestamp(epoch - epoch % size, tz=dt_timezone.utc))
+            self.assertEqual(bucket.count, before.get((resolution, bucket.bucket_start), 0) + 1)
+            self.assertEqual(bucket.max_value, 30.0)
+        hourly = rollups.filter(resolution='1h')
+        self.assertEqual(sum(hourly.values_list('count', flat=True)), THReading.objects.exclude(temperature=None).count())
+
+    def test_window_past_the_watermark_only_fetches_the_tail(self):
+        received, covered_until = ingest_site('th', 'UTIS0001-TH-V6_1', self.fetch, lookback_days=2)
+        covered_until = to_naive(covered_until)
+        start = covered_until - timedelta(hours=6)
+        end = covered_until + timedelta(hours=2)
+
+        with mock.patch.object(SensorAPIService, 'fetch_window', side_effect=lambda endpoint, s, e, site, use_mock: self.fetch(s, e)) as fetch_window:
+            rows = SensorAPIService.get_th_data(start, end, 'UTIS0001-TH-V6_1')
+            bucket = timedelta(seconds=settings.SENSOR_SEGMENT_BUCKET_SECONDS)
+            for call in fetch_window.call_args_list:
+                self.assertGreaterEqual(call.args[1], covered_until - bucket)
+            self.assertTrue(fetch_window.called)
+
+            times = [row['ReportedTimeUTC'] for row in rows]
+            self.assertEqual(times, sorted(set(times)))
+            self.assertLess(times[0], (start + timedelta(minutes=30)).strftime('%Y-%m-%d %H:%M:%S'))
+            self.assertGreater(times[-1], covered_until.strftime('%Y-%m-%d %H:%M:%S'))
+
+            data, resolution = SensorAPIService.get_rollup_data(
+                'th', 'UTIS0001-TH-V6_1', start, end, '1h', 500, ['Temperature']
+            )
+        self.assertEqual(resolution, '1h')
+        self.assertGreater(data[-1]['ReportedTimeUTC'], covered_until.strftime('%Y-%m-%d %H:%M:%S'))
+        self.assertEqual(data[-1]['Temperature'], '23.40')
+        buckets = [row['ReportedTimeUTC'] for row in data]
+        self.assertEqual(buckets, sorted(set(buckets)))
+
+    def test_uncovered_window_is_not_served_locally(self):
+        start = datetime(2020, 1, 1)
+        self.assertIsNone(read_window('th', 'UTIS0001-TH-V6_1', start, start + timedelta(hours=1)))
+
+
+class StreamingStatsTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_merged_summaries_match_a_single_pass(self):
+        values = [math.sin(i / 7) * 20 + i % 11 for i in range(5000)]
+        whole = RunningStats()
+        for value in values:
+            whole.add(value)
+        left, right = RunningStats(), RunningStats()
+        for value in values[:1234]:
+            left.add(value)
+        for value in values[1234:]:
+            right.add(value)
+        merged = left.merge(right).to_dict()
+
+        expected = sorted(values)
+        self.assertEqual(merged['count'], 5000)
+        self.assertAlmostEqual(merged['mean'], sum(values) / len(values))
+        self.assertAlmostEqual(merged['std'], whole.std)
+        self.assertEqual(merged['min'], expected[0])
+        self.assertEqual(merged['max'], expected[-1])
+        for q, key in ((0.50, 'p50'), (0.95, 'p95'), (0.99, 'p99')):
+            exact = expected[int(q * (len(values) - 1))]
+            self.assertLessEqual(abs(merged[key] - exact), abs(exact) * 0.011 + 1e-9)
+
+    def test_pollutant_stats_endpoint(self):
+        user = CustomUser.objects.create_user(email='user@example.com', password='UserPass123!')
+        self.client.force_authenticate(user=user)
+
+        def window(endpoint, start, end, site_name=None):
+            return [{'ReportedTimeUTC': start.strftime('%Y-%m-%d %H:%M:%S'), 'PM2_5': '10.00'},
+                    {'ReportedTimeUTC': end.strftime('%Y-%m-%d %H:%M:%S'), 'PM2_5': '20.00'}]
+
+        with mock.patch.object(SensorAPIService, 'get_uncached_window', side_effect=window) as fetch:
+            response = self.client.get(reverse('get_pollutant_stats', args=['aq_UTIS0001-TH-V6_1']), {
+                'pollutant': 'PM2_5',
+                'start_time': '2025-01-01 12:00:00',
+                'end_time': '2025-01-03 12:00:00'
+            })
+            # The whole day in the middle is summarised once and then served from cache
+            self.client.get(reverse('get_pollutant_stats', args=['aq_UTIS0001-TH-V6_1']), {
+                'pollutant': 'PM2_5',
+                'start_time': '2025-01-02 00:00:00',
+                'end_time': '2025-01-02 23:59:59'
+            })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 6)
+        self.assertEqual(response.data['mean'], 15.0)
+        self.assertEqual(fetch.call_count, 3)
+
+    def test_single_reading_window(self):
+        # The sensor API returns a bare object rather than a list when a window holds one reading
+        stats = stats_from_rows({'ReportedTimeUTC': '2025-01-01 00:00:00', 'PM2_5': '12.50'}, 'PM2_5')
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.to_dict()['mean'], 12.5)
+
+
+class StreamingExportTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = CustomUser.objects.create_user(email='admin@example.com', password='AdminPass123!', role='admin')
+        self.client.force_authenticate(user=self.admin)
+        self.params = {'start_time': '2025-01-01 00:00:00', 'end_time': '2025-01-03 23:59:59'}
+
+    def window(self, endpoint, start, end, site_name=None):
+        return [{'ReportedTimeUTC': start.strftime('%Y-%m-%d %H:%M:%S'), 'Temperature': '21.50'}]
+
+    def run_worker(self):
+        call_command('run_export_worker', '--once', stdout=io.StringIO())
+
+    def test_queued_export_is_written_by_the_worker(self):
+        response = self.client.get(reverse('export_sensor_th_data'), {**self.params, 'format': 'json'})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        status_url = response.data['status_url']
+        self.assertEqual(self.client.get(status_url).data['status'], 'pending')
+
+        with mock.patch.object(SensorAPIService, 'get_uncached_window', side_effect=self.window) as fetch:
+            self.run_worker()
+        self.assertEqual(fetch.call_count, 3)
+
+        job = self.client.get(status_url).data
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['rows_written'], 3)
+        self.assertEqual(job['progress'], 1.0)
+        exported_file = ExportedFile.objects.get(id=job['file_id'])
+        self.assertEqual(exported_file.created_by, self.admin)
+        with open(exported_file.file_path, encoding='utf-8') as export_file:
+            rows = json.load(export_file)
+        os.remove(exported_file.file_path)
+        self.assertEqual([row['ReportedTimeUTC'][:10] for row in rows], ['2025-01-01', '2025-01-02', '2025-01-03'])
+
+        other = CustomUser.objects.create_user(email='other@example.com', password='OtherPass123!')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(status_url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_racing_requests_share_one_export_job(self):
+        first = self.client.get(reverse('export_sensor_th_data'), self.params)
+        # Both requests missed each other's job in the lookup; the constraint settles the race
+        with mock.patch('api.views.find_existing_export', return_value=(None, None)):
+            second = self.client.get(reverse('export_sensor_th_data'), self.params)
+        self.assertEqual(second.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(second.data['message'], 'Export already in progress')
+        self.assertEqual(second.data['job_id'], first.data['job_id'])
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+    def test_exports_do_not_fill_the_segment_cache(self):
+        with mock.patch.object(SensorAPIService, 'fetch_window', side_effect=lambda endpoint, start, end, site_name, use_mock: self.window(endpoint, start, end)) as fetch:
+            rows = list(SensorAPIService.iter_window_data('/api/v6/th', datetime(2025, 1, 1), datetime(2025, 1, 3, 23, 59, 59), 'A'))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(fetch.call_count, 3)
+        for day in range(3):
+            unit_start = to_epoch(datetime(2025, 1, 1 + day))
+            self.assertIsNone(cache.get(segment_cache_key('/api/v6/th', 'A', unit_start, 86400)))
+
+    def test_only_jobs_without_a_recent_heartbeat_are_requeued(self):
+        started = timezone.now() - timedelta(hours=2)
+        alive, dead = (
+            ExportJob.objects.create(
+                kind='th', params=self.params, status='running', created_by=self.admin,
+                started_at=started, heartbeat_at=heartbeat_at
+            )
+            for heartbeat_at in (timezone.now(), started)
+        )
+        self.assertEqual(requeue_stale_jobs(60), 1)
+        alive.refresh_from_db()
+        dead.refresh_from_db()
+        self.assertEqual((alive.status, dead.status), ('running', 'pending'))
+
+    def test_partition_writers_keep_the_heartbeat_fresh(self):
+        job = ExportJob.objects.create(
+            kind='multi', params={**self.params, 'device_type': 'th', 'site_names': ['A'], 'layout': 'per_site'},
+            status='running', created_by=self.admin, started_at=timezone.now()
+        )
+        rows = [{'ReportedTimeUTC': '2025-01-01 00:00:00', 'Temperature': '21.50'}] * 3
+        with mock.patch.object(job_services, 'HEARTBEAT_SECONDS', 0), \
+                mock.patch.object(job_services, 'heartbeat') as beat:
+            job = job_services.run_partitioned_export_job(job, {'A': lambda: iter(rows)})
+        os.remove(job.exported_file.file_path)
+        # Once per row while the site is written, then once when it is added to the archive
+        self.assertEqual([call.kwargs for call in beat.call_args_list], [{}] * 3 + [{'rows_written': 3, 'progress': 1.0}])
+        self.assertEqual(job.status, 'done')
+
+    def test_streamed_multi_device_export(self):
+        with mock.patch.object(SensorAPIService, 'get_uncached_window', side_effect=self.window):
+            response = self.client.get(reverse('export_multi_device_data'), {
+                **self.params, 'device_type': 'th', 'site_names': ['A', 'B'], 'stream': 'true'
+            })
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'ReportedTimeUTC,Temperature,SiteName')
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(ExportedFile.objects.count(), 0)
+
+    def test_upstream_failure_is_not_exported(self):
+        with mock.patch.object(SensorAPIService, 'get_uncached_window', return_value=None):
+            response = self.client.get(reverse('export_sensor_th_data'), {**self.params, 'stream': 'true'})
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+            response = self.client.get(reverse('export_sensor_th_data'), self.params)
+            self.run_worker()
+        job = self.client.get(response.data['status_url']).data
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['error'], 'Failed to fetch data from sensor API')
+        self.assertEqual(ExportedFile.objects.count(), 0)
+
+    @skipIf(file_services.pa is None, 'pyarrow is not installed')
+    def test_columnar_exports_have_typed_columns(self):
+        for file_format in ('parquet', 'arrow'):
+            response = self.client.get(reverse('export_sensor_th_data'), {**self.params, 'format': file_format})
+            with mock.patch.object(SensorAPIService, 'get_uncached_window', side_effect=self.window):
+                self.run_worker()
+            job = self.client.get(response.data['status_url']).data
+            self.assertEqual(job['status'], 'done')
+
+            download = self.client.get(reverse('download_exported_file', args=[job['file_id']]))
+            self.assertEqual(download['Content-Type'], file_services.CONTENT_TYPES[file_format])
+            body = b''.join(download.streaming_content)
+            download.close()
+            os.remove(ExportedFile.objects.get(id=job['file_id']).file_path)
+
+            if file_format == 'parquet':
+                table = file_services.pq.read_table(file_services.pa.BufferReader(body))
+            else:
+                table = file_services.pa.ipc.open_file(file_services.pa.BufferReader(body)).read_all()
+            self.assertEqual(table.num_rows, 3)
+            self.assertEqual(table.schema.field('Temperature').type, file_services.pa.float64())
+            # Parquet has no second resolution, so the timestamps come back in milliseconds
+            self.assertTrue(file_services.pa.types.is_timestamp(table.schema.field('ReportedTimeUTC').type))
+            self.assertEqual(table.schema.field('ReportedTimeUTC').type.tz, 'UTC')
+            self.assertEqual(table.column('Temperature').to_pylist(), [21.5, 21.5, 21.5])
+            self.assertEqual(table.column('ReportedTimeUTC')[0].as_py().isoformat(), '2025-01-01T00:00:00+00:00')
+
+    def test_gzip_ndjson_export(self):
+        response = self.client.get(reverse('export_sensor_th_data'), {
+            **self.params, 'format': 'ndjson', 'compress': 'gzip'
+        })
+        with mock.patch.object(SensorAPIService, 'get_uncached_window', side_effect=self.window):
+            self.run_worker()
+        job = self.client.get(response.data['status_url']).data
+        exported_file = ExportedFile.objects.get(id=job['file_id'])
+        self.assertTrue(exported_file.filename.endswith('.ndjson.gz'))
+        self.assertEqual(exported_file.get_file_format(), 'ndjson')
+        with gzip.open(exported_file.file_path, 'rt', encoding='utf-8') as export_file:
+            self.assertEqual(len([json.loads(line) for line in export_file]), 3)
+
+        url = reverse('download_exported_file', args=[exported_file.id])
+        compressed = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed['Content-Type'], 'application/x-ndjson')
+        self.assertIn('.ndjson"', compressed['Content-Disposition'])
+        body = gzip.decompress(b''.join(compressed.streaming_content))
+        compressed.close()
+
+        plain = self.client.get(url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(plain.streaming_content), body)
+        os.remove(exported_file.file_path)
+
+        with mock.patch.object(SensorAPIService, 'get_uncached_window', side_effect=self.window):
+            streamed = self.client.get(reverse('export_sensor_th_data'), {
+                **self.params, 'format': 'ndjson', 'compress': 'gzip', 'stream': 'true'
+            })
+            self.assertEqual(streamed['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(b''.join(streamed.streaming_content)), body)
+
+    def test_identical_exports_are_deduplicated(self):
+        url = reverse('export_sensor_th_data')
+        first = self.client.get(url, {**self.params, 'site_name': 'A'})
+        again = self.client.get(url, {**self.params, 'site_name': 'A'})
+        self.assertEqual(again.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(again.data['job_id'], first.data['job_id'])
+
+        with mock.patch.object(SensorAPIService, 'get_uncached_window', side_effect=self.window):
+            self.run_worker()
+        file_id = self.client.get(first.data['status_url']).data['file_id']
+
+        # A closed window is shared with other admins, without another upstream pull
+        other = CustomUser.objects.create_user(email='other@example.com', password='OtherPass123!', role='admin')
+        self.client.force_authenticate(user=other)
+        reused = self.client.get(url, {**self.params, 'site_name': 'A'})
+        self.assertEqual(reused.status_code, status.HTTP_200_OK)
+        self.assertEqual(reused.data['file_id'], file_id)
+        download = self.client.get(reverse('download_exported_file', args=[file_id]))
+        self.assertEqual(download.status_code, status.HTTP_200_OK)
+        download.close()
+        os.remove(ExportedFile.objects.get(id=file_id).file_path)
+
+        # A different format or a window reaching now is a separate export
+        self.assertEqual(self.client.get(url, {**self.params, 'site_name': 'A', 'format': 'json'}).status_code, 202)
+        live = {'start_time': '2025-01-01 00:00:00', 'end_time': (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')}
+        mine = self.client.get(url, live)
+        self.client.force_authenticate(user=self.admin)
+        self.assertNotEqual(self.client.get(url, live).data['job_id'], mine.data['job_id'])
+
+    def test_download_ranges_and_etags(self):
+        response = self.client.get(reverse('export_sensor_th_data'), self.params)
+        with mock.patch.object(SensorAPIService, 'get_uncached_window', side_effect=self.window):
+            self.run_worker()
+        exported_file = ExportedFile.objects.get(id=self.client.get(response.data['status_url']).data['file_id'])
+        url = reverse('download_exported_file', args=[exported_file.id])
+        with open(exported_file.file_path, 'rb') as export_file:
+            content = export_file.read()
+
+        full = self.client.get(url)
+        etag = full['ETag']
+        self.assertEqual(etag, f'"{exported_file.content_hash}"')
+        self.assertEqual(full['Accept-Ranges'], 'bytes')
+        full.close()
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        partial = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(partial.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(partial['Content-Range'], f'bytes 10-19/{len(content)}')
+        self.assertEqual(b''.join(partial.streaming_content), content[10:20])
+
+        tail = self.client.get(url, HTTP_RANGE='bytes=-5', HTTP_IF_RANGE=etag)
+        self.assertEqual(b''.join(tail.streaming_content), content[-5:])
+        stale = self.client.get(url, HTTP_RANGE='bytes=-5', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(stale.status_code, status.HTTP_200_OK)
+        stale.close()
+
+        beyond = self.client.get(url, HTTP_RANGE=f'bytes={len(content)}-')
+        self.assertEqual(beyond.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(beyond['Content-Range'], f'bytes */{len(content)}')
+
+        with override_settings(EXPORT_SENDFILE_MODE='x-accel-redirect'):
+            handed_off = self.client.get(url)
+        self.assertEqual(
+            handed_off['X-Accel-Redirect'],
+            f"/protected-exports/air_quality/{exported_file.filename}"
+        )
+        self.assertEqual(handed_off.content, b'')
+        os.remove(exported_file.file_path)
+
+    def test_per_site_archive_export(self):
+        shared_rows = [{'ReportedTimeUTC': '2025-01-01 00:00:00', 'Temperature': '21.50'}]
+        params = {**self.params, 'device_type': 'th', 'site_names': ['A', 'B/C'], 'layout': 'per_site'}
+        response = self.client.get(reverse('export_multi_device_data'), params)
+        with mock.patch.object(SensorAPIService, 'get_uncached_window', return_value=shared_rows):
+            self.run_worker()
+        job = self.client.get(response.data['status_url']).data
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['rows_written'], 6)
+        exported_file = ExportedFile.objects.get(id=job['file_id'])
+        self.assertEqual(exported_file.get_file_format(), 'zip')
+        with zipfile.ZipFile(exported_file.file_path) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['A.csv', 'B_C.csv'])
+            lines = archive.read('B_C.csv').decode().splitlines()
+        os.remove(exported_file.file_path)
+        self.assertEqual(lines[0], 'ReportedTimeUTC,Temperature,SiteName')
+        self.assertEqual(lines[1:], ['2025-01-01 00:00:00,21.50,B/C'] * 3)
+        # Upstream rows are copied, never tagged in place
+        self.assertNotIn('SiteName', shared_rows[0])
+
+        with mock.patch.object(SensorAPIService, 'get_uncached_window', return_value=shared_rows):
+            streamed = self.client.get(reverse('export_multi_device_data'), {
+                **params, 'format': 'ndjson', 'stream': 'true'
+            })
+            self.assertEqual(streamed['Content-Type'], 'application/zip')
+            body = b''.join(streamed.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['A.ndjson', 'B_C.ndjson'])
+            self.assertEqual(len(archive.read('A.ndjson').splitlines()), 3)
+
+    def test_scheduled_export_runs_and_records_duration(self):
+        schedule = ScheduledExport.objects.create(
+            name='Nightly TH', schedule='30 2 * * *', device_type='th', site_names=['A'],
+            created_by=self.admin, next_run_at=timezone.now() - timedelta(minutes=1)
+        )
+        with mock.patch.object(SensorAPIService, 'get_uncached_window', side_effect=self.window) as fetch:
+            call_command('run_scheduled_exports', '--once', '--run-jobs', stdout=io.StringIO())
+        # A daily schedule exports the previous whole UTC day
+        self.assertEqual(fetch.call_count, 1)
+        start, end = fetch.call_args[0][1:3]
+        self.assertEqual((start.hour, start.minute, end.hour, end.minute), (0, 0, 23, 59))
+
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.last_status, 'done')
+        self.assertIsNotNone(schedule.last_duration_seconds)
+        self.assertGreater(schedule.next_run_at, timezone.now())
+        self.assertEqual(schedule.jobs.get().exported_file, schedule.last_exported_file)
+
+        listed = self.client.get(reverse('get_scheduled_exports')).data
+        self.assertEqual(listed[0]['file']['file_id'], schedule.last_exported_file.id)
+        os.remove(schedule.last_exported_file.file_path)
+
+    def test_cron_next(self):
+        after = datetime(2025, 1, 1, 12, 0, tzinfo=dt_timezone.utc)
+        self.assertEqual(cron_next('30 2 * * *', after), datetime(2025, 1, 2, 2, 30, tzinfo=dt_timezone.utc))
+        self.assertEqual(cron_next('*/15 * * * *', after), datetime(2025, 1, 1, 12, 15, tzinfo=dt_timezone.utc))
+        # 1 January 2025 is a Wednesday, so the next Sunday is the 5th
+        self.assertEqual(cron_next('0 3 * * 0', after), datetime(2025, 1, 5, 3, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(cron_next('0 0 1,15 * 1-5', after), datetime(2025, 1, 2, 0, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(cron_next('0 0 29 2 *', after), datetime(2028, 2, 29, 0, 0, tzinfo=dt_timezone.utc))
+        for expression in ('* * *', '60 * * * *', '0 0 * * 7', 'x * * * *'):
+            with self.assertRaises(ValueError):
+                parse_cron(expression)
+
+
+class CleanupExportsTest(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='admin@example.com', password='AdminPass123!', role='admin')
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.settings = override_settings(EXPORT_ROOT=self.root)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def make_export(self, name, size, expires_in=timedelta(hours=1), downloaded=None, on_disk=True):
+        file_path = os.path.join(self.root, name)
+        if on_disk:
+            with open(file_path, 'wb') as export_file:
+                export_file.write(b'x' * size)
+        return ExportedFile.objects.create(
+            filename=name, file_path=file_path, file_type='air_quality', created_by=self.user,
+            expires_at=timezone.now() + expires_in, last_downloaded_at=downloaded
+        )
+
+    def test_cleanup_sweeps_and_evicts(self):
+        self.make_export('expired.csv', 100, expires_in=timedelta(hours=-1))
+        self.make_export('gone.csv', 0, on_disk=False)
+        stale = self.make_export('stale.csv', 300, downloaded=timezone.now() - timedelta(hours=2))
+        recent = self.make_export('recent.csv', 300, downloaded=timezone.now())
+        for name, age in (('orphan.csv', 7200), ('writing.csv', 0)):
+            orphan = os.path.join(self.root, name)
+            with open(orphan, 'wb') as orphan_file:
+                orphan_file.write(b'x' * 50)
+            os.utime(orphan, (time.time() - age, time.time() - age))
+
+        out = io.StringIO()
+        call_command('cleanup_exports', '--batch-size', '1', '--max-bytes', '400', stdout=out)
+
+        self.assertEqual(list(ExportedFile.objects.values_list('id', flat=True)), [recent.id])
+        self.assertEqual(sorted(os.listdir(self.root)), ['recent.csv', 'writing.csv'])
+        self.assertFalse(os.path.exists(stale.file_path))
+        self.assertIn('reclaimed 450 bytes', out.getvalue())
+
+    def test_files_still_being_written_do_not_trigger_eviction(self):
+        kept = self.make_export('kept.csv', 100)
+        with open(os.path.join(self.root, 'writing.csv'), 'wb') as writing:
+            writing.write(b'x' * 1000)
+
+        call_command('cleanup_exports', '--max-bytes', '400', stdout=io.StringIO())
+
+        self.assertEqual(list(ExportedFile.objects.values_list('id', flat=True)), [kept.id])
+        self.assertEqual(sorted(os.listdir(self.root)), ['kept.csv', 'writing.csv'])
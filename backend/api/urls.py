@@ -19,6 +19,7 @@ urlpatterns = [
     path('sensor/th/', views.sensor_api_th_data, name='sensor_api_th_data'),
     path('sensor/voc/', views.sensor_api_voc_data, name='sensor_api_voc_data'),
     path('sensor/multi-device/', views.sensor_api_multi_device_data, name='sensor_api_multi_device_data'),
+    path('sensor/stats/', views.sensor_api_stats, name='sensor_api_stats'),
     
     # Air quality data endpoints
     path('devices/', views.get_devices, name='get_devices'),
@@ -41,4 +42,6 @@ urlpatterns = [
     path('export/sensor/th/', views.export_sensor_th_data, name='export_sensor_th_data'),
     path('export/sensor/voc/', views.export_sensor_voc_data, name='export_sensor_voc_data'),
     path('export/multi-device/', views.export_multi_device_data, name='export_multi_device_data'),
+    path('export-jobs/<int:job_id>/', views.export_job_status, name='export_job_status'),
+    path('scheduled-exports/', views.get_scheduled_exports, name='get_scheduled_exports'),
 ]
\ No newline at end of file
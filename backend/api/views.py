@@ -1,9 +1,10 @@
 import os
-import math
-import time
 import logging
 import json
+import contextvars
 import requests
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from rest_framework import generics, status
 from rest_framework.response import Response
@@ -13,9 +14,14 @@ from rest_framework.views import APIView
 from django.db import IntegrityError, models
 from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import api_view, permission_classes
-from django.http import FileResponse
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.core.cache import cache
 from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
 
 from .serializers import (
     UserRegistrationSerializer, 
@@ -25,220 +31,178 @@ from .serializers import (
     BatteryDataResponseSerializer,
     WeatherDataResponseSerializer
 )
-from .models import ExportedFile, DeviceGroup, DeviceGroupMember, CustomUser
+from .models import ExportedFile, ExportJob, ScheduledExport, DeviceGroup, DeviceGroupMember, CustomUser
 from .permissions import CanAccessData, IsAdminUser, IsSuperAdminUser, CanExportData
-from .file_services import generate_export_filename, save_data_to_file, create_export_record, get_export_download_url
+from .file_services import (
+    generate_export_filename,
+    get_export_download_url,
+    ensure_content_hash,
+    read_file_range,
+    parse_byte_range,
+    peek_rows,
+    encode_rows,
+    gzip_chunks,
+    iter_partitioned_zip,
+    read_decompressed,
+    CONTENT_TYPES,
+    COMPRESSION_EXTENSIONS,
+    EXPORT_FORMATS,
+    STREAMABLE_FORMATS
+)
+from .job_services import create_export_job, export_content_key, find_existing_export, window_is_closed
+from .http_services import sensor_get, get_connection_stats, get_circuit_breaker, SensorAPIError
+from .flight_services import single_flight, flight_key, get_flight_stats
+from .prefetch_services import schedule_prefetch, get_prefetch_stats
+from .cache_services import (
+    get_segmented_window,
+    get_or_revalidate,
+    mark_data,
+    chart_cache_key,
+    get_chart_result,
+    set_chart_result,
+    from_epoch,
+    utc_now_epoch
+)
+from .stats_services import get_window_stats, RunningStats
+from .store_services import (
+    read_window,
+    read_rollup_window,
+    closing_db_connection,
+    ENDPOINT_DEVICE_TYPES,
+    ROLLUP_RESOLUTIONS
+)
+from .downsampling_services import (
+    downsample_records,
+    downsample_records_multi,
+    parse_columns,
+    ALGORITHMS,
+    TH_COLUMNS,
+    VOC_COLUMNS
+)
 
 logger = logging.getLogger(__name__)
 
-# LTTB Algorithm Implementation
-def largest_triangle_three_buckets(data, threshold):
-    """
-    Implement the Largest Triangle Three Buckets (LTTB) downsampling algorithm
-    data: list of dictionaries with 'timestamp' and 'value' keys
-    threshold: maximum number of points to return
-    """
-    if len(data) <= threshold or threshold == 0:
-        return data
-    
-    # Convert data to list of tuples (timestamp, value)
-    try:
-        numeric_data = []
-        for d in data:
-            # Convert timestamp to Unix timestamp for numeric processing
-            if isinstance(d['timestamp'], str):
-                dt = datetime.strptime(d['timestamp'], '%Y-%m-%d %H:%M:%S')
-                timestamp = time.mktime(dt.timetuple())
-            else:
-                timestamp = time.mktime(d['timestamp'].timetuple())
-            numeric_data.append((timestamp, float(d['value'])))
-    except (ValueError, KeyError) as e:
-        logger.error(f"Error processing data for LTTB: {str(e)}")
-        return downsample_data_simple(data, threshold)
-    
-    # Implementation of LTTB algorithm
-    n = len(numeric_data)
-    if threshold >= n or threshold == 0:
-        return data
-    
-    # Calculate the size of each bucket
-    every = (n - 2) / (threshold - 2)
-    
-    # Initialize the sample with the first point
-    sampled_indices = [0]
-    a = 0
-    
-    for i in range(0, threshold - 2):
-        # Calculate the bucket range
-        avg_range_start = int((i + 1) * every) + 1
-        avg_range_end = int((i + 2) * every) + 1
-        avg_range_end = min(avg_range_end, n)
-        
-        avg_range_length = avg_range_end - avg_range_start
-        
-        # Calculate the average point in the next bucket
-        avg_x = 0.0
-        avg_y = 0.0
-        for j in range(avg_range_start, avg_range_end):
-            avg_x += numeric_data[j][0]
-            avg_y += numeric_data[j][1]
-        avg_x /= avg_range_length
-        avg_y /= avg_range_length
-        
-        # Get the range of the current bucket
-        range_offs = int(math.floor((i + 0) * every)) + 1
-        range_to = int(math.floor((i + 1) * every)) + 1
-        range_to = min(range_to, n)
-        
-        # Point a
-        point_ax = numeric_data[a][0]
-        point_ay = numeric_data[a][1]
-        
-        max_area = -1
-        max_index = -1
-        
-        for j in range(range_offs, range_to):
-            # Calculate the area of the triangle
-            area = abs(
-                (point_ax - avg_x) * (numeric_data[j][1] - point_ay) -
-                (point_ax - numeric_data[j][0]) * (avg_y - point_ay)
-            ) * 0.5
-            
-            if area > max_area:
-                max_area = area
-                max_index = j
-        
-        sampled_indices.append(max_index)
-        a = max_index
-    
-    # Add the last point
-    sampled_indices.append(n - 1)
-    
-    # Return the sampled data points
-    return [data[i] for i in sampled_indices]
+# Accepted values for the resolution parameter of chart endpoints
+RESOLUTION_CHOICES = ('auto', 'raw') + tuple(ROLLUP_RESOLUTIONS)
 
-def downsample_data_simple(data, max_points=500):
-    """Simple downsampling for non-time-series data"""
-    if len(data) <= max_points:
-        return data
-    
-    sample_rate = math.ceil(len(data) / max_points)
-    return data[::sample_rate]
+class ExportContentNegotiation(DefaultContentNegotiation):
+    """Content negotiation that leaves ?format= alone, for views that use it as a file format"""
+    settings = SimpleNamespace(URL_FORMAT_OVERRIDE=None)
 
-def downsample_data(data, max_points=500, algorithm='lttb'):
-    """
-    Downsample data using the specified algorithm
-    algorithm: 'lttb' for time-series data, 'simple' for other data
-    """
-    if len(data) <= max_points:
-        return data
-    
-    if algorithm == 'lttb':
-        # Check if data has the required structure for LTTB
-        if all('timestamp' in d and 'value' in d for d in data):
-            return largest_triangle_three_buckets(data, max_points)
-        else:
-            logger.warning("Data structure not suitable for LTTB, using simple downsampling")
-            return downsample_data_simple(data, max_points)
-    else:
-        return downsample_data_simple(data, max_points)
+def file_format_param(view):
+    """Let ?format= choose an export's file format instead of DRF's response renderer"""
+    view.cls.content_negotiation_class = ExportContentNegotiation
+    return view
 
 # Sensor API Service
 class SensorAPIService:
     BASE_URL = "http://47.190.103.180:5001"
     
     @staticmethod
-    def make_request(endpoint, params=None):
+    def make_request(endpoint, params=None, use_mock=True):
         """Make a request to the sensor API"""
-        try:
-            url = f"{SensorAPIService.BASE_URL}{endpoint}"
-            response = requests.get(url, params=params, timeout=10)
+        url = f"{SensorAPIService.BASE_URL}{endpoint}"
+        
+        def fetch():
+            response = sensor_get(url, params=params)
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
+        
+        try:
+            # Identical concurrent calls in this worker share one upstream request
+            data = single_flight(flight_key(endpoint, params), fetch)
+            mark_data('fresh')
+            return data
+        except (requests.exceptions.RequestException, SensorAPIError) as e:
             logger.error(f"Sensor API request failed: {str(e)}")
-            # Return mock data for testing
-            if endpoint == "/api/v6/th":
-                return [{
-                    "SiteName": params.get("site_name", "UTIS0001-TH-V6_1"),
-                    "Humidity": "65.50",
-                    "Temperature": "23.40",
-                    "Noise": "45.20",
-                    "PM2_5": "12.30",
-                    "PM10": "25.60",
-                    "ReceivedTime": "2025-08-25 12:30:00",
-                    "ReportedTimeUTC": "2025-08-25 12:30:00",
-                    "Illumination": "850.00"
-                }]
-            elif endpoint == "/api/v6/voc":
-                return [{
-                    "SiteName": params.get("site_name", "UTIS0001-VOC-V6_1"),
-                    "ReportedTimeUTC": "2025-08-25 12:30:00",
-                    "VOC": "0.1250",
-                    "O3": "0.0450",
-                    "SO2": "0.0120",
-                    "NO2": "0.0230",
-                    "ReceivedTime": "2025-08-25 12:30:00"
-                }]
-            elif endpoint == "/api/v6/sites":
-                return {
-                    "sites": [
-                        "UTIS0001-TH-V6_1",
-                        "UTIS0001-VOC-V6_1",
-                        "UTIS0002-TH-V6_1",
-                        "UTIS0002-VOC-V6_1",
-                        "UTIS0003-TH-V6_1",
-                        "UTIS0003-VOC-V6_1",
-                        "UTIS0004-TH-V6_1",
-                        "UTIS0004-VOC-V6_1",
-                        "UTIS0005-TH-V6_1",
-                        "UTIS0005-VOC-V6_1",
-                        "UTIS0006-TH-V6_1",
-                        "UTIS0006-VOC-V6_1",
-                        "UTIS0007-TH-V6_1",
-                        "UTIS0007-VOC-V6_1",
-                        "UTIS0008-TH-V6_1",
-                        "UTIS0008-VOC-V6_1",
-                        "UTIS0009-TH-V6_1",
-                        "UTIS0009-VOC-V6_1",
-                        "UTIS0011-TH-V6_1",
-                        "UTIS0011-VOC-V6_1"
-                    ],
-                    "count": 20
-                }
-            return None
+            if not use_mock:
+                return None
+            return SensorAPIService.get_mock_data(endpoint, params)
     
     @staticmethod
-    def get_health():
-        """Check sensor API health"""
-        cache_key = "sensor_api_health"
-        cached_data = cache.get(cache_key)
-        
-        if cached_data:
-            return cached_data
-            
-        data = SensorAPIService.make_request("/api/v6/health")
-        if data:
-            cache.set(cache_key, data, 60)  # Cache for 1 minute
-        return data
+    def get_mock_data(endpoint, params=None):
+        """Mock data returned when the sensor API is unreachable"""
+        params = params or {}
+        if endpoint in ("/api/v6/th", "/api/v6/voc", "/api/v6/sites"):
+            mark_data('synthetic')
+        if endpoint == "/api/v6/th":
+            return [{
+                "SiteName": params.get("site_name", "UTIS0001-TH-V6_1"),
+                "Humidity": "65.50",
+                "Temperature": "23.40",
+                "Noise": "45.20",
+                "PM2_5": "12.30",
+                "PM10": "25.60",
+                "ReceivedTime": "2025-08-25 12:30:00",
+                "ReportedTimeUTC": "2025-08-25 12:30:00",
+                "Illumination": "850.00"
+            }]
+        elif endpoint == "/api/v6/voc":
+            return [{
+                "SiteName": params.get("site_name", "UTIS0001-VOC-V6_1"),
+                "ReportedTimeUTC": "2025-08-25 12:30:00",
+                "VOC": "0.1250",
+                "O3": "0.0450",
+                "SO2": "0.0120",
+                "NO2": "0.0230",
+                "ReceivedTime": "2025-08-25 12:30:00"
+            }]
+        elif endpoint == "/api/v6/sites":
+            return {
+                "sites": [
+                    "UTIS0001-TH-V6_1",
+                    "UTIS0001-VOC-V6_1",
+                    "UTIS0002-TH-V6_1",
+                    "UTIS0002-VOC-V6_1",
+                    "UTIS0003-TH-V6_1",
+                    "UTIS0003-VOC-V6_1",
+                    "UTIS0004-TH-V6_1",
+                    "UTIS0004-VOC-V6_1",
+                    "UTIS0005-TH-V6_1",
+                    "UTIS0005-VOC-V6_1",
+                    "UTIS0006-TH-V6_1",
+                    "UTIS0006-VOC-V6_1",
+                    "UTIS0007-TH-V6_1",
+                    "UTIS0007-VOC-V6_1",
+                    "UTIS0008-TH-V6_1",
+                    "UTIS0008-VOC-V6_1",
+                    "UTIS0009-TH-V6_1",
+                    "UTIS0009-VOC-V6_1",
+                    "UTIS0011-TH-V6_1",
+                    "UTIS0011-VOC-V6_1"
+                ],
+                "count": 20
+            }
+        return None
     
     @staticmethod
-    def get_sites():
-        """Get all available sites from sensor API"""
-        cache_key = "sensor_api_sites"
-        cached_data = cache.get(cache_key)
-        
-        if cached_data:
-            return cached_data
-            
-        data = SensorAPIService.make_request("/api/v6/sites")
-        if data:
-            cache.set(cache_key, data, 300)  # Cache for 5 minutes
+    def get_health(refresh=False):
+        """Check sensor API health, serving the last answer while a refresh runs"""
+        return get_or_revalidate(
+            "sensor_api_health",
+            lambda: SensorAPIService.make_request("/api/v6/health", use_mock=False),
+            settings.SENSOR_HEALTH_CACHE_TTL,
+            settings.SENSOR_CACHE_STALE_SECONDS,
+            refresh=refresh
+        )
+    
+    @staticmethod
+    def get_sites(refresh=False):
+        """Get all available sites from sensor API, falling back to the (uncached) mock list"""
+        data = get_or_revalidate(
+            "sensor_api_sites",
+            lambda: SensorAPIService.make_request("/api/v6/sites", use_mock=False),
+            settings.SENSOR_SITES_CACHE_TTL,
+            settings.SENSOR_CACHE_STALE_SECONDS,
+            refresh=refresh
+        )
+        if data is None:
+            return SensorAPIService.get_mock_data("/api/v6/sites")
         return data
     
     @staticmethod
-    def get_th_data(start_time, end_time, site_name=None):
-        """Get TH data from sensor API"""
+    def fetch_window(endpoint, start_time, end_time, site_name=None, use_mock=True):
+        """Fetch a raw time window from the sensor API, bypassing the segment cache"""
         params = {
             "start_time": start_time.strftime("%Y-%m-%d %H:%M:%S"),
             "end_time": end_time.strftime("%Y-%m-%d %H:%M:%S")
@@ -247,36 +211,181 @@ class SensorAPIService:
         if site_name:
             params["site_name"] = site_name
             
-        return SensorAPIService.make_request("/api/v6/th", params)
+        return SensorAPIService.make_request(endpoint, params, use_mock=use_mock)
+    
+    @staticmethod
+    def get_cached_window(endpoint, start_time, end_time, site_name=None):
+        """Get a time window, fetching only the time buckets missing from the segment cache"""
+        return get_segmented_window(
+            endpoint, site_name, start_time, end_time,
+            lambda start, end: SensorAPIService.fetch_window(endpoint, start, end, site_name, use_mock=False)
+        )
+    
+    @staticmethod
+    def get_window_data(endpoint, start_time, end_time, site_name=None, use_mock=True):
+        """
+        Get a time window, from the local store as far as ingestion covers it and
+        the rest from the segment cache
+        """
+        data = read_window(
+            ENDPOINT_DEVICE_TYPES[endpoint], site_name, start_time, end_time,
+            tail=lambda start, end: SensorAPIService.get_cached_window(endpoint, start, end, site_name)
+        )
+        if data is not None:
+            mark_data('fresh')
+            return data
+        
+        data = SensorAPIService.get_cached_window(endpoint, start_time, end_time, site_name)
+        if data is None and use_mock:
+            return SensorAPIService.get_mock_data(endpoint, {"site_name": site_name} if site_name else {})
+        return data
+    
+    @staticmethod
+    def get_uncached_window(endpoint, start_time, end_time, site_name=None):
+        """
+        Get a time window for a one-off read such as an export, without filling the
+        segment cache: from the local store as far as ingestion covers it, the rest upstream
+        """
+        fetch = lambda start, end: SensorAPIService.fetch_window(endpoint, start, end, site_name, use_mock=False)
+        data = read_window(ENDPOINT_DEVICE_TYPES[endpoint], site_name, start_time, end_time, tail=fetch)
+        if data is not None:
+            mark_data('fresh')
+            return data
+        return fetch(start_time, end_time)
+    
+    @staticmethod
+    def get_rollup_data(device_type, site_name, start_time, end_time, resolution, max_points, columns=None, extremes=False):
+        """
+        Get pre-aggregated rollups from the local store, bucketing the part of the
+        window after ingestion from the segment cache; (None, 'raw') when not covered
+        """
+        endpoint = f"/api/v6/{device_type}"
+        data, resolution = read_rollup_window(
+            device_type, site_name, start_time, end_time, resolution, max_points, columns,
+            tail=lambda start, end: SensorAPIService.get_cached_window(endpoint, start, end, site_name),
+            extremes=extremes
+        )
+        if data is not None:
+            mark_data('fresh')
+        return data, resolution
+    
+    @staticmethod
+    def get_th_data(start_time, end_time, site_name=None):
+        """Get TH data from sensor API"""
+        return SensorAPIService.get_window_data("/api/v6/th", start_time, end_time, site_name)
     
     @staticmethod
     def get_voc_data(start_time, end_time, site_name=None):
         """Get VOC data from sensor API"""
-        params = {
-            "start_time": start_time.strftime("%Y-%m-%d %H:%M:%S"),
-            "end_time": end_time.strftime("%Y-%m-%d %H:%M:%S")
-        }
-        
-        if site_name:
-            params["site_name"] = site_name
-            
-        return SensorAPIService.make_request("/api/v6/voc", params)
+        return SensorAPIService.get_window_data("/api/v6/voc", start_time, end_time, site_name)
     
     @staticmethod
-    def get_multi_device_data(device_type, start_time, end_time, site_names):
-        """Get data for multiple devices"""
-        results = {}
-        
-        for site_name in site_names:
-            if device_type == 'th':
-                data = SensorAPIService.get_th_data(start_time, end_time, site_name)
+    def get_multi_device_data(device_type, start_time, end_time, site_names, max_workers=None, use_mock=True, fetch=None):
+        """
+        Get data for multiple devices, fetching sites concurrently
+        fetch: optional callable(start, end, site_name) replacing the per-site window fetch
+        """
+        if not site_names:
+            return {}
+        
+        if fetch is None:
+            if not use_mock:
+                # Exports: never mocked, and read past the segment cache
+                endpoint = "/api/v6/th" if device_type == 'th' else "/api/v6/voc"
+                fetch = lambda start, end, site_name: SensorAPIService.get_uncached_window(
+                    endpoint, start, end, site_name
+                )
+            elif device_type == 'th':
+                fetch = SensorAPIService.get_th_data
             else:  # voc
-                data = SensorAPIService.get_voc_data(start_time, end_time, site_name)
-                
+                fetch = SensorAPIService.get_voc_data
+        
+        # Cap the fan-out per request so one call cannot monopolise the session pool
+        max_workers = min(max_workers or settings.SENSOR_API_MAX_CONCURRENCY, len(site_names))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Run each fetch in a copy of this context so its freshness marks reach the request,
+            # closing the database connection the pool thread opens for local store reads
+            futures = [
+                executor.submit(contextvars.copy_context().run, closing_db_connection(fetch), start_time, end_time, site_name)
+                for site_name in site_names
+            ]
+        
+        # Collect in request order so results stay keyed exactly as before
+        results = {}
+        for site_name, future in zip(site_names, futures):
+            data = future.result()
             if data:
                 results[site_name] = data
+            elif data is None and not use_mock:
+                raise SensorAPIError(f"Failed to fetch {device_type} data for {site_name}")
                 
         return results
+    
+    @staticmethod
+    def iter_chunks(start_time, end_time, chunk_hours=None):
+        """Split an inclusive window into consecutive disjoint (start, end) chunks"""
+        chunk = timedelta(hours=chunk_hours or settings.EXPORT_CHUNK_HOURS)
+        chunk_start = start_time
+        while chunk_start <= end_time:
+            chunk_end = min(chunk_start + chunk - timedelta(seconds=1), end_time)
+            yield chunk_start, chunk_end
+            chunk_start = chunk_end + timedelta(seconds=1)
+    
+    @staticmethod
+    def iter_window_data(endpoint, start_time, end_time, site_name=None, chunk_hours=None):
+        """
+        Yield the rows of a window one chunk at a time, so exports never hold the whole range
+        Chunks bypass the segment cache, which a long export would otherwise flood.
+        Raises SensorAPIError when a chunk cannot be fetched; mock data is never exported.
+        """
+        for chunk_start, chunk_end in SensorAPIService.iter_chunks(start_time, end_time, chunk_hours):
+            rows = SensorAPIService.get_uncached_window(endpoint, chunk_start, chunk_end, site_name)
+            if rows is None:
+                raise SensorAPIError(f"Failed to fetch {endpoint} data for {chunk_start} - {chunk_end}")
+            if isinstance(rows, dict):
+                rows = [rows]
+            yield from rows
+    
+    @staticmethod
+    def iter_export_rows(kind, params):
+        """Row source for an export of the given kind, built from its string parameters"""
+        start_time = datetime.strptime(params['start_time'], '%Y-%m-%d %H:%M:%S')
+        end_time = datetime.strptime(params['end_time'], '%Y-%m-%d %H:%M:%S')
+        if kind == 'multi':
+            return SensorAPIService.iter_multi_device_data(
+                params['device_type'], start_time, end_time, params['site_names']
+            )
+        return SensorAPIService.iter_window_data(f"/api/v6/{kind}", start_time, end_time, params.get('site_name'))
+    
+    @staticmethod
+    def iter_export_partitions(params):
+        """Per-site row sources for a multi-device export, each tagging rows with its SiteName"""
+        start_time = datetime.strptime(params['start_time'], '%Y-%m-%d %H:%M:%S')
+        end_time = datetime.strptime(params['end_time'], '%Y-%m-%d %H:%M:%S')
+        endpoint = f"/api/v6/{params['device_type']}"
+        
+        def site_rows(site_name):
+            for row in SensorAPIService.iter_window_data(endpoint, start_time, end_time, site_name):
+                yield {**row, 'SiteName': site_name}
+        
+        return {
+            site_name: (lambda site_name=site_name: site_rows(site_name))
+            for site_name in params['site_names']
+        }
+    
+    @staticmethod
+    def iter_multi_device_data(device_type, start_time, end_time, site_names, chunk_hours=None):
+        """
+        Yield rows for several sites chunk by chunk, each tagged with its SiteName
+        Sites are fetched concurrently within a chunk; rows are copied, never mutated.
+        """
+        for chunk_start, chunk_end in SensorAPIService.iter_chunks(start_time, end_time, chunk_hours):
+            data = SensorAPIService.get_multi_device_data(
+                device_type, chunk_start, chunk_end, site_names, use_mock=False
+            )
+            for site_name in site_names:
+                for item in data.get(site_name, []):
+                    yield {**item, 'SiteName': site_name}
 
 # Helper functions
 def parse_date_param(date_str, default=None):
@@ -387,8 +496,43 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 # Data export function
-def export_data(request, data, filename_prefix, file_type, device_id=None, pollutant=None, file_format='csv'):
-    """Save data to a physical file and return download information"""
+def parse_export_options(request):
+    """
+    Read the format, compress and stream parameters shared by the export endpoints
+    Returns (options, None), or (None, error response) when they are invalid.
+    """
+    file_format = request.GET.get('format', 'csv').lower()
+    compression = request.GET.get('compress', '').lower() or None
+    stream = request.GET.get('stream', 'false').lower() == 'true'
+    
+    if file_format not in EXPORT_FORMATS:
+        return None, Response(
+            {'error': f"Invalid format. Use one of: {', '.join(EXPORT_FORMATS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if stream and file_format not in STREAMABLE_FORMATS:
+        return None, Response(
+            {'error': f"Only {', '.join(STREAMABLE_FORMATS)} exports can be streamed"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if compression and compression not in COMPRESSION_EXTENSIONS:
+        return None, Response(
+            {'error': f"Invalid compress. Use one of: {', '.join(COMPRESSION_EXTENSIONS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if compression and file_format not in STREAMABLE_FORMATS:
+        return None, Response(
+            {'error': f"Only {', '.join(STREAMABLE_FORMATS)} exports can be compressed"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    return {'file_format': file_format, 'compression': compression, 'stream': stream}, None
+
+def export_data(request, data, filename_prefix, file_format='csv', compression=None):
+    """
+    Stream rows straight to the client as a file download
+    data can be any iterable of rows and is consumed lazily while the response is sent.
+    """
     if not request.user.is_admin():
         logger.warning(f"Export denied for user {request.user.email} - admin required")
         return Response(
@@ -396,43 +540,156 @@ def export_data(request, data, filename_prefix, file_type, device_id=None, pollu
             status=status.HTTP_403_FORBIDDEN
         )
     
-    if not data:
+    try:
+        rows = peek_rows(data)
+    except SensorAPIError as e:
+        logger.warning(f"Export failed for {filename_prefix}: {str(e)}")
+        return Response(
+            {"error": "Failed to fetch data from sensor API"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    
+    if rows is None:
         logger.warning(f"Export failed: No data to export for {filename_prefix}")
         return Response({'error': 'No data to export'}, status=status.HTTP_400_BAD_REQUEST)
     
-    try:
-        # Generate filename and save data
-        filename = generate_export_filename(filename_prefix, file_format)
-        file_path = save_data_to_file(data, filename, file_format, file_type)
-        
-        if not file_path:
-            return Response({'error': 'Failed to create export file'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        # Create export record
-        exported_file = create_export_record(
-            request, file_path, filename, file_type, device_id, pollutant
+    filename = generate_export_filename(filename_prefix, file_format)
+    content = encode_rows(rows, file_format)
+    if compression == 'gzip':
+        content = gzip_chunks(content)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[file_format])
+    if compression == 'gzip':
+        response['Content-Encoding'] = 'gzip'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    logger.info(f"Streaming export started for {filename_prefix}")
+    return response
+
+def export_archive(request, partitions, filename_prefix, file_format='csv'):
+    """Stream a ZIP with one file per partition, encoded in parallel as the response is sent"""
+    if not request.user.is_admin():
+        logger.warning(f"Export denied for user {request.user.email} - admin required")
+        return Response(
+            {'error': 'Permission denied. Admin access required for export.'},
+            status=status.HTTP_403_FORBIDDEN
         )
-        
-        # Return download information instead of the file content
-        download_url = get_export_download_url(exported_file)
-        
-        logger.info(f"Export completed successfully for {filename_prefix}, file ID: {exported_file.id}")
-        
+    
+    filename = generate_export_filename(filename_prefix, 'zip')
+    content = iter_partitioned_zip(partitions, file_format, settings.SENSOR_API_MAX_CONCURRENCY)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES['zip'])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    logger.info(f"Streaming archive export started for {filename_prefix}")
+    return response
+
+def queue_export(request, kind, params, file_format='csv', compression=None):
+    """Queue an export job for the worker and return 202 with its id"""
+    if not request.user.is_admin():
+        logger.warning(f"Export denied for user {request.user.email} - admin required")
+        return Response(
+            {'error': 'Permission denied. Admin access required for export.'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    # Identical exports are answered from the existing file, or the job already producing it
+    content_key = export_content_key(kind, params, file_format, compression)
+    exported_file, job = find_existing_export(request.user, content_key, window_is_closed(params))
+    if exported_file:
+        logger.info(f"Reusing export file {exported_file.id} for {kind} export")
         return Response({
-            'message': 'Export completed successfully',
+            'message': 'Export already available',
             'file_id': exported_file.id,
-            'filename': filename,
-            'download_url': download_url,
+            'filename': exported_file.filename,
+            'download_url': get_export_download_url(exported_file),
             'expires_at': exported_file.expires_at,
-            'format': file_format
+            'format': file_format,
+            'compression': compression
         })
-            
-    except Exception as e:
-        logger.error(f"Error generating export for {filename_prefix}: {str(e)}", exc_info=True)
-        return Response(
-            {'error': f'Failed to generate export: {str(e)}'},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+    
+    created = False
+    if job is None:
+        job, created = create_export_job(request.user, kind, params, file_format, compression)
+    if created:
+        logger.info(f"Queued {kind} export job {job.id}")
+        message = 'Export queued'
+    else:
+        logger.info(f"Reusing export job {job.id} for {kind} export")
+        message = 'Export already in progress'
+    
+    return Response({
+        'message': message,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': reverse('export_job_status', args=[job.id]),
+        'format': file_format,
+        'compression': compression
+    }, status=status.HTTP_202_ACCEPTED)
+
+@api_view(['GET'])
+@permission_classes([CanExportData])
+def export_job_status(request, job_id):
+    """Report the progress of a queued export, with download information once done"""
+    try:
+        job = ExportJob.objects.select_related('exported_file').get(
+            models.Q(created_by=request.user) | models.Q(shared=True), id=job_id
         )
+    except ExportJob.DoesNotExist:
+        return Response({'error': 'Export job not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    data = {
+        'job_id': job.id,
+        'status': job.status,
+        'progress': job.progress,
+        'rows_written': job.rows_written,
+        'format': job.file_format,
+        'compression': job.compression or None,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at
+    }
+    if job.status == 'failed':
+        data['error'] = job.error
+    if job.status == 'done' and job.exported_file:
+        data.update({
+            'file_id': job.exported_file.id,
+            'filename': job.exported_file.filename,
+            'download_url': get_export_download_url(job.exported_file),
+            'expires_at': job.exported_file.expires_at
+        })
+    return Response(data)
+
+@api_view(['GET'])
+@permission_classes([CanExportData])
+def get_scheduled_exports(request):
+    """List recurring exports with their last run and the latest ready-made file"""
+    schedules = ScheduledExport.objects.filter(enabled=True).select_related('last_exported_file').order_by('name')
+    
+    data = []
+    for schedule in schedules:
+        item = {
+            'id': schedule.id,
+            'name': schedule.name,
+            'schedule': schedule.schedule,
+            'device_type': schedule.device_type,
+            'site_names': schedule.site_names,
+            'window_hours': schedule.window_hours,
+            'format': schedule.file_format,
+            'layout': schedule.layout,
+            'next_run_at': schedule.next_run_at,
+            'last_run_at': schedule.last_run_at,
+            'last_status': schedule.last_status or None,
+            'last_duration_seconds': schedule.last_duration_seconds,
+            'file': None
+        }
+        exported_file = schedule.last_exported_file
+        if exported_file and not exported_file.is_expired():
+            item['file'] = {
+                'file_id': exported_file.id,
+                'filename': exported_file.filename,
+                'download_url': get_export_download_url(exported_file),
+                'expires_at': exported_file.expires_at
+            }
+        data.append(item)
+    
+    return Response(data)
 
 # API endpoints with pagination and downsampling
 @api_view(['GET'])
@@ -440,7 +697,9 @@ def export_data(request, data, filename_prefix, file_type, device_id=None, pollu
 def download_exported_file(request, file_id):
     """Serve an exported file for download"""
     try:
-        exported_file = ExportedFile.objects.get(id=file_id, created_by=request.user)
+        exported_file = ExportedFile.objects.get(
+            models.Q(created_by=request.user) | models.Q(shared=True), id=file_id
+        )
         
         # Check if file exists and hasn't expired
         if exported_file.is_expired():
@@ -450,15 +709,72 @@ def download_exported_file(request, file_id):
             return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
         
         # Determine content type based on file extension
-        if exported_file.filename.endswith('.json'):
-            content_type = 'application/json'
+        content_type = CONTENT_TYPES.get(exported_file.get_file_format(), 'text/csv')
+        filename = exported_file.filename
+        file_path = exported_file.file_path
+        
+        # Gzip exports are sent as stored when the client accepts gzip, otherwise inflated on the fly
+        compressed = exported_file.get_compression() == 'gzip'
+        inflate = compressed and 'gzip' not in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if compressed:
+            filename = filename[:-len(COMPRESSION_EXTENSIONS['gzip'])]
+        
+        ExportedFile.objects.filter(id=exported_file.id).update(last_downloaded_at=timezone.now())
+        
+        # Strong ETag from the file's content hash, distinct for the inflated representation
+        content_hash = ensure_content_hash(exported_file)
+        etag = f'"{content_hash}-inflated"' if inflate else f'"{content_hash}"'
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        
+        if inflate:
+            response = StreamingHttpResponse(read_decompressed(file_path), content_type=content_type)
+        elif settings.EXPORT_SENDFILE_MODE:
+            # The front proxy reads the file and handles ranges itself
+            response = HttpResponse(content_type=content_type)
+            if settings.EXPORT_SENDFILE_MODE == 'x-accel-redirect':
+                relative_path = os.path.relpath(file_path, settings.EXPORT_ROOT)
+                response['X-Accel-Redirect'] = f"{settings.EXPORT_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{relative_path}"
+            else:
+                response['X-Sendfile'] = file_path
         else:
-            content_type = 'text/csv'
+            size = os.path.getsize(file_path)
+            byte_range = None
+            # A stale If-Range means the client's partial copy is outdated, so send everything
+            if_range = request.META.get('HTTP_IF_RANGE')
+            if not if_range or if_range == etag:
+                try:
+                    byte_range = parse_byte_range(request.META.get('HTTP_RANGE'), size)
+                except ValueError:
+                    return Response(
+                        {'error': 'Requested range not satisfiable'},
+                        status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                        headers={'Content-Range': f'bytes */{size}'}
+                    )
+            
+            if byte_range:
+                start, end = byte_range
+                response = StreamingHttpResponse(
+                    read_file_range(file_path, start, end),
+                    status=status.HTTP_206_PARTIAL_CONTENT,
+                    content_type=content_type
+                )
+                response['Content-Range'] = f'bytes {start}-{end}/{size}'
+                response['Content-Length'] = end - start + 1
+            else:
+                # Serve the file for download
+                response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+            response['Accept-Ranges'] = 'bytes'
         
-        # Serve the file for download
-        response = FileResponse(open(exported_file.file_path, 'rb'))
-        response['Content-Disposition'] = f'attachment; filename="{exported_file.filename}"'
-        response['Content-Type'] = content_type
+        if compressed:
+            if not inflate:
+                response['Content-Encoding'] = 'gzip'
+            patch_vary_headers(response, ['Accept-Encoding'])
+        response['ETag'] = etag
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         
         return response
     except ExportedFile.DoesNotExist:
@@ -499,6 +815,15 @@ def sensor_api_sites(request):
         logger.error(f"Error in sensor_api_sites: {str(e)}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def prefetch_following_windows(request, endpoint, site_name, start_time, end_time):
+    """With ?prefetch=true, load the windows a chart user is likely to view next in the background"""
+    if request.GET.get('prefetch', 'false').lower() != 'true':
+        return
+    schedule_prefetch(
+        endpoint, site_name, start_time, end_time, from_epoch(utc_now_epoch()),
+        lambda start, end: SensorAPIService.get_window_data(endpoint, start, end, site_name, use_mock=False)
+    )
+
 @api_view(['GET'])
 @permission_classes([CanAccessData])
 def sensor_api_th_data(request):
@@ -510,6 +835,8 @@ def sensor_api_th_data(request):
         site_name = request.GET.get('site_name')
         downsample = request.GET.get('downsample', 'true').lower() == 'true'
         max_points = int(request.GET.get('max_points', 500))
+        algorithm = request.GET.get('algorithm', 'lttb').lower()
+        resolution = request.GET.get('resolution', 'auto').lower()
         
         # Validate required parameters
         if not start_time_str or not end_time_str:
@@ -518,6 +845,24 @@ def sensor_api_th_data(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Optional columns for multi-channel downsampling
+        try:
+            columns = parse_columns(request.GET.get('columns'), TH_COLUMNS)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if algorithm not in ALGORITHMS:
+            return Response(
+                {"error": f"algorithm must be one of: {', '.join(ALGORITHMS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if resolution not in RESOLUTION_CHOICES:
+            return Response(
+                {"error": f"resolution must be one of: {', '.join(RESOLUTION_CHOICES)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         # Parse datetime parameters
         try:
             start_time = datetime.strptime(start_time_str, '%Y-%m-%d %H:%M:%S')
@@ -535,35 +880,33 @@ def sensor_api_th_data(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get data from sensor API
-        data = SensorAPIService.get_th_data(start_time, end_time, site_name)
+        # Serve pre-aggregated rollups when the local store covers the start of the window,
+        # every column filled so rows keep the sensor API's shape
+        data, resolution = SensorAPIService.get_rollup_data(
+            'th', site_name, start_time, end_time,
+            resolution if downsample else 'raw', max_points
+        )
+        if data is None:
+            # Get data from sensor API
+            data = SensorAPIService.get_th_data(start_time, end_time, site_name)
         
         if data:
             # Downsample if requested
             if downsample and len(data) > max_points:
-                # Transform data for downsampling
-                transformed_data = []
-                for item in data:
-                    transformed_data.append({
-                        'timestamp': item.get('ReportedTimeUTC', ''),
-                        'value': item.get('Temperature', 0)  # Use temperature as default value for downsampling
-                    })
-                
-                # Downsample using LTTB
-                downsampled_data = downsample_data(transformed_data, max_points, 'lttb')
-                
-                # Map back to original data structure
-                result_data = []
-                for ds_item in downsampled_data:
-                    # Find the original item with matching timestamp
-                    for item in data:
-                        if item.get('ReportedTimeUTC') == ds_item['timestamp']:
-                            result_data.append(item)
-                            break
-                
-                data = result_data
+                if columns:
+                    # Keep the extremes of every requested column
+                    data = downsample_records_multi(data, max_points, columns, algorithm)
+                else:
+                    # Downsample the original rows on Temperature
+                    data = downsample_records(
+                        data, max_points, algorithm,
+                        value_key=lambda item: item.get('Temperature', 0)
+                    )
             
-            return Response(data)
+            prefetch_following_windows(request, "/api/v6/th", site_name, start_time, end_time)
+            response = Response(data)
+            response['X-Data-Resolution'] = resolution
+            return response
         else:
             return Response(
                 {"error": "Failed to fetch TH data from sensor API"}, 
@@ -585,6 +928,8 @@ def sensor_api_voc_data(request):
         site_name = request.GET.get('site_name')
         downsample = request.GET.get('downsample', 'true').lower() == 'true'
         max_points = int(request.GET.get('max_points', 500))
+        algorithm = request.GET.get('algorithm', 'lttb').lower()
+        resolution = request.GET.get('resolution', 'auto').lower()
         
         # Validate required parameters
         if not start_time_str or not end_time_str:
@@ -593,6 +938,24 @@ def sensor_api_voc_data(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Optional columns for multi-channel downsampling
+        try:
+            columns = parse_columns(request.GET.get('columns'), VOC_COLUMNS)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if algorithm not in ALGORITHMS:
+            return Response(
+                {"error": f"algorithm must be one of: {', '.join(ALGORITHMS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if resolution not in RESOLUTION_CHOICES:
+            return Response(
+                {"error": f"resolution must be one of: {', '.join(RESOLUTION_CHOICES)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         # Parse datetime parameters
         try:
             start_time = datetime.strptime(start_time_str, '%Y-%m-%d %H:%M:%S')
@@ -610,35 +973,33 @@ def sensor_api_voc_data(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get data from sensor API
-        data = SensorAPIService.get_voc_data(start_time, end_time, site_name)
+        # Serve pre-aggregated rollups when the local store covers the start of the window,
+        # every column filled so rows keep the sensor API's shape
+        data, resolution = SensorAPIService.get_rollup_data(
+            'voc', site_name, start_time, end_time,
+            resolution if downsample else 'raw', max_points
+        )
+        if data is None:
+            # Get data from sensor API
+            data = SensorAPIService.get_voc_data(start_time, end_time, site_name)
         
         if data:
             # Downsample if requested
             if downsample and len(data) > max_points:
-                # Transform data for downsampling
-                transformed_data = []
-                for item in data:
-                    transformed_data.append({
-                        'timestamp': item.get('ReportedTimeUTC', ''),
-                        'value': item.get('VOC', 0)  # Use VOC as default value for downsampling
-                    })
-                
-                # Downsample using LTTB
-                downsampled_data = downsample_data(transformed_data, max_points, 'lttb')
-                
-                # Map back to original data structure
-                result_data = []
-                for ds_item in downsampled_data:
-                    # Find the original item with matching timestamp
-                    for item in data:
-                        if item.get('ReportedTimeUTC') == ds_item['timestamp']:
-                            result_data.append(item)
-                            break
-                
-                data = result_data
+                if columns:
+                    # Keep the extremes of every requested column
+                    data = downsample_records_multi(data, max_points, columns, algorithm)
+                else:
+                    # Downsample the original rows on VOC
+                    data = downsample_records(
+                        data, max_points, algorithm,
+                        value_key=lambda item: item.get('VOC', 0)
+                    )
             
-            return Response(data)
+            prefetch_following_windows(request, "/api/v6/voc", site_name, start_time, end_time)
+            response = Response(data)
+            response['X-Data-Resolution'] = resolution
+            return response
         else:
             return Response(
                 {"error": "Failed to fetch VOC data from sensor API"}, 
@@ -661,6 +1022,8 @@ def sensor_api_multi_device_data(request):
         site_names = request.GET.getlist('site_names')
         downsample = request.GET.get('downsample', 'true').lower() == 'true'
         max_points = int(request.GET.get('max_points', 500))
+        algorithm = request.GET.get('algorithm', 'lttb').lower()
+        resolution = request.GET.get('resolution', 'auto').lower()
         
         # Validate required parameters
         if not device_type or not start_time_str or not end_time_str or not site_names:
@@ -675,6 +1038,26 @@ def sensor_api_multi_device_data(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Optional columns for multi-channel downsampling
+        try:
+            columns = parse_columns(
+                request.GET.get('columns'), TH_COLUMNS if device_type == 'th' else VOC_COLUMNS
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if algorithm not in ALGORITHMS:
+            return Response(
+                {"error": f"algorithm must be one of: {', '.join(ALGORITHMS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if resolution not in RESOLUTION_CHOICES:
+            return Response(
+                {"error": f"resolution must be one of: {', '.join(RESOLUTION_CHOICES)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         # Parse datetime parameters
         try:
             start_time = datetime.strptime(start_time_str, '%Y-%m-%d %H:%M:%S')
@@ -699,35 +1082,35 @@ def sensor_api_multi_device_data(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get data from sensor API
-        data = SensorAPIService.get_multi_device_data(device_type, start_time, end_time, site_names)
+        def fetch_site(start, end, site_name):
+            # Pre-aggregated rollups for sites the local store has ingested, else the sensor API
+            rows, _ = SensorAPIService.get_rollup_data(
+                device_type, site_name, start, end, resolution if downsample else 'raw', max_points
+            )
+            if rows:
+                return rows
+            if device_type == 'th':
+                return SensorAPIService.get_th_data(start, end, site_name)
+            return SensorAPIService.get_voc_data(start, end, site_name)
+        
+        # Sites are served concurrently, each from its rollups or the sensor API
+        data = SensorAPIService.get_multi_device_data(
+            device_type, start_time, end_time, site_names, fetch=fetch_site
+        )
         
         if data:
             # Downsample if requested
             if downsample:
                 for site_name, site_data in data.items():
-                    if len(site_data) > max_points:
-                        # Transform data for downsampling
-                        transformed_data = []
-                        for item in site_data:
-                            transformed_data.append({
-                                'timestamp': item.get('ReportedTimeUTC', ''),
-                                'value': item.get('Temperature', item.get('VOC', 0))
-                            })
-                        
-                        # Downsample using LTTB
-                        downsampled_data = downsample_data(transformed_data, max_points, 'lttb')
-                        
-                        # Map back to original data structure
-                        result_data = []
-                        for ds_item in downsampled_data:
-                            # Find the original item with matching timestamp
-                            for item in site_data:
-                                if item.get('ReportedTimeUTC') == ds_item['timestamp']:
-                                    result_data.append(item)
-                                    break
-                        
-                        data[site_name] = result_data
+                    if len(site_data) > max_points and columns:
+                        # Keep the extremes of every requested column
+                        data[site_name] = downsample_records_multi(site_data, max_points, columns, algorithm)
+                    elif len(site_data) > max_points:
+                        # Downsample the original rows
+                        data[site_name] = downsample_records(
+                            site_data, max_points, algorithm,
+                            value_key=lambda item: item.get('Temperature', item.get('VOC', 0))
+                        )
             
             return Response(data)
         else:
@@ -740,6 +1123,23 @@ def sensor_api_multi_device_data(request):
         logger.error(f"Error in sensor_api_multi_device_data: {str(e)}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def sensor_api_stats(request):
+    """Report sensor API client counters for this worker process"""
+    try:
+        return Response({
+            'pid': os.getpid(),
+            'connections': get_connection_stats(),
+            'coalescing': get_flight_stats(),
+            'circuit': get_circuit_breaker().stats(),
+            'prefetch': get_prefetch_stats(),
+            'cache': cache.stats() if hasattr(cache, 'stats') else None
+        })
+    except Exception as e:
+        logger.error(f"Error in sensor_api_stats: {str(e)}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 # Updated endpoints to use sensor API instead of local database
 @api_view(['GET'])
 @permission_classes([AllowAny])
@@ -799,6 +1199,13 @@ def get_pollutants(request):
     ]
     return Response(pollutants)
 
+def chart_response(resolution, payload, cache_status):
+    """Response for a chart already rendered to JSON bytes"""
+    response = HttpResponse(payload, content_type='application/json')
+    response['X-Data-Resolution'] = resolution
+    response['X-Result-Cache'] = cache_status
+    return response
+
 @api_view(['GET'])
 @permission_classes([CanAccessData])
 def get_air_quality_data(request, device_id, pollutant):
@@ -811,15 +1218,20 @@ def get_air_quality_data(request, device_id, pollutant):
         if pollutant in ['VOC', 'O3', 'SO2', 'NO2']:
             # Use VOC API for gas pollutants
             api_func = SensorAPIService.get_voc_data
+            device_type = 'voc'
         else:
             # Use TH API for other pollutants
             api_func = SensorAPIService.get_th_data
+            device_type = 'th'
+        endpoint = f"/api/v6/{device_type}"
         
         # Get time parameters
         start_time_str = request.GET.get('start_time')
         end_time_str = request.GET.get('end_time')
         downsample = request.GET.get('downsample', 'true').lower() == 'true'
         max_points = int(request.GET.get('max_points', 500))
+        algorithm = request.GET.get('algorithm', 'lttb').lower()
+        resolution = request.GET.get('resolution', 'auto').lower()
         
         if not start_time_str or not end_time_str:
             return Response(
@@ -827,6 +1239,18 @@ def get_air_quality_data(request, device_id, pollutant):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        if algorithm not in ALGORITHMS:
+            return Response(
+                {"error": f"algorithm must be one of: {', '.join(ALGORITHMS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if resolution not in RESOLUTION_CHOICES:
+            return Response(
+                {"error": f"resolution must be one of: {', '.join(RESOLUTION_CHOICES)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         # Parse datetime parameters
         try:
             start_time = datetime.strptime(start_time_str, '%Y-%m-%d %H:%M:%S')
@@ -837,14 +1261,41 @@ def get_air_quality_data(request, device_id, pollutant):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get data from sensor API
-        data = api_func(start_time, end_time, site_name)
+        # Repeat views of a chart are served from the rendered result cache
+        use_result_cache = request.accepted_renderer.format == 'json'
+        result_key = chart_cache_key(
+            device_id=device_id, pollutant=pollutant, start_time=start_time, end_time=end_time,
+            downsample=downsample, algorithm=algorithm, max_points=max_points, resolution=resolution
+        )
+        if use_result_cache:
+            cached = get_chart_result(result_key)
+            if cached is not None:
+                prefetch_following_windows(request, endpoint, site_name, start_time, end_time)
+                return chart_response(*cached, cache_status='hit')
+        
+        # Serve pre-aggregated rollups when the local store covers the start of the window
+        data, resolution = SensorAPIService.get_rollup_data(
+            device_type, site_name, start_time, end_time,
+            resolution if downsample else 'raw', max_points, [pollutant], extremes=True
+        )
+        if data is None:
+            # Get data from sensor API
+            data = api_func(start_time, end_time, site_name)
         
         if data:
             # Handle both single object and list responses
             if not isinstance(data, list):
                 data = [data]
             
+            # Downsample if requested, selecting rows before transforming them
+            if downsample and len(data) > max_points:
+                data = downsample_records(
+                    data, max_points, algorithm,
+                    value_key=lambda item: item.get(pollutant, None)
+                )
+            
+            prefetch_following_windows(request, endpoint, site_name, start_time, end_time)
+            
             # Transform data to match expected format
             transformed_data = []
             for item in data:
@@ -855,13 +1306,20 @@ def get_air_quality_data(request, device_id, pollutant):
                     'pollutant': pollutant,
                     'device_id': device_id
                 }
+                if resolution != 'raw':
+                    # Rollup buckets carry the extremes around the mean value
+                    transformed_item['min'] = item.get(f'{pollutant}_min')
+                    transformed_item['max'] = item.get(f'{pollutant}_max')
                 transformed_data.append(transformed_item)
             
-            # Downsample if requested
-            if downsample and len(transformed_data) > max_points:
-                transformed_data = downsample_data(transformed_data, max_points, 'lttb')
+            if use_result_cache:
+                payload = JSONRenderer().render(transformed_data)
+                set_chart_result(result_key, resolution, payload, end_time)
+                return chart_response(resolution, payload, cache_status='miss')
             
-            return Response(transformed_data)
+            response = Response(transformed_data)
+            response['X-Data-Resolution'] = resolution
+            return response
         else:
             return Response(
                 {"error": "Failed to fetch data from sensor API"}, 
@@ -892,20 +1350,76 @@ def get_weather_data(request):
 @api_view(['GET'])
 @permission_classes([CanAccessData])
 def get_pollutant_stats(request, device):
-    """Get statistics for a pollutant"""
-    # Implementation would depend on your specific requirements
-    return Response({
-        "message": "Pollutant stats endpoint",
-        "device": device
-    })
+    """Get summary statistics for a pollutant over a time window"""
+    try:
+        site_name = device.replace('aq_', '')
+        pollutant = request.GET.get('pollutant')
+        start_time_str = request.GET.get('start_time')
+        end_time_str = request.GET.get('end_time')
+        
+        if pollutant in VOC_COLUMNS:
+            endpoint = "/api/v6/voc"
+        elif pollutant in TH_COLUMNS:
+            endpoint = "/api/v6/th"
+        else:
+            return Response(
+                {"error": f"pollutant must be one of: {', '.join(TH_COLUMNS + VOC_COLUMNS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Parse datetime parameters, defaulting to the last 24 hours
+        try:
+            if end_time_str:
+                end_time = datetime.strptime(end_time_str, '%Y-%m-%d %H:%M:%S')
+            else:
+                end_time = from_epoch(utc_now_epoch())
+            if start_time_str:
+                start_time = datetime.strptime(start_time_str, '%Y-%m-%d %H:%M:%S')
+            else:
+                start_time = end_time - timedelta(days=1)
+        except ValueError:
+            return Response(
+                {"error": "Invalid datetime format. Use YYYY-MM-DD HH:MM:SS"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if start_time > end_time or (end_time - start_time).days > 30:
+            return Response(
+                {"error": "Time range must be positive and cannot exceed 30 days"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        stats = get_window_stats(
+            ENDPOINT_DEVICE_TYPES[endpoint], site_name, pollutant, start_time, end_time,
+            # Whole days are cached as summaries, so the raw rows need not be
+            lambda start, end: SensorAPIService.get_uncached_window(endpoint, start, end, site_name)
+        )
+        if stats is None:
+            return Response(
+                {"error": "Failed to fetch data from sensor API"}, 
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        
+        return Response({
+            'device': device,
+            'site_name': site_name,
+            'pollutant': pollutant,
+            'start_time': start_time,
+            'end_time': end_time,
+            **stats.to_dict()
+        })
+    except Exception as e:
+        logger.error(f"Error in get_pollutant_stats: {str(e)}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
 @permission_classes([CanAccessData])
 def get_battery_stats(request, device):
-    """Get battery statistics - placeholder"""
+    """Get battery statistics - the external API provides no battery readings yet"""
     return Response({
         "message": "Battery stats not available",
-        "device": device
+        "device": device,
+        **RunningStats().to_dict()
     })
 
 @api_view(['GET'])
@@ -915,19 +1429,20 @@ def get_multi_device_data(request):
     return sensor_api_multi_device_data(request)
 
 # Export endpoints for sensor data
+@file_format_param
 @api_view(['GET'])
 @permission_classes([CanExportData])
 def export_sensor_th_data(request):
-    """Export TH data from sensor API to file"""
+    """Queue a TH data export, or stream it directly with stream=true"""
     try:
         # Get parameters from request
         start_time_str = request.GET.get('start_time')
         end_time_str = request.GET.get('end_time')
         site_name = request.GET.get('site_name')
-        file_format = request.GET.get('format', 'csv').lower()
         
-        if file_format not in ['csv', 'json']:
-            return Response({'error': 'Invalid format. Use csv or json'}, status=status.HTTP_400_BAD_REQUEST)
+        options, error = parse_export_options(request)
+        if error:
+            return error
         
         # Validate required parameters
         if not start_time_str or not end_time_str:
@@ -946,38 +1461,32 @@ def export_sensor_th_data(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get data from sensor API
-        data = SensorAPIService.get_th_data(start_time, end_time, site_name)
+        params = {'start_time': start_time_str, 'end_time': end_time_str, 'site_name': site_name}
+        if options['stream']:
+            # Rows are pulled from the sensor API chunk by chunk as the response is sent
+            rows = SensorAPIService.iter_export_rows('th', params)
+            return export_data(request, rows, 'th_export', options['file_format'], options['compression'])
         
-        if data:
-            # Handle both single object and list responses
-            if not isinstance(data, list):
-                data = [data]
-            
-            return export_data(request, data, 'th_export', 'air_quality', site_name, file_format=file_format)
-        else:
-            return Response(
-                {"error": "Failed to fetch TH data from sensor API"}, 
-                status=status.HTTP_503_SERVICE_UNAVAILABLE
-            )
+        return queue_export(request, 'th', params, options['file_format'], options['compression'])
             
     except Exception as e:
         logger.error(f"Error in export_sensor_th_data: {str(e)}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@file_format_param
 @api_view(['GET'])
 @permission_classes([CanExportData])
 def export_sensor_voc_data(request):
-    """Export VOC data from sensor API to file"""
+    """Queue a VOC data export, or stream it directly with stream=true"""
     try:
         # Get parameters from request
         start_time_str = request.GET.get('start_time')
         end_time_str = request.GET.get('end_time')
         site_name = request.GET.get('site_name')
-        file_format = request.GET.get('format', 'csv').lower()
         
-        if file_format not in ['csv', 'json']:
-            return Response({'error': 'Invalid format. Use csv or json'}, status=status.HTTP_400_BAD_REQUEST)
+        options, error = parse_export_options(request)
+        if error:
+            return error
         
         # Validate required parameters
         if not start_time_str or not end_time_str:
@@ -996,39 +1505,46 @@ def export_sensor_voc_data(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get data from sensor API
-        data = SensorAPIService.get_voc_data(start_time, end_time, site_name)
+        params = {'start_time': start_time_str, 'end_time': end_time_str, 'site_name': site_name}
+        if options['stream']:
+            # Rows are pulled from the sensor API chunk by chunk as the response is sent
+            rows = SensorAPIService.iter_export_rows('voc', params)
+            return export_data(request, rows, 'voc_export', options['file_format'], options['compression'])
         
-        if data:
-            # Handle both single object and list responses
-            if not isinstance(data, list):
-                data = [data]
-            
-            return export_data(request, data, 'voc_export', 'air_quality', site_name, file_format=file_format)
-        else:
-            return Response(
-                {"error": "Failed to fetch VOC data from sensor API"}, 
-                status=status.HTTP_503_SERVICE_UNAVAILABLE
-            )
+        return queue_export(request, 'voc', params, options['file_format'], options['compression'])
             
     except Exception as e:
         logger.error(f"Error in export_sensor_voc_data: {str(e)}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@file_format_param
 @api_view(['GET'])
 @permission_classes([CanExportData])
 def export_multi_device_data(request):
-    """Export multi-device data to file"""
+    """Queue a multi-device data export, or stream it directly with stream=true"""
     try:
         # Get parameters from request
         device_type = request.GET.get('device_type')  # 'th' or 'voc'
         start_time_str = request.GET.get('start_time')
         end_time_str = request.GET.get('end_time')
         site_names = request.GET.getlist('site_names')
-        file_format = request.GET.get('format', 'csv').lower()
+        # 'merged' writes one file with a SiteName column, 'per_site' a ZIP with a file per site
+        layout = request.GET.get('layout', 'merged').lower()
         
-        if file_format not in ['csv', 'json']:
-            return Response({'error': 'Invalid format. Use csv or json'}, status=status.HTTP_400_BAD_REQUEST)
+        options, error = parse_export_options(request)
+        if error:
+            return error
+        
+        if layout not in ['merged', 'per_site']:
+            return Response(
+                {"error": "layout must be either 'merged' or 'per_site'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if layout == 'per_site' and options['compression']:
+            return Response(
+                {"error": "per_site exports are already compressed as a ZIP, omit compress"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         # Validate required parameters
         if not device_type or not start_time_str or not end_time_str or not site_names:
@@ -1053,23 +1569,22 @@ def export_multi_device_data(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get data from sensor API
-        data = SensorAPIService.get_multi_device_data(device_type, start_time, end_time, site_names)
-        
-        if data:
-            # Flatten the data for export
-            flattened_data = []
-            for site_name, site_data in data.items():
-                for item in site_data:
-                    item['SiteName'] = site_name  # Add site name to each record
-                    flattened_data.append(item)
-            
-            return export_data(request, flattened_data, 'multi_device_export', 'air_quality', file_format=file_format)
-        else:
-            return Response(
-                {"error": "Failed to fetch data from sensor API"}, 
-                status=status.HTTP_503_SERVICE_UNAVAILABLE
-            )
+        params = {
+            'device_type': device_type,
+            'start_time': start_time_str,
+            'end_time': end_time_str,
+            'site_names': site_names,
+            'layout': layout
+        }
+        if options['stream'] and layout == 'per_site':
+            partitions = SensorAPIService.iter_export_partitions(params)
+            return export_archive(request, partitions, 'multi_device_export', options['file_format'])
+        if options['stream']:
+            # Sites are fetched a chunk at a time and tagged with their SiteName as they are sent
+            rows = SensorAPIService.iter_export_rows('multi', params)
+            return export_data(request, rows, 'multi_device_export', options['file_format'], options['compression'])
+        
+        return queue_export(request, 'multi', params, options['file_format'], options['compression'])
             
     except Exception as e:
         logger.error(f"Error in export_multi_device_data: {str(e)}")
@@ -39,6 +39,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'api.middleware.RequestLoggingMiddleware',
+    'api.middleware.DataFreshnessMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -61,10 +62,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
-# Neon PostgreSQL Config
+# Neon PostgreSQL Config, with a local SQLite database for development and tests
 DATABASES = {
     'default': dj_database_url.parse(
-        os.environ.get('DATABASE_URL'),
+        os.environ.get('DATABASE_URL', f"sqlite:///{BASE_DIR / 'db.sqlite3'}"),
         conn_max_age=600,
         conn_health_checks=True,
     )
@@ -122,6 +123,7 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+CORS_EXPOSE_HEADERS = ['X-Data-Freshness', 'X-Data-Resolution']
 
 # CSRF trusted origins
 CSRF_TRUSTED_ORIGINS = [
@@ -157,9 +159,117 @@ LOGGING = {
     },
 }
 
+# Two-level cache: a small per-process LRU in front of a tier shared by all workers.
+# CACHE_BACKEND picks the shared tier. 'redis' is the default when REDIS_URL is set and is
+# what production should use: its eviction is cheap and its add is atomic. 'file' stands in
+# on local disk, checking its size only every CACHE_CULL_EVERY writes. Its MAX_ENTRIES covers
+# about 150 sites at ~60 segment entries each for a 30-day dashboard (30 settled days plus
+# the hourly tail of today), with room left for charts and stats; raise it with more sites.
+# 'locmem' only shares within one process; the test runner (api.test_runner) always uses it.
+SENSOR_HEALTH_CACHE_TTL = int(os.environ.get('SENSOR_HEALTH_CACHE_TTL', 60))
+SENSOR_SITES_CACHE_TTL = int(os.environ.get('SENSOR_SITES_CACHE_TTL', 300))
+# Cached sensor data is kept this long past its TTL and served as stale while it is
+# refreshed in the background, or while the sensor API is unreachable
+SENSOR_CACHE_STALE_SECONDS = int(os.environ.get('SENSOR_CACHE_STALE_SECONDS', 3600))
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'redis' if REDIS_URL else 'file')
+if CACHE_BACKEND == 'redis':
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+elif CACHE_BACKEND == 'locmem':
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared-cache',
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 10000))},
+    }
+else:
+    SHARED_CACHE = {
+        'BACKEND': 'api.cache_backends.CullingFileCache',
+        'LOCATION': os.environ.get('CACHE_DIR', os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 10000)),
+            'CULL_EVERY': int(os.environ.get('CACHE_CULL_EVERY', 100)),
+        },
+    }
+CACHES = {
+    'default': {
+        'BACKEND': 'api.cache_backends.TwoLevelCache',
+        'OPTIONS': {
+            'SHARED_ALIAS': 'shared',
+            'LOCAL_MAX_BYTES': int(os.environ.get('CACHE_LOCAL_MAX_BYTES', 16 * 1024 * 1024)),
+            'LOCAL_TTL': float(os.environ.get('CACHE_LOCAL_TTL', 5)),
+            'NAMESPACE_TTLS': {
+                'sensor_api_health': SENSOR_HEALTH_CACHE_TTL + SENSOR_CACHE_STALE_SECONDS,
+                'sensor_api_sites': SENSOR_SITES_CACHE_TTL + SENSOR_CACHE_STALE_SECONDS,
+            },
+        },
+    },
+    'shared': SHARED_CACHE,
+}
+TEST_RUNNER = 'api.test_runner.TestRunner'
+
+# Sensor API client: pooled keep-alive session, one per worker process
+SENSOR_API_POOL_SIZE = int(os.environ.get('SENSOR_API_POOL_SIZE', 10))
+SENSOR_API_CONNECT_TIMEOUT = float(os.environ.get('SENSOR_API_CONNECT_TIMEOUT', 3.05))
+SENSOR_API_READ_TIMEOUT = float(os.environ.get('SENSOR_API_READ_TIMEOUT', 10))
+# Maximum concurrent upstream fetches for a single multi-device request
+SENSOR_API_MAX_CONCURRENCY = int(os.environ.get('SENSOR_API_MAX_CONCURRENCY', 5))
+
+# Circuit breaker: after this many consecutive failures sensor API calls fail fast, and a
+# background probe of the health endpoint checks for recovery every RESET seconds
+SENSOR_BREAKER_FAILURES = int(os.environ.get('SENSOR_BREAKER_FAILURES', 5))
+SENSOR_BREAKER_RESET_SECONDS = int(os.environ.get('SENSOR_BREAKER_RESET_SECONDS', 30))
+SENSOR_BREAKER_PROBE_PATH = os.environ.get('SENSOR_BREAKER_PROBE_PATH', '/api/v6/health')
+
+# Identical concurrent upstream calls are coalesced: threads of a worker share one call, and
+# with ACROSS_WORKERS one worker at a time fills a cache entry under a lock in the shared
+# cache while the others wait at most WAIT seconds and then read the entry. The lock needs
+# an atomic add, so this is only on by default with the Redis tier.
+SENSOR_FLIGHT_ACROSS_WORKERS = os.environ.get('SENSOR_FLIGHT_ACROSS_WORKERS', str(CACHE_BACKEND == 'redis')) == 'True'
+SENSOR_FLIGHT_LOCK_SECONDS = int(os.environ.get('SENSOR_FLIGHT_LOCK_SECONDS', 30))
+SENSOR_FLIGHT_WAIT_SECONDS = float(os.environ.get('SENSOR_FLIGHT_WAIT_SECONDS', 15))
+
+# Segment cache for TH/VOC windows: fixed time buckets, set the size to 0 to disable
+SENSOR_SEGMENT_BUCKET_SECONDS = int(os.environ.get('SENSOR_SEGMENT_BUCKET_SECONDS', 3600))
+SENSOR_SEGMENT_CLOSED_TTL = int(os.environ.get('SENSOR_SEGMENT_CLOSED_TTL', 86400))
+SENSOR_SEGMENT_LIVE_TTL = int(os.environ.get('SENSOR_SEGMENT_LIVE_TTL', 60))
+# Buckets are only treated as closed once late-arriving readings have settled
+SENSOR_SEGMENT_SETTLE_SECONDS = int(os.environ.get('SENSOR_SEGMENT_SETTLE_SECONDS', 300))
+
+# Rendered chart responses: long-lived for settled history, brief for windows reaching now.
+# Responses larger than the max are not cached; the cache tiers evict by size and age.
+SENSOR_CHART_CACHE_CLOSED_TTL = int(os.environ.get('SENSOR_CHART_CACHE_CLOSED_TTL', 86400))
+SENSOR_CHART_CACHE_LIVE_TTL = int(os.environ.get('SENSOR_CHART_CACHE_LIVE_TTL', 30))
+SENSOR_CHART_CACHE_MAX_BYTES = int(os.environ.get('SENSOR_CHART_CACHE_MAX_BYTES', 2 * 1024 * 1024))
+
+# Opt-in (?prefetch=true) background loading of the windows a chart user is likely to view
+# next. Prefetch waits while BUSY_REQUESTS sensor API calls are in flight, and gives up on
+# tasks older than MAX_AGE; set WORKERS to 0 to disable it.
+SENSOR_PREFETCH_WORKERS = int(os.environ.get('SENSOR_PREFETCH_WORKERS', 1))
+SENSOR_PREFETCH_MAX_QUEUE = int(os.environ.get('SENSOR_PREFETCH_MAX_QUEUE', 50))
+SENSOR_PREFETCH_BUSY_REQUESTS = int(os.environ.get('SENSOR_PREFETCH_BUSY_REQUESTS', 2))
+SENSOR_PREFETCH_MAX_AGE_SECONDS = int(os.environ.get('SENSOR_PREFETCH_MAX_AGE_SECONDS', 30))
+
+# Serve TH/VOC windows from the locally ingested store when it covers them
+SENSOR_LOCAL_STORE_ENABLED = os.environ.get('SENSOR_LOCAL_STORE_ENABLED', 'True') == 'True'
+
 # Add these settings for file exports
 EXPORT_ROOT = os.path.join(BASE_DIR, 'exports')
 EXPORT_URL = '/exports/'
+# Exports pull and write the requested window this many hours at a time
+EXPORT_CHUNK_HOURS = int(os.environ.get('EXPORT_CHUNK_HOURS', 24))
+# Codec for Parquet and Arrow IPC exports
+EXPORT_COLUMNAR_COMPRESSION = os.environ.get('EXPORT_COLUMNAR_COMPRESSION', 'zstd')
+# Identical exports of a window that includes live data are reused for this long
+EXPORT_LIVE_REUSE_SECONDS = int(os.environ.get('EXPORT_LIVE_REUSE_SECONDS', 60))
+# Hand export downloads to the front proxy: '' (serve from Django), 'x-accel-redirect' (nginx)
+# or 'x-sendfile' (Apache/lighttpd). For nginx, map the prefix to EXPORT_ROOT in an internal location.
+EXPORT_SENDFILE_MODE = os.environ.get('EXPORT_SENDFILE_MODE', '')
+EXPORT_ACCEL_REDIRECT_PREFIX = os.environ.get('EXPORT_ACCEL_REDIRECT_PREFIX', '/protected-exports/')
+# cleanup_exports evicts the least recently downloaded exports once EXPORT_ROOT exceeds this (0 = no limit)
+EXPORT_DISK_BUDGET_BYTES = int(os.environ.get('EXPORT_DISK_BUDGET_BYTES', 0))
 
 # Create the export directory if it doesn't exist
 os.makedirs(EXPORT_ROOT, exist_ok=True)